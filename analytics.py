@@ -0,0 +1,374 @@
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import duckdb
+import pyarrow as pa
+import pyarrow.parquet as pq
+from mysql.connector import Error
+
+import database
+import farms
+
+# Columnar snapshot of the fact tables for the analytical views. Each shard's rows are copied
+# into Parquet parts under FARM_ANALYTICS_DIR/<shard>/<table>/ and queried with embedded DuckDB,
+# so heavy aggregations scan columns locally instead of loading MySQL. The copy is incremental:
+# each refresh appends a part holding the rows whose updated_at passed the table's watermark,
+# and the views keep the newest copy of each row. Parts are compacted once they pile up, and a
+# table that lost rows is copied in full. Rows leave the fact tables only through archive.py,
+# which marks the tables it moves rows out of; deletes made outside the app are caught when a
+# table is due for compaction, by comparing the count and sum of the keys the snapshot holds
+# with MySQL's. That scan covers the whole table, so it is not run on every refresh.
+SNAPSHOT_DIR = os.environ.get("FARM_ANALYTICS_DIR")
+INTERVAL = float(os.environ.get("FARM_ANALYTICS_INTERVAL", "300"))
+# Rows are re-read this far behind the watermark, to catch transactions that committed late or
+# reached a replica after the last refresh
+OVERLAP = timedelta(seconds=float(os.environ.get("FARM_ANALYTICS_OVERLAP", "300")))
+MAX_PARTS = int(os.environ.get("FARM_ANALYTICS_MAX_PARTS", "24"))
+FETCH_ROWS = 10000
+
+# table -> (primary key, {column: type}); the Parquet types are fixed so every part agrees
+FACT_TABLES = {
+    "Feed_Record": ("feed_id", {
+        "feed_id": pa.int32(), "farm_id": pa.int32(), "animal_id": pa.int32(), "date": pa.date32(),
+        "feed_type": pa.string(), "quantity_kg": pa.float64(), "cost": pa.float64(),
+        "updated_at": pa.timestamp("us")}),
+    "Medicine_Record": ("medicine_id", {
+        "medicine_id": pa.int32(), "farm_id": pa.int32(), "animal_id": pa.int32(), "date": pa.date32(),
+        "medicine_name": pa.string(), "quantity": pa.string(), "cost": pa.float64(),
+        "remarks": pa.string(), "updated_at": pa.timestamp("us")}),
+    "Monthly_Weight": ("weight_id", {
+        "weight_id": pa.int32(), "farm_id": pa.int32(), "animal_id": pa.int32(), "month": pa.date32(),
+        "weight_kg": pa.float64(), "updated_at": pa.timestamp("us")}),
+    "Utility_Bill": ("bill_id", {
+        "bill_id": pa.int32(), "farm_id": pa.int32(), "month": pa.date32(), "type": pa.string(),
+        "amount": pa.float64(), "updated_at": pa.timestamp("us")}),
+    "Expense_Summary": ("expense_id", {
+        "expense_id": pa.int32(), "farm_id": pa.int32(), "month": pa.date32(),
+        "total_feed_cost": pa.float64(), "total_medicine_cost": pa.float64(),
+        "total_salaries": pa.float64(), "total_utilities": pa.float64(),
+        "other_expenses": pa.float64(), "total_expense": pa.float64(), "updated_at": pa.timestamp("us")}),
+}
+
+# DuckDB column types of the Parquet types, for the empty view of a table without parts
+DUCKDB_TYPES = {pa.int32(): "INTEGER", pa.float64(): "DOUBLE", pa.string(): "VARCHAR",
+                pa.date32(): "DATE", pa.timestamp("us"): "TIMESTAMP"}
+
+logger = logging.getLogger("farm.analytics")
+
+# One refresh at a time per process; readers never wait on it
+_refresh_lock = threading.Lock()
+
+
+class SnapshotUnavailable(Exception):
+    pass
+
+
+def enabled():
+    return bool(SNAPSHOT_DIR)
+
+
+def _shard_dir(shard):
+    return os.path.join(SNAPSHOT_DIR, shard)
+
+
+def _table_dir(shard, table):
+    return os.path.join(_shard_dir(shard), table)
+
+
+def _state_path(shard):
+    return os.path.join(_shard_dir(shard), "state.json")
+
+
+def load_state(shard):
+    try:
+        with open(_state_path(shard)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _save_state(shard, state):
+    path = _state_path(shard)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _parts(shard, table):
+    directory = _table_dir(shard, table)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".parquet"))
+
+
+def _part_path(shard, table, number):
+    return os.path.join(_table_dir(shard, table), f"part-{number:06d}.parquet")
+
+
+# Newest copy of each row across a table's parts; parts sort by number, so the last one wins
+def _view_sql(shard, table):
+    key = FACT_TABLES[table][0]
+    pattern = os.path.join(_table_dir(shard, table), "*.parquet").replace("'", "''")
+    return f"""
+        SELECT * EXCLUDE (filename, _rank) FROM (
+            SELECT *, row_number() OVER (PARTITION BY {key} ORDER BY filename DESC) AS _rank
+            FROM read_parquet('{pattern}', filename = true)
+        ) WHERE _rank = 1
+    """
+
+
+# A table without parts (never copied, or emptied) still has its columns, just no rows
+def _empty_view_sql(table):
+    columns = ", ".join(f"CAST(NULL AS {DUCKDB_TYPES[kind]}) AS {column}"
+                        for column, kind in FACT_TABLES[table][1].items())
+    return f"SELECT {columns} WHERE false"
+
+
+# An in-memory DuckDB connection with a view per fact table of the shard
+def _open(shard):
+    connection = duckdb.connect()
+    for table in FACT_TABLES:
+        view = _view_sql(shard, table) if _parts(shard, table) else _empty_view_sql(table)
+        connection.execute(f"CREATE VIEW {table} AS {view}")
+    return connection
+
+
+# Copy MySQL rows into a new part, streaming them in row groups; returns (rows, latest updated_at)
+def _copy_rows(cursor, table, path, since):
+    columns = FACT_TABLES[table][1]
+    schema = pa.schema(list(columns.items()))
+    where, params = ("WHERE updated_at >= %s", (since,)) if since else ("", ())
+    cursor.execute(f"SELECT {', '.join(columns)} FROM {table} {where}", params)
+    rows, latest, writer = 0, None, None
+    try:
+        while True:
+            chunk = cursor.fetchmany(FETCH_ROWS)
+            if not chunk:
+                break
+            if writer is None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                writer = pq.ParquetWriter(path + ".tmp", schema)
+            batch = pa.RecordBatch.from_arrays([pa.array(values, type=schema.field(i).type)
+                                                for i, values in enumerate(zip(*chunk))], schema=schema)
+            writer.write_batch(batch)
+            rows += len(chunk)
+            latest = max([row[-1] for row in chunk if row[-1] is not None] + ([latest] if latest else []),
+                         default=None)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        os.replace(path + ".tmp", path)
+    return rows, latest
+
+
+# (rows, highest key, sum of keys) of a table's snapshot
+def _snapshot_keys(shard, table):
+    if not _parts(shard, table):
+        return 0, None, 0
+    key = FACT_TABLES[table][0]
+    connection = duckdb.connect()
+    try:
+        return connection.execute(
+            f"SELECT COUNT(*), MAX({key}), COALESCE(SUM({key}), 0) FROM ({_view_sql(shard, table)})").fetchone()
+    finally:
+        connection.close()
+
+
+# Whether rows the snapshot holds were deleted from MySQL. New rows get higher keys, so the live
+# rows up to the snapshot's highest key must have the same count and key sum unless some are gone.
+def _rows_deleted(cursor, shard, table):
+    rows, highest, total = _snapshot_keys(shard, table)
+    if not rows:
+        return False
+    key = FACT_TABLES[table][0]
+    cursor.execute(f"SELECT COUNT(*), COALESCE(SUM({key}), 0) FROM {table} WHERE {key} <= %s", (highest,))
+    live_rows, live_total = cursor.fetchone()
+    return (live_rows, int(live_total)) != (rows, int(total))
+
+
+def _full_marker(shard, table):
+    return os.path.join(_shard_dir(shard), f"{table}.full")
+
+
+# Have the next refresh copy the tables in full, e.g. after rows were moved out of them
+def mark_full(shard, tables):
+    if not enabled():
+        return
+    os.makedirs(_shard_dir(shard), exist_ok=True)
+    for table in tables:
+        if table in FACT_TABLES:
+            with open(_full_marker(shard, table), "w"):
+                pass
+
+
+# Rewrite a table's parts as one part numbered after them, then drop the old ones
+def _compact(shard, table, number):
+    old_parts = _parts(shard, table)
+    path = _part_path(shard, table, number)
+    connection = duckdb.connect()
+    try:
+        connection.execute(f"COPY ({_view_sql(shard, table)}) TO '{path}.tmp' (FORMAT parquet)")
+    finally:
+        connection.close()
+    os.replace(path + ".tmp", path)
+    for part in old_parts:
+        os.remove(part)
+
+
+def _refresh_table(cursor, shard, table, table_state, full):
+    number = table_state.get("next_part", 1)
+    # The marker goes before the copy starts, so rows moved out during the copy mark it again
+    marker = _full_marker(shard, table)
+    if os.path.exists(marker):
+        os.remove(marker)
+        full = True
+    if not full and table_state.get("watermark") and len(_parts(shard, table)) >= MAX_PARTS:
+        full = _rows_deleted(cursor, shard, table)
+    since = None if full else table_state.get("watermark")
+    if since:
+        since = datetime.fromisoformat(since) - OVERLAP
+    old_parts = _parts(shard, table)
+
+    rows, latest = _copy_rows(cursor, table, _part_path(shard, table, number), since)
+    if rows:
+        number += 1
+    if full:
+        # The new part holds every row; an empty table leaves no part at all
+        for part in old_parts:
+            os.remove(part)
+    elif len(_parts(shard, table)) > MAX_PARTS:
+        _compact(shard, table, number)
+        number += 1
+
+    if latest is not None and (full or latest.isoformat() > table_state.get("watermark", "")):
+        table_state["watermark"] = latest.isoformat()
+    elif full:
+        table_state.pop("watermark", None)
+    table_state["next_part"] = number
+    table_state["refreshed_at"] = datetime.now().replace(microsecond=0).isoformat()
+    return rows
+
+
+# Bring one shard's snapshot up to date; returns rows copied per table
+def refresh(shard, full=False):
+    with _refresh_lock:
+        state = load_state(shard)
+        os.makedirs(_shard_dir(shard), exist_ok=True)
+        connection = database.open_connection(shard)
+        try:
+            cursor = connection.cursor()
+            try:
+                copied = {}
+                for table in FACT_TABLES:
+                    copied[table] = _refresh_table(cursor, shard, table, state.setdefault(table, {}), full)
+                    _save_state(shard, state)
+                return copied
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+
+
+# Start the shard's snapshot over, e.g. after a restore
+def rebuild(shard):
+    with _refresh_lock:
+        shutil.rmtree(_shard_dir(shard), ignore_errors=True)
+    return refresh(shard, full=True)
+
+
+# When the shard's snapshot last caught up, or None if it has never been built
+def refreshed_at(shard):
+    times = [table_state.get("refreshed_at") for table_state in load_state(shard).values()]
+    if not times or None in times:
+        return None
+    return datetime.fromisoformat(min(times))
+
+
+# Run an analytical query against a shard's snapshot and return a DataFrame. Parts replaced by a
+# concurrent refresh can vanish mid-query, so a failed query is retried once on fresh views; a
+# query DuckDB cannot answer counts as the snapshot being unavailable.
+def query(sql, params=None, shard=None):
+    shard = shard or database.current_shard()
+    if not enabled() or refreshed_at(shard) is None:
+        raise SnapshotUnavailable(f"No analytics snapshot for shard {shard}")
+    for attempt in range(2):
+        connection = _open(shard)
+        try:
+            return connection.execute(sql, params or []).df()
+        except duckdb.IOException as e:
+            if attempt:
+                raise SnapshotUnavailable(f"Analytics snapshot of shard {shard} could not be read: {e}") from e
+        except duckdb.Error as e:
+            raise SnapshotUnavailable(f"Analytics query on shard {shard} failed: {e}") from e
+        finally:
+            connection.close()
+
+
+# Recorded feed, medicine and utility costs per month, from the individual records
+def monthly_costs(farm_id, shard=None):
+    return query("""
+        WITH feed AS (
+            SELECT date_trunc('month', date) AS month, SUM(cost) AS feed_cost, SUM(quantity_kg) AS feed_kg
+            FROM Feed_Record WHERE farm_id = $farm GROUP BY 1
+        ), medicine AS (
+            SELECT date_trunc('month', date) AS month, SUM(cost) AS medicine_cost
+            FROM Medicine_Record WHERE farm_id = $farm GROUP BY 1
+        ), utilities AS (
+            SELECT date_trunc('month', month) AS month, SUM(amount) AS utility_cost
+            FROM Utility_Bill WHERE farm_id = $farm GROUP BY 1
+        )
+        SELECT month, COALESCE(feed_cost, 0) AS feed_cost, COALESCE(feed_kg, 0) AS feed_kg,
+               COALESCE(medicine_cost, 0) AS medicine_cost, COALESCE(utility_cost, 0) AS utility_cost
+        FROM feed FULL OUTER JOIN medicine USING (month) FULL OUTER JOIN utilities USING (month)
+        WHERE month IS NOT NULL
+        ORDER BY month
+    """, {'farm': farm_id}, shard)
+
+
+# Herd weight distribution per month: animals weighed, mean and the 10th/50th/90th percentiles
+def herd_weights(farm_id, start, end, shard=None):
+    return query("""
+        SELECT month, COUNT(DISTINCT animal_id) AS animals, AVG(weight_kg) AS mean_kg,
+               quantile_cont(weight_kg, 0.1) AS p10_kg, median(weight_kg) AS median_kg,
+               quantile_cont(weight_kg, 0.9) AS p90_kg
+        FROM Monthly_Weight
+        WHERE farm_id = $farm AND month BETWEEN $start AND $end
+        GROUP BY month
+        ORDER BY month
+    """, {'farm': farm_id, 'start': start, 'end': end}, shard)
+
+
+def _maintain(shard):
+    copied = refresh(shard)
+    if any(copied.values()):
+        logger.info("Analytics snapshot of shard %s: copied %s", shard, copied)
+
+
+# Background thread that keeps every shard's snapshot current; started once per process
+def start_maintainer(interval=INTERVAL):
+    return database.start_maintainer("analytics-snapshot", _maintain, interval, logger, "Analytics snapshot",
+                                     errors=(Error, OSError))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the columnar analytics snapshot.")
+    parser.add_argument("--shard", nargs="*", default=list(farms.SHARDS), choices=list(farms.SHARDS))
+    parser.add_argument("--rebuild", action="store_true", help="discard the snapshot and copy everything")
+    args = parser.parse_args(argv)
+    if not enabled():
+        raise SystemExit("Set FARM_ANALYTICS_DIR to the snapshot directory")
+    for shard in args.shard:
+        copied = rebuild(shard) if args.rebuild else refresh(shard)
+        print(f"{shard}: " + ", ".join(f"{table} {rows:,}" for table, rows in copied.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
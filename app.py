@@ -1,128 +1,34 @@
-import mysql.connector
 from mysql.connector import Error
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
 import plotly.express as px
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
 import os
 from PIL import Image
 import io
-
-# Database connection function
-def create_connection():
-    try:
-        connection = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="1713$",
-            database="farm_v5"
-        )
-        return connection
-    except Error as e:
-        st.error(f"Error connecting to MySQL: {e}")
-        return None
-
-# Initialize database schema
-def init_database():
-    connection = create_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            cursor.execute("""
-                CREATE DATABASE IF NOT EXISTS farm;
-            """)
-            cursor.execute("USE farm;")
-            
-            # Create tables
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS Animal_Category (
-                    category_id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(100) UNIQUE,
-                    description TEXT,
-                    image LONGBLOB
-                );
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS Animal (
-                    animal_id INT AUTO_INCREMENT PRIMARY KEY,
-                    tag_number VARCHAR(50) UNIQUE,
-                    category_id INT,
-                    breed VARCHAR(100),
-                    arrival_date DATE,
-                    initial_weight_kg FLOAT,
-                    image LONGBLOB,
-                    FOREIGN KEY (category_id) REFERENCES Animal_Category(category_id)
-                );
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS Staff (
-                    staff_id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(100),
-                    role VARCHAR(100),
-                    salary_per_month FLOAT,
-                    image LONGBLOB
-                );
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS Expense_Summary (
-                    expense_id INT AUTO_INCREMENT PRIMARY KEY,
-                    month DATE,
-                    total_feed_cost FLOAT,
-                    total_medicine_cost FLOAT,
-                    total_salaries FLOAT,
-                    total_utilities FLOAT,
-                    other_expenses FLOAT,
-                    total_expense FLOAT
-                );
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS Monthly_Weight (
-                    weight_id INT AUTO_INCREMENT PRIMARY KEY,
-                    animal_id INT,
-                    month DATE,
-                    weight_kg FLOAT,
-                    FOREIGN KEY (animal_id) REFERENCES Animal(animal_id)
-                );
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS Feed_Record (
-                    feed_id INT AUTO_INCREMENT PRIMARY KEY,
-                    animal_id INT,
-                    date DATE,
-                    feed_type VARCHAR(100),
-                    quantity_kg FLOAT,
-                    cost FLOAT,
-                    FOREIGN KEY (animal_id) REFERENCES Animal(animal_id)
-                );
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS Medicine_Record (
-                    medicine_id INT AUTO_INCREMENT PRIMARY KEY,
-                    animal_id INT,
-                    date DATE,
-                    medicine_name VARCHAR(100),
-                    quantity VARCHAR(50),
-                    cost FLOAT,
-                    remarks TEXT,
-                    FOREIGN KEY (animal_id) REFERENCES Animal(animal_id)
-                );
-            """)
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS Utility_Bill (
-                    bill_id INT AUTO_INCREMENT PRIMARY KEY,
-                    month DATE,
-                    type VARCHAR(50),
-                    amount FLOAT
-                );
-            """)
-            connection.commit()
-        except Error as e:
-            st.error(f"Error initializing database: {e}")
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
+import hashlib
+import functools
+import math
+import threading
+from collections import OrderedDict
+import analytics
+import archive
+import farms
+import forecast
+import frames
+import gallery
+import health
+import image_server
+import images
+import ingest_server
+import instrumentation
+import metrics
+import rollups
+import write_queue
+from database import (create_connection, current_farm, current_shard, fan_out, fetch_stored_image, init_database,
+                      note_session_write, open_connection, run_queries, shard_config)
 
 # Page configuration
 st.set_page_config(
@@ -206,172 +112,623 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Helper function to display images from binary data
-def display_image(binary_data):
-    if binary_data:
+# LRU caches keyed by content hash. This script runs afresh on every rerun, so each cache is a
+# resource created once per process and shared, with its lock, by every session thread.
+IMAGE_CACHE_SIZE = int(os.environ.get("FARM_IMAGE_CACHE_SIZE", "128"))
+
+@st.cache_resource
+def image_cache(name):
+    return OrderedDict(), threading.Lock()
+
+# Decoded images keyed by content hash
+def decode_image(binary_data):
+    key = hashlib.blake2b(binary_data, digest_size=16).digest()
+    decoded, lock = image_cache("decoded_images")
+    with lock:
+        image = decoded.get(key)
+        if image is not None:
+            decoded.move_to_end(key)
+    metrics.count_cache("decoded_images", image is not None)
+    if image is None:
         image = Image.open(io.BytesIO(binary_data))
-        st.image(image, use_column_width=True)
+        image.load()
+        with lock:
+            decoded[key] = image
+            while len(decoded) > IMAGE_CACHE_SIZE:
+                decoded.popitem(last=False)
+    return image
+
+# Image bytes from the shared store keyed by content hash; only a miss reads the database
+def stored_image(image_hash):
+    stored, lock = image_cache("stored_images")
+    with lock:
+        data = stored.get(image_hash)
+        if data is not None:
+            stored.move_to_end(image_hash)
+    metrics.count_cache("stored_images", data is not None)
+    if data is None:
+        data = fetch_stored_image(image_hash, current_shard())
+        if data is not None:
+            with lock:
+                stored[image_hash] = data
+                while len(stored) > IMAGE_CACHE_SIZE:
+                    stored.popitem(last=False)
+    return data
+
+# Card photo, or a placeholder while a new upload is still being processed
+def display_card_image(row):
+    if row.get('image_job'):
+        st.markdown('<div class="image-preview">🖼️ Processing photo…</div>', unsafe_allow_html=True)
+    elif row.get('image_hash') and IMAGE_BASE_URL:
+        # A stable URL lets the browser cache the photo instead of receiving it on every rerun
+        st.markdown(f'<img src="{card_image_url(row)}" loading="lazy" '
+                    f'style="width:100%; border-radius:8px;">', unsafe_allow_html=True)
+    elif row.get('image_hash'):
+        display_image(stored_image(row['image_hash']))
+    elif row['image']:
+        display_image(row['image'])
+
+# Address of a stored photo on the image server, if it is running; other shards than the default
+# are named in the query string
+def card_image_url(row):
+    if IMAGE_BASE_URL and row.get('image_hash'):
+        shard = current_shard()
+        if shard == farms.DEFAULT_SHARD:
+            return f"{IMAGE_BASE_URL}/images/{row['image_hash']}"
+        return f"{IMAGE_BASE_URL}/images/{row['image_hash']}?shard={shard}"
+    return None
+
+# The virtualized gallery needs every photo at a URL; rows still holding inline blobs use the grid
+def use_gallery(rows):
+    return IMAGE_BASE_URL and not any(row['image'] for row in rows)
+
+# Insert a barn-side record directly, or journal it when MySQL is down or slow; the sync thread
+# copies journaled records later. The session keeps their keys so a later rerun can report the
+# ones the database rejects. Returns False if the database refused the record.
+def save_record(table, values, label):
+    try:
+        key, queued = write_queue.save(
+            lambda: open_connection(connection_timeout=write_queue.DIRECT_TIMEOUT), table, values, farm_id)
+    except Error as e:
+        st.error(f"Error saving {label.lower()}: {e}")
+        return False
+    note_session_write()
+    if queued:
+        st.session_state.setdefault('queued_writes', {})[key] = label
+        st.success(f"{label} saved; it will sync to the database in the background.")
     else:
-        st.warning("No image available")
+        st.success(f"{label} added successfully!")
+    return True
+
+# Errors for this session's records the database rejected; written and parked ones are forgotten
+def report_rejected_writes():
+    queued = st.session_state.get('queued_writes')
+    if not queued:
+        return
+    journal = write_queue.status(list(queued))
+    for key, label in list(queued.items()):
+        attempts, error = journal.get(key, (None, None))
+        if attempts is None:
+            del queued[key]
+        elif attempts >= write_queue.MAX_ATTEMPTS:
+            st.error(f"{label} was rejected by the database and set aside: {error}")
+            del queued[key]
+        elif attempts:
+            st.error(f"{label} was rejected by the database and will be retried: {error}")
+
+# Hand an uploaded photo to the background image workers once its row is committed
+def queue_image(table, key, job, upload):
+    if job:
+        images.submit(shard_config(current_shard()), table, key, job, upload.getvalue())
+
+# Helper function to display images from binary data
+def display_image(binary_data):
+    with instrumentation.timed("display_image"):
+        if binary_data:
+            st.image(decode_image(binary_data), use_column_width=True)
+            metrics.IMAGE_BYTES.inc(len(binary_data))
+        else:
+            st.warning("No image available")
+
+# Subheader that also starts a new timed render section
+def section_header(title):
+    instrumentation.section(title)
+    st.subheader(title)
+
+# True when any of the given show_* form flags is set
+def form_open(*flags):
+    return any(st.session_state.get(flag, False) for flag in flags)
+
+# Hide a form right away; outside a fragment rerun this falls back to a full rerun
+def close_form(flag):
+    st.session_state[flag] = False
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+# Sort and page controls for a table paged in SQL; returns (ORDER BY clause, LIMIT, OFFSET).
+# sort_columns maps a label to a SQL expression, so only whitelisted columns reach the query;
+# the row's primary key breaks ties so pages never overlap.
+PAGE_SIZES = (25, 50, 100, 200)
+
+def table_pager(key, total_rows, sort_columns, key_column):
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        sort_label = st.selectbox("Sort by", options=list(sort_columns), key=f"{key}_sort")
+    with col2:
+        descending = st.toggle("Descending", value=True, key=f"{key}_descending")
+    with col3:
+        page_size = st.selectbox("Rows per page", options=PAGE_SIZES, index=1, key=f"{key}_page_size")
+    pages = max(1, math.ceil(total_rows / page_size))
+    # Narrower filters can leave the remembered page past the end
+    if st.session_state.get(f"{key}_page", 1) > pages:
+        st.session_state[f"{key}_page"] = pages
+    with col4:
+        page_number = st.number_input("Page", min_value=1, max_value=pages, key=f"{key}_page")
+    st.caption(f"{total_rows:,} records, page {page_number} of {pages}")
+    direction = "DESC" if descending else "ASC"
+    return (f"{sort_columns[sort_label]} {direction}, {key_column} {direction}",
+            page_size, (page_number - 1) * page_size)
+
+FEED_SORT_COLUMNS = {"Date": "fr.date", "Feed type": "fr.feed_type", "Quantity": "fr.quantity_kg",
+                     "Cost": "fr.cost", "Tag": "a.tag_number"}
+MEDICAL_SORT_COLUMNS = {"Date": "mr.date", "Medicine": "mr.medicine_name", "Cost": "mr.cost",
+                        "Tag": "a.tag_number"}
+FORECAST_SORT_COLUMNS = {"Projected weight": "projected_kg", "Daily gain": "wf.gain_kg_per_day",
+                         "Last weighed": "wf.anchor_month", "Tag": "a.tag_number"}
+
+# Fragment that is instrumented as its own rerun when it runs without the rest of the page
+def page_fragment(func):
+    @functools.wraps(func)
+    def run(*args, **kwargs):
+        if instrumentation.current_rerun() is not None:
+            return func(*args, **kwargs)
+        instrumentation.start_rerun(f"{page} / {func.__name__}")
+        try:
+            return func(*args, **kwargs)
+        finally:
+            instrumentation.finish_rerun()
+    return st.fragment(run)
+
+# Sidebar panel with timings for this rerun and rolling per-page percentiles
+def render_perf_panel(rerun):
+    with st.sidebar.expander("Performance", expanded=True):
+        st.metric("Rerun", f"{rerun.total_ms:,.0f} ms")
+        st.metric("SQL", f"{len(rerun.queries)} queries / {rerun.query_ms:,.0f} ms")
+        st.caption(f"{rerun.rows:,} rows, {rerun.bytes:,} bytes fetched")
+        
+        if rerun.queries:
+            st.markdown("**Queries**")
+            queries = pd.DataFrame(rerun.queries)[['sql', 'params', 'duration_ms', 'rows', 'bytes']]
+            st.dataframe(queries.sort_values('duration_ms', ascending=False), use_container_width=True)
+        
+        if rerun.sections:
+            st.markdown("**Sections**")
+            sections = pd.DataFrame(rerun.sections).groupby('section', sort=False)['duration_ms'].agg(['count', 'sum'])
+            st.dataframe(sections, use_container_width=True)
+        
+        st.markdown("**Pages (rolling)**")
+        st.dataframe(pd.DataFrame(instrumentation.page_summary()), use_container_width=True)
+
+# Start the Prometheus exporter once per server process when a port is configured
+@st.cache_resource
+def start_metrics_exporter(port):
+    return metrics.start_http_server(port, host=os.environ.get("FARM_METRICS_HOST", "127.0.0.1"))
+
+if os.environ.get("FARM_METRICS_PORT"):
+    start_metrics_exporter(int(os.environ["FARM_METRICS_PORT"]))
+
+# Serve stored images over HTTP when a port is configured; FARM_IMAGE_BASE_URL is the address
+# browsers use to reach it, e.g. through the same reverse proxy as the app
+@st.cache_resource
+def start_image_server(port):
+    return image_server.start_http_server(port, host=os.environ.get("FARM_IMAGE_HOST", "127.0.0.1"))
+
+IMAGE_BASE_URL = None
+if os.environ.get("FARM_IMAGE_PORT"):
+    start_image_server(int(os.environ["FARM_IMAGE_PORT"]))
+    IMAGE_BASE_URL = os.environ.get("FARM_IMAGE_BASE_URL",
+                                    f"http://localhost:{os.environ['FARM_IMAGE_PORT']}").rstrip("/")
+
+# Accept scale and RFID readings over HTTP alongside the app when a port is configured
+@st.cache_resource
+def start_ingest_server(port):
+    return ingest_server.start_http_server(port, host=os.environ.get("FARM_INGEST_HOST", "127.0.0.1"))
+
+if os.environ.get("FARM_INGEST_PORT"):
+    start_ingest_server(int(os.environ["FARM_INGEST_PORT"]))
+
+# Sync queued barn-side records to MySQL from one thread per server process
+@st.cache_resource
+def start_write_flusher():
+    return write_queue.start_flusher(lambda shard: open_connection(shard, connection_timeout=5))
+
+start_write_flusher()
+
+# Keep the columnar analytics snapshot current when FARM_ANALYTICS_DIR is set
+@st.cache_resource
+def start_analytics_snapshot():
+    return analytics.start_maintainer()
+
+if analytics.enabled():
+    start_analytics_snapshot()
+
+# Keep the weight reading and finance rollups current from one thread per server process
+@st.cache_resource
+def start_rollups():
+    return rollups.start_maintainer()
+
+start_rollups()
+
+# Keep the herd health scores current from one thread per server process
+@st.cache_resource
+def start_health_monitor():
+    return health.start_maintainer()
+
+start_health_monitor()
+
+# Keep the weight and expense forecasts current from one thread per server process
+@st.cache_resource
+def start_forecasts():
+    return forecast.start_maintainer()
+
+start_forecasts()
 
 # Sidebar navigation
 st.sidebar.title("🐄 Farm Management")
-page = st.sidebar.radio("Navigation", [
+
+# Page data kept for the action fragments; it belongs to one farm
+FARM_VIEW_STATE = ('animal_list', 'animal_category_options', 'weight_animal_options', 'weight_records_view',
+                   'feed_animal_options', 'feed_records_view', 'medical_animal_options', 'medical_records_view',
+                   'timeline_animal', 'timeline_cursors')
+
+def switch_farm():
+    for key in FARM_VIEW_STATE:
+        st.session_state.pop(key, None)
+
+# Farm switcher; every page shows and edits the selected farm's records
+if len(farms.FARMS) > 1:
+    st.sidebar.selectbox("Farm", list(farms.FARMS), format_func=lambda f: farms.FARMS[f].name,
+                         key='farm_id', on_change=switch_farm)
+farm_id = current_farm()
+
+pages = [
     "Dashboard",
     "Animal Categories",
     "Animal Records",
     "Weight Tracking",
     "Feed Records",
     "Medical Records",
+    "Animal Timeline",
+    "Cohort Analytics",
+    "Forecasts",
     "Staff Management",
     "Financial Overview"
-])
+]
+if len(farms.FARMS) > 1:
+    pages.append("Farm Comparison")
+page = st.sidebar.radio("Navigation", pages)
+show_perf_panel = st.sidebar.checkbox("🔧 Performance panel",
+                                      value=os.environ.get("FARM_PERF_PANEL") == "1")
 
-# Initialize database
-init_database()
+# Records entered while MySQL was unreachable
+queued_records, parked_records = write_queue.backlog()
+if queued_records:
+    st.sidebar.warning(f"📡 {queued_records} record(s) waiting to sync")
+if parked_records:
+    st.sidebar.error(f"⚠️ {parked_records} queued record(s) were rejected by the database")
+    if st.sidebar.button("Retry rejected records"):
+        write_queue.requeue_parked()
+report_rejected_writes()
+
+instrumentation.start_rerun(page)
+
+# Initialize every shard's schema once per server process instead of on every rerun
+@st.cache_resource
+def ensure_schema():
+    for shard in farms.SHARDS:
+        if not init_database(shard):
+            raise RuntimeError(f"Database schema of shard {shard} could not be initialized")
+    return True
+
+instrumentation.section("init_database")
+try:
+    ensure_schema()
+except RuntimeError:
+    pass
+instrumentation.section(page)
 
 # Dashboard Page
 if page == "Dashboard":
     st.title("Farm Dashboard")
     
-    connection = create_connection()
-    
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get animal count
-            cursor.execute("SELECT COUNT(*) as count FROM Animal")
-            animal_count = cursor.fetchone()['count'] if cursor.rowcount > 0 else 0
-            
-            # Get staff count
-            cursor.execute("SELECT COUNT(*) as count FROM Staff")
-            staff_count = cursor.fetchone()['count'] if cursor.rowcount > 0 else 0
-            
-            # Get total expenses
-            cursor.execute("SELECT SUM(total_expense) as total FROM Expense_Summary")
-            total_expenses = cursor.fetchone()['total'] if cursor.rowcount > 0 and cursor.fetchone()['total'] else 0.0
-            
-            # Get average weight gain
-            cursor.execute("""
+    try:
+        # The dashboard's reads are independent, so they run side by side
+        results = run_queries({
+            'animal_count': ("SELECT COUNT(*) as count FROM Animal WHERE farm_id = %s AND status = 'active'",
+                             (farm_id,)),
+            'staff_count': ("SELECT COUNT(*) as count FROM Staff WHERE farm_id = %s", (farm_id,)),
+            'total_expenses': ("SELECT SUM(total_expense) as total FROM Expense_Summary WHERE farm_id = %s",
+                               (farm_id,)),
+            'avg_gain': ("""
                 SELECT AVG(mw.weight_kg - a.initial_weight_kg) as avg_gain 
                 FROM Monthly_Weight mw
                 JOIN Animal a ON mw.animal_id = a.animal_id
-                WHERE mw.month = (SELECT MAX(month) FROM Monthly_Weight)
-            """)
-            avg_gain = cursor.fetchone()['avg_gain'] if cursor.rowcount > 0 and cursor.fetchone()['avg_gain'] else 0.0
-            
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.markdown(f"""
-                <div class="metric-card">
-                    <h3>Animals</h3>
-                    <h1>{animal_count}</h1>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col2:
-                st.markdown(f"""
-                <div class="metric-card">
-                    <h3>Staff</h3>
-                    <h1>{staff_count}</h1>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col3:
-                st.markdown(f"""
-                <div class="metric-card">
-                    <h3>Monthly Expenses</h3>
-                    <h1>${total_expenses:,.2f}</h1>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            with col4:
-                st.markdown(f"""
-                <div class="metric-card">
-                    <h3>Avg Weight Gain</h3>
-                    <h1>{avg_gain:.2f} kg</h1>
-                </div>
-                """, unsafe_allow_html=True)
-            
-            # Weight gain chart
-            st.subheader("Animal Weight Progress")
-            cursor.execute("""
+                WHERE mw.farm_id = %s AND a.status = 'active'
+                  AND mw.month = (SELECT MAX(month) FROM Monthly_Weight WHERE farm_id = %s)
+            """, (farm_id, farm_id)),
+            'weight_data': ("""
                 SELECT a.tag_number, a.breed, a.initial_weight_kg, mw.weight_kg, 
                        mw.weight_kg - a.initial_weight_kg as weight_gain
                 FROM Animal a
                 JOIN Monthly_Weight mw ON a.animal_id = mw.animal_id
-                WHERE mw.month = (SELECT MAX(month) FROM Monthly_Weight)
-            """)
-            weight_data = pd.DataFrame(cursor.fetchall())
-            
-            if not weight_data.empty:
-                fig = px.bar(weight_data, x='tag_number', y='weight_gain',
-                             color='breed', text='weight_gain',
-                             title="Weight Gain by Animal")
-                fig.update_traces(texttemplate='%{text:.2f}kg', textposition='outside')
-                st.plotly_chart(fig, use_container_width=True)
-            
-            # Expense breakdown
-            st.subheader("Monthly Expense Breakdown")
-            cursor.execute("""
+                WHERE mw.farm_id = %s AND a.status = 'active'
+                  AND mw.month = (SELECT MAX(month) FROM Monthly_Weight WHERE farm_id = %s)
+            """, (farm_id, farm_id)),
+            'expense_data': ("""
                 SELECT month, total_feed_cost, total_medicine_cost, 
                        total_salaries, total_utilities, other_expenses
                 FROM Expense_Summary
+                WHERE farm_id = %s
                 ORDER BY month DESC
                 LIMIT 5
-            """)
-            expense_data = pd.DataFrame(cursor.fetchall())
-            
-            if not expense_data.empty:
-                # Convert month to string if not datetime
-                if not pd.api.types.is_datetime64_any_dtype(expense_data['month']):
-                    expense_data['month'] = pd.to_datetime(expense_data['month']).dt.strftime('%Y-%m')
-                else:
-                    expense_data['month'] = expense_data['month'].dt.strftime('%Y-%m')
-                fig = px.bar(expense_data, x='month',
-                            y=['total_feed_cost', 'total_medicine_cost',
-                               'total_salaries', 'total_utilities', 'other_expenses'],
-                            title="Expense Breakdown by Category",
-                            labels={'value': 'Amount ($)', 'variable': 'Category'})
-                st.plotly_chart(fig, use_container_width=True)
-            
-            # Recent Animals
-            st.subheader("Recent Animals")
-            cursor.execute("""
+            """, (farm_id,), frames.EXPENSE_KINDS),
+            'recent_animals': ("""
                 SELECT a.*, ac.name as category_name 
                 FROM Animal a
                 LEFT JOIN Animal_Category ac ON a.category_id = ac.category_id
+                WHERE a.farm_id = %s AND a.status = 'active'
                 ORDER BY a.arrival_date DESC
                 LIMIT 4
-            """)
-            recent_animals = cursor.fetchall()
-            
-            if recent_animals:
-                cols = st.columns(4)
-                for idx, animal in enumerate(recent_animals):
-                    with cols[idx % 4]:
-                        st.markdown(f"""
-                            <div class="animal-card">
-                                <h4>{animal['tag_number']}</h4>
-                                <p><strong>Breed:</strong> {animal['breed']}</p>
-                                <p><strong>Category:</strong> {animal['category_name'] or 'N/A'}</p>
-                                <p><strong>Arrival:</strong> {animal['arrival_date']}</p>
-                        """, unsafe_allow_html=True)
-                        if animal['image']:
-                            display_image(animal['image'])
-                        st.markdown("</div>", unsafe_allow_html=True)
-            
-        except Error as e:
-            st.error(f"Error retrieving data: {e}")
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
+            """, (farm_id,)),
+            'health_alerts': health.alerts_query(farm_id),
+        })
+        
+        animal_count = results['animal_count'][0]['count']
+        staff_count = results['staff_count'][0]['count']
+        total_expenses = results['total_expenses'][0]['total'] or 0.0
+        avg_gain = results['avg_gain'][0]['avg_gain'] or 0.0
+        
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.markdown(f"""
+            <div class="metric-card">
+                <h3>Animals</h3>
+                <h1>{animal_count}</h1>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col2:
+            st.markdown(f"""
+            <div class="metric-card">
+                <h3>Staff</h3>
+                <h1>{staff_count}</h1>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col3:
+            st.markdown(f"""
+            <div class="metric-card">
+                <h3>Monthly Expenses</h3>
+                <h1>${total_expenses:,.2f}</h1>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        with col4:
+            st.markdown(f"""
+            <div class="metric-card">
+                <h3>Avg Weight Gain</h3>
+                <h1>{avg_gain:.2f} kg</h1>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        # Animals whose weight history needs a look, worst first
+        section_header("Health Alerts")
+        health_alerts = results['health_alerts']
+        
+        if not health_alerts.empty:
+            health_alerts['reasons'] = health_alerts.apply(health.reasons, axis=1)
+            st.dataframe(health_alerts[['tag_number', 'breed', 'latest_month', 'latest_weight_kg',
+                                        'monthly_gain_kg', 'reasons']],
+                         use_container_width=True, hide_index=True, column_config={
+                             'latest_month': st.column_config.DateColumn("last weighed", format="YYYY-MM"),
+                             'latest_weight_kg': st.column_config.NumberColumn("weight (kg)", format="%.1f"),
+                             'monthly_gain_kg': st.column_config.NumberColumn("last gain (kg/month)", format="%.1f"),
+                         })
+        else:
+            st.info("No health alerts from the weight history.")
+        
+        # Weight gain chart
+        section_header("Animal Weight Progress")
+        weight_data = pd.DataFrame(results['weight_data'])
+        
+        if not weight_data.empty:
+            fig = px.bar(weight_data, x='tag_number', y='weight_gain',
+                         color='breed', text='weight_gain',
+                         title="Weight Gain by Animal")
+            fig.update_traces(texttemplate='%{text:.2f}kg', textposition='outside')
+            st.plotly_chart(fig, use_container_width=True)
+        
+        # Expense breakdown
+        section_header("Monthly Expense Breakdown")
+        expense_data = results['expense_data']
+        
+        if not expense_data.empty:
+            expense_data['month'] = expense_data['month'].dt.strftime('%Y-%m')
+            fig = px.bar(expense_data, x='month',
+                        y=['total_feed_cost', 'total_medicine_cost',
+                           'total_salaries', 'total_utilities', 'other_expenses'],
+                        title="Expense Breakdown by Category",
+                        labels={'value': 'Amount ($)', 'variable': 'Category'})
+            st.plotly_chart(fig, use_container_width=True)
+        
+        # Recent Animals
+        section_header("Recent Animals")
+        recent_animals = results['recent_animals']
+        
+        if recent_animals:
+            cols = st.columns(4)
+            for idx, animal in enumerate(recent_animals):
+                with cols[idx % 4]:
+                    st.markdown(f"""
+                        <div class="animal-card">
+                            <h4>{animal['tag_number']}</h4>
+                            <p><strong>Breed:</strong> {animal['breed']}</p>
+                            <p><strong>Category:</strong> {animal['category_name'] or 'N/A'}</p>
+                            <p><strong>Arrival:</strong> {animal['arrival_date']}</p>
+                    """, unsafe_allow_html=True)
+                    display_card_image(animal)
+                    st.markdown("</div>", unsafe_allow_html=True)
+        
+    except Error as e:
+        st.error(f"Error retrieving data: {e}")
 
 # Animal Categories Page
 elif page == "Animal Categories":
     st.title("Animal Categories Management")
+    
+    # Buttons and forms rerun on their own; a successful submit reruns the page
+    @page_fragment
+    def category_actions(categories):
+        # Action buttons below the heading
+        section_header("Actions")
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            if st.button("➕ Add New Category"):
+                st.session_state.show_add_category = True
+        
+        with col2:
+            if categories:
+                if st.button("✏️ Update Category"):
+                    st.session_state.show_update_category = True
+        
+        with col3:
+            if categories:
+                if st.button("🗑️ Delete Category"):
+                    st.session_state.show_delete_category = True
+        
+        if not form_open('show_add_category', 'show_update_category', 'show_delete_category'):
+            return
+        
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Add new category form
+                if st.session_state.get('show_add_category', False):
+                    with st.form("category_form"):
+                        st.subheader("Add New Category")
+                        name = st.text_input("Category Name*")
+                        description = st.text_area("Description")
+                        image = st.file_uploader("Category Image", type=['jpg', 'jpeg', 'png'])
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if st.form_submit_button("Add Category"):
+                                if name:
+                                    try:
+                                        image_job = images.new_job() if image else None
+                                        cursor.execute("""
+                                            INSERT INTO Animal_Category (farm_id, name, description, image_job)
+                                            VALUES (%s, %s, %s, %s)
+                                        """, (farm_id, name, description, image_job))
+                                        connection.commit()
+                                        queue_image("Animal_Category", cursor.lastrowid, image_job, image)
+                                        st.success("Category added successfully!")
+                                        st.session_state.show_add_category = False
+                                        st.rerun()
+                                    except Error as e:
+                                        st.error(f"Error adding category: {e}")
+                                else:
+                                    st.error("Category name is required")
+                        with col2:
+                            if st.form_submit_button("Cancel"):
+                                close_form('show_add_category')
+                
+                # Update category form
+                if st.session_state.get('show_update_category', False) and categories:
+                    with st.form("update_category_form"):
+                        st.subheader("Update Category")
+                        
+                        category_options = {f"{c['name']} (ID: {c['category_id']})": c['category_id'] for c in categories}
+                        selected_category = st.selectbox("Select Category", options=list(category_options.keys()))
+                        
+                        if selected_category:
+                            category_id = category_options[selected_category]
+                            cursor.execute("SELECT * FROM Animal_Category WHERE category_id = %s AND farm_id = %s",
+                                           (category_id, farm_id))
+                            category_data = cursor.fetchone()
+                            
+                            new_name = st.text_input("Name", value=category_data['name'])
+                            new_description = st.text_area("Description", value=category_data['description'] or "")
+                            new_image = st.file_uploader("Update Image", type=['jpg', 'jpeg', 'png'])
+                            
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                if st.form_submit_button("Update Category"):
+                                    try:
+                                        image_job = images.new_job() if new_image else None
+                                        cursor.execute("""
+                                            UPDATE Animal_Category 
+                                            SET name = %s, description = %s, image_job = COALESCE(%s, image_job)
+                                            WHERE category_id = %s AND farm_id = %s
+                                        """, (new_name, new_description, image_job, category_id, farm_id))
+                                        connection.commit()
+                                        queue_image("Animal_Category", category_id, image_job, new_image)
+                                        st.success("Category updated successfully!")
+                                        st.session_state.show_update_category = False
+                                        st.rerun()
+                                    except Error as e:
+                                        st.error(f"Error updating category: {e}")
+                            with col2:
+                                if st.form_submit_button("Cancel"):
+                                    close_form('show_update_category')
+                
+                # Delete category form
+                if st.session_state.get('show_delete_category', False) and categories:
+                    with st.form("delete_category_form"):
+                        st.subheader("Delete Category")
+                        st.warning("Warning: This action cannot be undone")
+                        
+                        category_options = {f"{c['name']} (ID: {c['category_id']})": c['category_id'] for c in categories}
+                        selected_category = st.selectbox("Select Category to Delete", options=list(category_options.keys()))
+                        
+                        if selected_category:
+                            category_id = category_options[selected_category]
+                            
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                if st.form_submit_button("Delete Category"):
+                                    try:
+                                        # Check if any animals are using this category
+                                        cursor.execute("SELECT COUNT(*) as count FROM Animal WHERE category_id = %s", (category_id,))
+                                        animal_count = cursor.fetchone()['count']
+                                        
+                                        if animal_count > 0:
+                                            st.error(f"Cannot delete category - {animal_count} animals are associated with it")
+                                        else:
+                                            cursor.execute("DELETE FROM Animal_Category WHERE category_id = %s AND farm_id = %s",
+                                                           (category_id, farm_id))
+                                            connection.commit()
+                                            st.success("Category deleted successfully!")
+                                            st.session_state.show_delete_category = False
+                                            st.rerun()
+                                    except Error as e:
+                                        st.error(f"Error deleting category: {e}")
+                            with col2:
+                                if st.form_submit_button("Cancel"):
+                                    close_form('show_delete_category')
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
     connection = create_connection()
     
     if connection:
@@ -379,144 +736,33 @@ elif page == "Animal Categories":
             cursor = connection.cursor(dictionary=True)
             
             # Display all categories
-            st.subheader("All Animal Categories")
+            section_header("All Animal Categories")
             
-            cursor.execute("SELECT * FROM Animal_Category")
+            cursor.execute("SELECT * FROM Animal_Category WHERE farm_id = %s", (farm_id,))
             categories = cursor.fetchall()
             
             if categories:
-                cols = st.columns(3)
-                for idx, category in enumerate(categories):
-                    with cols[idx % 3]:
-                        st.markdown(f"""
-                            <div class="category-card">
-                                <h3>{category['name']}</h3>
-                                <p>{category['description'] or 'No description'}</p>
-                        """, unsafe_allow_html=True)
-                        if category['image']:
-                            display_image(category['image'])
-                        st.markdown("</div>", unsafe_allow_html=True)
+                if use_gallery(categories):
+                    gallery.render_gallery([
+                        gallery.card(category['name'], [(None, category['description'] or 'No description')],
+                                     card_image_url(category), category['image_job'])
+                        for category in categories
+                    ])
+                else:
+                    cols = st.columns(3)
+                    for idx, category in enumerate(categories):
+                        with cols[idx % 3]:
+                            st.markdown(f"""
+                                <div class="category-card">
+                                    <h3>{category['name']}</h3>
+                                    <p>{category['description'] or 'No description'}</p>
+                            """, unsafe_allow_html=True)
+                            display_card_image(category)
+                            st.markdown("</div>", unsafe_allow_html=True)
             else:
                 st.info("No animal categories found.")
             
-            # Action buttons below the heading
-            st.subheader("Actions")
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                if st.button("➕ Add New Category"):
-                    st.session_state.show_add_category = True
-            
-            with col2:
-                if categories:
-                    if st.button("✏️ Update Category"):
-                        st.session_state.show_update_category = True
-            
-            with col3:
-                if categories:
-                    if st.button("🗑️ Delete Category"):
-                        st.session_state.show_delete_category = True
-            
-            # Add new category form
-            if st.session_state.get('show_add_category', False):
-                with st.form("category_form"):
-                    st.subheader("Add New Category")
-                    name = st.text_input("Category Name*")
-                    description = st.text_area("Description")
-                    image = st.file_uploader("Category Image", type=['jpg', 'jpeg', 'png'])
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Add Category"):
-                            if name:
-                                try:
-                                    image_data = image.read() if image else None
-                                    cursor.execute("""
-                                        INSERT INTO Animal_Category (name, description, image)
-                                        VALUES (%s, %s, %s)
-                                    """, (name, description, image_data))
-                                    connection.commit()
-                                    st.success("Category added successfully!")
-                                    st.session_state.show_add_category = False
-                                    st.rerun()
-                                except Error as e:
-                                    st.error(f"Error adding category: {e}")
-                            else:
-                                st.error("Category name is required")
-                    with col2:
-                        if st.form_submit_button("Cancel"):
-                            st.session_state.show_add_category = False
-            
-            # Update category form
-            if st.session_state.get('show_update_category', False) and categories:
-                with st.form("update_category_form"):
-                    st.subheader("Update Category")
-                    
-                    category_options = {f"{c['name']} (ID: {c['category_id']})": c['category_id'] for c in categories}
-                    selected_category = st.selectbox("Select Category", options=list(category_options.keys()))
-                    
-                    if selected_category:
-                        category_id = category_options[selected_category]
-                        cursor.execute("SELECT * FROM Animal_Category WHERE category_id = %s", (category_id,))
-                        category_data = cursor.fetchone()
-                        
-                        new_name = st.text_input("Name", value=category_data['name'])
-                        new_description = st.text_area("Description", value=category_data['description'] or "")
-                        new_image = st.file_uploader("Update Image", type=['jpg', 'jpeg', 'png'])
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            if st.form_submit_button("Update Category"):
-                                try:
-                                    image_data = new_image.read() if new_image else category_data['image']
-                                    cursor.execute("""
-                                        UPDATE Animal_Category 
-                                        SET name = %s, description = %s, image = %s
-                                        WHERE category_id = %s
-                                    """, (new_name, new_description, image_data, category_id))
-                                    connection.commit()
-                                    st.success("Category updated successfully!")
-                                    st.session_state.show_update_category = False
-                                    st.rerun()
-                                except Error as e:
-                                    st.error(f"Error updating category: {e}")
-                        with col2:
-                            if st.form_submit_button("Cancel"):
-                                st.session_state.show_update_category = False
-            
-            # Delete category form
-            if st.session_state.get('show_delete_category', False) and categories:
-                with st.form("delete_category_form"):
-                    st.subheader("Delete Category")
-                    st.warning("Warning: This action cannot be undone")
-                    
-                    category_options = {f"{c['name']} (ID: {c['category_id']})": c['category_id'] for c in categories}
-                    selected_category = st.selectbox("Select Category to Delete", options=list(category_options.keys()))
-                    
-                    if selected_category:
-                        category_id = category_options[selected_category]
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            if st.form_submit_button("Delete Category"):
-                                try:
-                                    # Check if any animals are using this category
-                                    cursor.execute("SELECT COUNT(*) as count FROM Animal WHERE category_id = %s", (category_id,))
-                                    animal_count = cursor.fetchone()['count']
-                                    
-                                    if animal_count > 0:
-                                        st.error(f"Cannot delete category - {animal_count} animals are associated with it")
-                                    else:
-                                        cursor.execute("DELETE FROM Animal_Category WHERE category_id = %s", (category_id,))
-                                        connection.commit()
-                                        st.success("Category deleted successfully!")
-                                        st.session_state.show_delete_category = False
-                                        st.rerun()
-                                except Error as e:
-                                    st.error(f"Error deleting category: {e}")
-                        with col2:
-                            if st.form_submit_button("Cancel"):
-                                st.session_state.show_delete_category = False
+            category_actions([{'category_id': c['category_id'], 'name': c['name']} for c in categories])
             
         except Error as e:
             st.error(f"Error retrieving data: {e}")
@@ -528,694 +774,1462 @@ elif page == "Animal Categories":
 # Animal Records Page
 elif page == "Animal Records":
     st.title("Animal Records Management")
-    connection = create_connection()
     
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get categories for dropdown
-            cursor.execute("SELECT category_id, name FROM Animal_Category")
-            categories = cursor.fetchall()
-            category_options = {c['name']: c['category_id'] for c in categories}
-            category_options["Uncategorized"] = None
-            
-            # Display all animals
-            st.subheader("All Animals")
-            
-            cursor.execute("""
-                SELECT a.*, ac.name as category_name 
-                FROM Animal a
-                LEFT JOIN Animal_Category ac ON a.category_id = ac.category_id
-            """)
-            animals = cursor.fetchall()
-            
-            search_term = st.text_input("Search Animals by Tag Number or Breed")
-            
-            if search_term:
-                filtered_animals = [a for a in animals if 
-                                  search_term.lower() in a['tag_number'].lower() or 
-                                  (a['breed'] and search_term.lower() in a['breed'].lower())]
-            else:
-                filtered_animals = animals
-            
-            if filtered_animals:
-                cols = st.columns(3)
-                for idx, animal in enumerate(filtered_animals):
-                    with cols[idx % 3]:
-                        st.markdown(f"""
-                            <div class="animal-card">
-                                <h3>{animal['tag_number']}</h3>
-                                <p><strong>Breed:</strong> {animal['breed']}</p>
-                                <p><strong>Category:</strong> {animal['category_name'] or 'Uncategorized'}</p>
-                                <p><strong>Arrival:</strong> {animal['arrival_date']}</p>
-                                <p><strong>Initial Weight:</strong> {animal['initial_weight_kg']} kg</p>
-                        """, unsafe_allow_html=True)
-                        if animal['image']:
-                            display_image(animal['image'])
-                        st.markdown("</div>", unsafe_allow_html=True)
-            else:
-                st.info("No animals found matching your search criteria.")
-            
-            # Action buttons below the heading
-            st.subheader("Actions")
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                if st.button("➕ Add New Animal"):
-                    st.session_state.show_add_animal = True
-            
-            with col2:
-                if animals:
-                    if st.button("✏️ Update Animal"):
-                        st.session_state.show_update_animal = True
-            
-            with col3:
-                if animals:
-                    if st.button("🗑️ Delete Animal"):
-                        st.session_state.show_delete_animal = True
-            
-            # Add new animal form
-            if st.session_state.get('show_add_animal', False):
-                with st.form("animal_form"):
-                    st.subheader("Add New Animal")
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        tag_number = st.text_input("Tag Number*")
-                        breed = st.text_input("Breed")
-                        category = st.selectbox("Category", options=list(category_options.keys()))
-                        arrival_date = st.date_input("Arrival Date")
-                    
-                    with col2:
-                        initial_weight = st.number_input("Initial Weight (kg)*", min_value=0.0, step=0.1)
-                        image = st.file_uploader("Animal Image", type=['jpg', 'jpeg', 'png'])
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Add Animal"):
-                            if tag_number and initial_weight:
-                                try:
-                                    image_data = image.read() if image else None
-                                    category_id = category_options[category]
-                                    cursor.execute("""
-                                        INSERT INTO Animal (tag_number, category_id, breed, arrival_date, initial_weight_kg, image)
-                                        VALUES (%s, %s, %s, %s, %s, %s)
-                                    """, (tag_number, category_id, breed, arrival_date, initial_weight, image_data))
-                                    connection.commit()
-                                    st.success("Animal added successfully!")
-                                    st.session_state.show_add_animal = False
-                                    st.rerun()
-                                except Error as e:
-                                    st.error(f"Error adding animal: {e}")
-                            else:
-                                st.error("Tag number and initial weight are required")
-                    with col2:
-                        if st.form_submit_button("Cancel"):
-                            st.session_state.show_add_animal = False
-            
-            # Update animal form
-            if st.session_state.get('show_update_animal', False) and animals:
-                with st.form("edit_animal_form"):
-                    st.subheader("Update Animal")
-                    
-                    animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
-                    selected_animal = st.selectbox("Select Animal", options=list(animal_options.keys()))
-                    
-                    if selected_animal:
-                        animal_id = animal_options[selected_animal]
-                        cursor.execute("""
-                            SELECT a.*, ac.name as category_name 
-                            FROM Animal a
-                            LEFT JOIN Animal_Category ac ON a.category_id = ac.category_id
-                            WHERE a.animal_id = %s
-                        """, (animal_id,))
-                        animal_data = cursor.fetchone()
-                        
+    # Data view reruns on its own when its filters change
+    @page_fragment
+    def animal_gallery():
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Get categories for dropdown
+                cursor.execute("SELECT category_id, name FROM Animal_Category WHERE farm_id = %s", (farm_id,))
+                categories = cursor.fetchall()
+                category_options = {c['name']: c['category_id'] for c in categories}
+                category_options["Uncategorized"] = None
+                
+                # Display the current herd; animals with a disposition are listed by the archive form
+                section_header("All Animals")
+                
+                cursor.execute("""
+                    SELECT a.*, ac.name as category_name 
+                    FROM Animal a
+                    LEFT JOIN Animal_Category ac ON a.category_id = ac.category_id
+                    WHERE a.farm_id = %s AND a.status = 'active'
+                """, (farm_id,))
+                animals = cursor.fetchall()
+                
+                search_term = st.text_input("Search Animals by Tag Number or Breed")
+                
+                if search_term:
+                    filtered_animals = [a for a in animals if 
+                                      search_term.lower() in a['tag_number'].lower() or 
+                                      (a['breed'] and search_term.lower() in a['breed'].lower())]
+                else:
+                    filtered_animals = animals
+                
+                if filtered_animals:
+                    if use_gallery(filtered_animals):
+                        gallery.render_gallery([
+                            gallery.card(animal['tag_number'], [
+                                ("Breed", animal['breed']),
+                                ("Category", animal['category_name'] or 'Uncategorized'),
+                                ("Arrival", animal['arrival_date']),
+                                ("Initial Weight", f"{animal['initial_weight_kg']} kg"),
+                            ], card_image_url(animal), animal['image_job'])
+                            for animal in filtered_animals
+                        ])
+                    else:
+                        cols = st.columns(3)
+                        for idx, animal in enumerate(filtered_animals):
+                            with cols[idx % 3]:
+                                st.markdown(f"""
+                                    <div class="animal-card">
+                                        <h3>{animal['tag_number']}</h3>
+                                        <p><strong>Breed:</strong> {animal['breed']}</p>
+                                        <p><strong>Category:</strong> {animal['category_name'] or 'Uncategorized'}</p>
+                                        <p><strong>Arrival:</strong> {animal['arrival_date']}</p>
+                                        <p><strong>Initial Weight:</strong> {animal['initial_weight_kg']} kg</p>
+                                """, unsafe_allow_html=True)
+                                display_card_image(animal)
+                                st.markdown("</div>", unsafe_allow_html=True)
+                else:
+                    st.info("No animals found matching your search criteria.")
+                
+                st.session_state.animal_list = [{'animal_id': a['animal_id'], 'tag_number': a['tag_number']} for a in animals]
+                st.session_state.animal_category_options = category_options
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    # Buttons and forms rerun on their own; a successful submit reruns the page
+    @page_fragment
+    def animal_actions():
+        animals = st.session_state.get('animal_list', [])
+        category_options = st.session_state.get('animal_category_options', {"Uncategorized": None})
+        
+        # Action buttons below the heading
+        section_header("Actions")
+        col1, col2, col3, col4, col5 = st.columns(5)
+        
+        with col1:
+            if st.button("➕ Add New Animal"):
+                st.session_state.show_add_animal = True
+        
+        with col2:
+            if animals:
+                if st.button("✏️ Update Animal"):
+                    st.session_state.show_update_animal = True
+        
+        with col3:
+            if animals:
+                if st.button("🏷️ Record Disposition"):
+                    st.session_state.show_dispose_animal = True
+        
+        with col4:
+            if st.button("📦 Archive Animals"):
+                st.session_state.show_archive_animal = True
+        
+        with col5:
+            if animals:
+                if st.button("🗑️ Delete Animals"):
+                    st.session_state.show_delete_animal = True
+        
+        if not form_open('show_add_animal', 'show_update_animal', 'show_dispose_animal', 'show_archive_animal',
+                         'show_delete_animal'):
+            return
+        
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Add new animal form
+                if st.session_state.get('show_add_animal', False):
+                    with st.form("animal_form"):
+                        st.subheader("Add New Animal")
                         col1, col2 = st.columns(2)
                         
                         with col1:
-                            new_tag = st.text_input("Tag Number", value=animal_data['tag_number'])
-                            new_breed = st.text_input("Breed", value=animal_data['breed'] or "")
-                            
-                            # Get current category name
-                            current_category = animal_data['category_name'] or "Uncategorized"
-                            new_category = st.selectbox(
-                                "Category", 
-                                options=list(category_options.keys()),
-                                index=list(category_options.keys()).index(current_category)
-                            )
-                            
-                            new_arrival = st.date_input("Arrival Date", value=animal_data['arrival_date'])
+                            tag_number = st.text_input("Tag Number*")
+                            breed = st.text_input("Breed")
+                            category = st.selectbox("Category", options=list(category_options.keys()))
+                            arrival_date = st.date_input("Arrival Date")
                         
                         with col2:
-                            new_weight = st.number_input(
-                                "Initial Weight (kg)", 
-                                min_value=0.0, 
-                                step=0.1,
-                                value=animal_data['initial_weight_kg']
-                            )
-                            new_image = st.file_uploader("Update Image", type=['jpg', 'jpeg', 'png'])
-                            
-                            if animal_data['image']:
-                                st.markdown("**Current Image:**")
-                                display_image(animal_data['image'])
+                            initial_weight = st.number_input("Initial Weight (kg)*", min_value=0.0, step=0.1)
+                            image = st.file_uploader("Animal Image", type=['jpg', 'jpeg', 'png'])
                         
                         col1, col2 = st.columns(2)
                         with col1:
-                            if st.form_submit_button("Update Animal"):
-                                try:
-                                    image_data = new_image.read() if new_image else animal_data['image']
-                                    category_id = category_options[new_category]
-                                    cursor.execute("""
-                                        UPDATE Animal 
-                                        SET tag_number = %s, category_id = %s, breed = %s, 
-                                            arrival_date = %s, initial_weight_kg = %s, image = %s
-                                        WHERE animal_id = %s
-                                    """, (new_tag, category_id, new_breed, new_arrival, new_weight, image_data, animal_id))
-                                    connection.commit()
-                                    st.success("Animal updated successfully!")
-                                    st.session_state.show_update_animal = False
-                                    st.rerun()
-                                except Error as e:
-                                    st.error(f"Error updating animal: {e}")
+                            if st.form_submit_button("Add Animal"):
+                                if tag_number and initial_weight:
+                                    try:
+                                        image_job = images.new_job() if image else None
+                                        category_id = category_options[category]
+                                        cursor.execute("""
+                                            INSERT INTO Animal (farm_id, tag_number, category_id, breed, arrival_date, initial_weight_kg, image_job)
+                                            VALUES (%s, %s, %s, %s, %s, %s, %s)
+                                        """, (farm_id, tag_number, category_id, breed, arrival_date, initial_weight, image_job))
+                                        connection.commit()
+                                        queue_image("Animal", cursor.lastrowid, image_job, image)
+                                        st.success("Animal added successfully!")
+                                        st.session_state.show_add_animal = False
+                                        st.rerun()
+                                    except Error as e:
+                                        st.error(f"Error adding animal: {e}")
+                                else:
+                                    st.error("Tag number and initial weight are required")
                         with col2:
                             if st.form_submit_button("Cancel"):
-                                st.session_state.show_update_animal = False
-            
-            # Delete animal form
-            if st.session_state.get('show_delete_animal', False) and animals:
-                with st.form("delete_animal_form"):
-                    st.subheader("Delete Animal")
-                    st.warning("Warning: This action cannot be undone")
-                    
-                    animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
-                    selected_animal = st.selectbox("Select Animal to Delete", options=list(animal_options.keys()))
-                    
-                    if selected_animal:
-                        animal_id = animal_options[selected_animal]
+                                close_form('show_add_animal')
+                
+                # Update animal form
+                if st.session_state.get('show_update_animal', False) and animals:
+                    with st.form("edit_animal_form"):
+                        st.subheader("Update Animal")
                         
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            if st.form_submit_button("Delete Animal"):
-                                try:
-                                    # Check for dependent records
-                                    cursor.execute("SELECT COUNT(*) as count FROM Monthly_Weight WHERE animal_id = %s", (animal_id,))
-                                    weight_records = cursor.fetchone()['count']
-                                    
-                                    cursor.execute("SELECT COUNT(*) as count FROM Feed_Record WHERE animal_id = %s", (animal_id,))
-                                    feed_records = cursor.fetchone()['count']
-                                    
-                                    cursor.execute("SELECT COUNT(*) as count FROM Medicine_Record WHERE animal_id = %s", (animal_id,))
-                                    med_records = cursor.fetchone()['count']
-                                    
-                                    if weight_records > 0 or feed_records > 0 or med_records > 0:
-                                        st.error(f"Cannot delete animal - it has {weight_records} weight records, {feed_records} feed records, and {med_records} medical records")
-                                    else:
-                                        cursor.execute("DELETE FROM Animal WHERE animal_id = %s", (animal_id,))
-                                        connection.commit()
-                                        st.success("Animal deleted successfully!")
+                        animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
+                        selected_animal = st.selectbox("Select Animal", options=list(animal_options.keys()))
+                        
+                        if selected_animal:
+                            animal_id = animal_options[selected_animal]
+                            cursor.execute("""
+                                SELECT a.*, ac.name as category_name 
+                                FROM Animal a
+                                LEFT JOIN Animal_Category ac ON a.category_id = ac.category_id
+                                WHERE a.animal_id = %s AND a.farm_id = %s
+                            """, (animal_id, farm_id))
+                            animal_data = cursor.fetchone()
+                            
+                            col1, col2 = st.columns(2)
+                            
+                            with col1:
+                                new_tag = st.text_input("Tag Number", value=animal_data['tag_number'])
+                                new_breed = st.text_input("Breed", value=animal_data['breed'] or "")
+                                
+                                # Get current category name
+                                current_category = animal_data['category_name'] or "Uncategorized"
+                                new_category = st.selectbox(
+                                    "Category", 
+                                    options=list(category_options.keys()),
+                                    index=list(category_options.keys()).index(current_category)
+                                )
+                                
+                                new_arrival = st.date_input("Arrival Date", value=animal_data['arrival_date'])
+                            
+                            with col2:
+                                new_weight = st.number_input(
+                                    "Initial Weight (kg)", 
+                                    min_value=0.0, 
+                                    step=0.1,
+                                    value=animal_data['initial_weight_kg']
+                                )
+                                new_image = st.file_uploader("Update Image", type=['jpg', 'jpeg', 'png'])
+                                
+                                if animal_data['image'] or animal_data['image_hash'] or animal_data['image_job']:
+                                    st.markdown("**Current Image:**")
+                                    display_card_image(animal_data)
+                            
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                if st.form_submit_button("Update Animal"):
+                                    try:
+                                        image_job = images.new_job() if new_image else None
+                                        category_id = category_options[new_category]
+                                        cursor.execute("""
+                                            UPDATE Animal 
+                                            SET tag_number = %s, category_id = %s, breed = %s, 
+                                                arrival_date = %s, initial_weight_kg = %s, image_job = COALESCE(%s, image_job)
+                                            WHERE animal_id = %s AND farm_id = %s
+                                        """, (new_tag, category_id, new_breed, new_arrival, new_weight, image_job, animal_id, farm_id))
+                                        connection.commit()
+                                        queue_image("Animal", animal_id, image_job, new_image)
+                                        st.success("Animal updated successfully!")
+                                        st.session_state.show_update_animal = False
+                                        st.rerun()
+                                    except Error as e:
+                                        st.error(f"Error updating animal: {e}")
+                            with col2:
+                                if st.form_submit_button("Cancel"):
+                                    close_form('show_update_animal')
+                
+                # Disposition form
+                if st.session_state.get('show_dispose_animal', False) and animals:
+                    with st.form("dispose_animal_form"):
+                        st.subheader("Record Disposition")
+                        st.info("Animals that leave the herd drop out of the herd views; their records stay in the reports until they are archived.")
+                        
+                        animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
+                        selected_animals = st.multiselect("Select Animals", options=list(animal_options.keys()))
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            disposition = st.selectbox("Disposition", options=list(archive.DISPOSITIONS),
+                                                       format_func=str.capitalize)
+                        with col2:
+                            disposed_on = st.date_input("Date")
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if st.form_submit_button("Record Disposition"):
+                                if selected_animals:
+                                    try:
+                                        disposed = archive.dispose(connection, farm_id,
+                                                                   [animal_options[a] for a in selected_animals],
+                                                                   disposition, disposed_on)
+                                        connection.commit()
+                                        # Readings for these tags stop resolving to the animals
+                                        ingest_server.forget_tags(farm_id)
+                                        st.success(f"{disposed} animal(s) marked as {disposition}")
+                                        st.session_state.show_dispose_animal = False
+                                        st.rerun()
+                                    except Error as e:
+                                        st.error(f"Error recording disposition: {e}")
+                                else:
+                                    st.error("Select at least one animal")
+                        with col2:
+                            if st.form_submit_button("Cancel"):
+                                close_form('show_dispose_animal')
+                
+                # Archive form
+                if st.session_state.get('show_archive_animal', False):
+                    with st.form("archive_animal_form"):
+                        st.subheader("Archive Animals")
+                        
+                        cursor.execute("""
+                            SELECT animal_id, tag_number, status, disposed_on FROM Animal
+                            WHERE farm_id = %s AND status <> 'active'
+                            ORDER BY disposed_on, tag_number
+                        """, (farm_id,))
+                        disposed = {f"{a['tag_number']} ({a['status']}, ID: {a['animal_id']})": a['animal_id']
+                                    for a in cursor.fetchall()}
+                        selected_animals = []
+                        if disposed:
+                            st.info("Archived animals move out of the live tables together with all of their records.")
+                            selected_animals = st.multiselect("Select Animals to Archive", options=list(disposed.keys()),
+                                                              default=list(disposed.keys()))
+                        else:
+                            st.info("No animals have a disposition recorded.")
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if st.form_submit_button("Archive Animals"):
+                                if selected_animals:
+                                    try:
+                                        # The animals and their records move in one transaction
+                                        archived = archive.archive(connection, farm_id,
+                                                                   [disposed[a] for a in selected_animals])
+                                        connection.commit()
+                                        if archived:
+                                            archive.committed(farm_id)
+                                        st.success(f"{archived} animal(s) archived")
+                                        st.session_state.show_archive_animal = False
+                                        st.rerun()
+                                    except archive.HasRecords as e:
+                                        connection.rollback()
+                                        st.error(f"Cannot archive - {e}")
+                                    except Error as e:
+                                        st.error(f"Error archiving animals: {e}")
+                                else:
+                                    st.error("Select at least one animal")
+                        with col2:
+                            if st.form_submit_button("Cancel"):
+                                close_form('show_archive_animal')
+                
+                # Delete animal form
+                if st.session_state.get('show_delete_animal', False) and animals:
+                    with st.form("delete_animal_form"):
+                        st.subheader("Delete Animals")
+                        st.warning("Warning: This action cannot be undone. To keep an animal's records, record its disposition and archive it instead.")
+                        
+                        animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
+                        selected_animals = st.multiselect("Select Animals to Delete", options=list(animal_options.keys()))
+                        delete_records = st.checkbox("Also delete their weight, feed, medical and scale records")
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if st.form_submit_button("Delete Animals"):
+                                if selected_animals:
+                                    try:
+                                        animal_ids = [animal_options[a] for a in selected_animals]
+                                        # The animals and their records go in one transaction, which also
+                                        # checks for dependent records once the animals are locked
+                                        deleted = archive.delete(connection, farm_id, animal_ids, delete_records)
+                                        connection.commit()
+                                        if deleted:
+                                            archive.committed(farm_id)
+                                        st.success(f"{deleted} animal(s) deleted")
                                         st.session_state.show_delete_animal = False
                                         st.rerun()
-                                except Error as e:
-                                    st.error(f"Error deleting animal: {e}")
+                                    except archive.HasRecords as e:
+                                        connection.rollback()
+                                        st.error(f"Cannot delete - {e}")
+                                    except Error as e:
+                                        st.error(f"Error deleting animal: {e}")
+                                else:
+                                    st.error("Select at least one animal")
                         with col2:
                             if st.form_submit_button("Cancel"):
-                                st.session_state.show_delete_animal = False
-            
-        except Error as e:
-            st.error(f"Error retrieving data: {e}")
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
+                                close_form('show_delete_animal')
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    animal_gallery()
+    animal_actions()
 
 # Weight Tracking Page
 elif page == "Weight Tracking":
     st.title("Animal Weight Tracking")
-    connection = create_connection()
     
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get animals for dropdown
-            cursor.execute("SELECT animal_id, tag_number FROM Animal")
-            animals = cursor.fetchall()
-            animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
-            
-            # View weight records
-            st.subheader("Weight Records")
-            selected_animal_view = st.selectbox("Select Animal to View", options=["All"] + list(animal_options.keys()))
-            start_date = st.date_input("Start Date")
-            end_date = st.date_input("End Date")
-            
-            if selected_animal_view != "All":
-                animal_id = animal_options[selected_animal_view]
-                cursor.execute("""
-                    SELECT mw.month, mw.weight_kg, a.tag_number, a.breed
-                    FROM Monthly_Weight mw
-                    JOIN Animal a ON mw.animal_id = a.animal_id
-                    WHERE mw.animal_id = %s AND mw.month BETWEEN %s AND %s
-                    ORDER BY mw.month DESC
-                """, (animal_id, start_date, end_date))
-            else:
-                cursor.execute("""
-                    SELECT mw.month, mw.weight_kg, a.tag_number, a.breed
-                    FROM Monthly_Weight mw
-                    JOIN Animal a ON mw.animal_id = a.animal_id
-                    WHERE mw.month BETWEEN %s AND %s
-                    ORDER BY mw.month DESC
-                """, (start_date, end_date))
-            
-            weight_records = pd.DataFrame(cursor.fetchall())
-            
-            if not weight_records.empty:
-                st.dataframe(weight_records, use_container_width=True)
+    # Data view reruns on its own when its filters change
+    @page_fragment
+    def weight_view():
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Get animals for dropdown
+                cursor.execute("SELECT animal_id, tag_number FROM Animal WHERE farm_id = %s AND status = 'active'",
+                               (farm_id,))
+                animals = cursor.fetchall()
+                animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
+                write_queue.remember_animals(animal_options, farm_id)
+                
+                # View weight records
+                section_header("Weight Records")
+                selected_animal_view = st.selectbox("Select Animal to View", options=["All"] + list(animal_options.keys()))
+                start_date = st.date_input("Start Date")
+                end_date = st.date_input("End Date")
                 
-                # Plot weight progress
                 if selected_animal_view != "All":
-                    fig = px.line(weight_records, x='month', y='weight_kg',
-                                 title=f"Weight Progress for {selected_animal_view}",
-                                 markers=True)
-                    st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No weight records found for the selected period.")
-            
-            # Action buttons below the heading
-            st.subheader("Actions")
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                if st.button("➕ Add Weight Record"):
-                    st.session_state.show_add_weight = True
-            
-            with col2:
+                    animal_id = animal_options[selected_animal_view]
+                    weight_records = frames.read_frame(connection, """
+                        SELECT mw.month, mw.weight_kg, a.tag_number, a.breed
+                        FROM Monthly_Weight mw
+                        JOIN Animal a ON mw.animal_id = a.animal_id
+                        WHERE mw.animal_id = %s AND mw.month BETWEEN %s AND %s
+                        ORDER BY mw.month DESC
+                    """, (animal_id, start_date, end_date), frames.WEIGHT_RECORD_KINDS)
+                else:
+                    weight_records = frames.read_frame(connection, """
+                        SELECT mw.month, mw.weight_kg, a.tag_number, a.breed
+                        FROM Monthly_Weight mw
+                        JOIN Animal a ON mw.animal_id = a.animal_id
+                        WHERE mw.farm_id = %s AND mw.month BETWEEN %s AND %s
+                        ORDER BY mw.month DESC
+                    """, (farm_id, start_date, end_date), frames.WEIGHT_RECORD_KINDS)
+                
                 if not weight_records.empty:
-                    if st.button("✏️ Update Weight Record"):
-                        st.session_state.show_update_weight = True
-            
-            # Add new weight record form
-            if st.session_state.get('show_add_weight', False):
-                with st.form("weight_form"):
-                    st.subheader("Add New Weight Record")
-                    selected_animal = st.selectbox("Select Animal", options=list(animal_options.keys()))
-                    month = st.date_input("Month")
-                    weight = st.number_input("Weight (kg)", min_value=0.0, step=0.1)
+                    st.dataframe(weight_records, use_container_width=True,
+                                 column_config={'month': st.column_config.DateColumn(format="YYYY-MM-DD")})
                     
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Add Weight Record"):
-                            animal_id = animal_options[selected_animal]
-                            try:
-                                cursor.execute("""
-                                    INSERT INTO Monthly_Weight (animal_id, month, weight_kg)
-                                    VALUES (%s, %s, %s)
-                                """, (animal_id, month, weight))
-                                connection.commit()
-                                st.success("Weight record added successfully!")
-                                st.session_state.show_add_weight = False
-                                st.rerun()
-                            except Error as e:
-                                st.error(f"Error adding weight record: {e}")
-                    with col2:
-                        if st.form_submit_button("Cancel"):
+                    # Plot weight progress
+                    if selected_animal_view != "All":
+                        fig = px.line(weight_records, x='month', y='weight_kg',
+                                     title=f"Weight Progress for {selected_animal_view}",
+                                     markers=True)
+                        st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("No weight records found for the selected period.")
+                
+                # Herd weight spread per month, aggregated by DuckDB over the analytics snapshot
+                if selected_animal_view == "All" and analytics.enabled():
+                    try:
+                        herd = analytics.herd_weights(farm_id, start_date, end_date)
+                        if not herd.empty:
+                            section_header("Herd Weight Distribution")
+                            fig = px.line(herd, x='month', y=['p10_kg', 'median_kg', 'p90_kg'],
+                                         title="Herd Weight by Month (10th, 50th and 90th percentile)",
+                                         labels={'value': 'weight_kg', 'variable': ''})
+                            st.plotly_chart(fig, use_container_width=True)
+                    except analytics.SnapshotUnavailable:
+                        st.info("The analytics snapshot is still being built.")
+                
+                # Scale readings, at a daily, weekly or monthly resolution to suit the range
+                if selected_animal_view != "All":
+                    tier, points = rollups.series(animal_id, start_date, end_date)
+                    if points:
+                        section_header("Scale Readings")
+                        scale_readings = pd.DataFrame(points)
+                        fig = px.line(scale_readings, x='period_start', y=['median_kg', 'min_kg', 'max_kg'],
+                                     title=f"{tier.capitalize()} scale weights for {selected_animal_view}",
+                                     labels={'period_start': tier, 'value': 'weight_kg'})
+                        st.plotly_chart(fig, use_container_width=True)
+                        st.caption(f"{int(scale_readings['readings'].sum()):,} readings, "
+                                   f"{int(scale_readings['rejected'].sum()):,} rejected as outliers")
+                
+                st.session_state.weight_animal_options = animal_options
+                st.session_state.weight_records_view = weight_records
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    # Buttons and forms rerun on their own; a successful submit reruns the page
+    @page_fragment
+    def weight_actions():
+        animal_options = st.session_state.get('weight_animal_options') or write_queue.cached_animals(farm_id)
+        weight_records = st.session_state.get('weight_records_view', pd.DataFrame())
+        
+        # Action buttons below the heading
+        section_header("Actions")
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if st.button("➕ Add Weight Record"):
+                st.session_state.show_add_weight = True
+        
+        with col2:
+            if not weight_records.empty:
+                if st.button("✏️ Update Weight Record"):
+                    st.session_state.show_update_weight = True
+        
+        if not form_open('show_add_weight', 'show_update_weight'):
+            return
+        
+        # Add new weight record form
+        if st.session_state.get('show_add_weight', False):
+            with st.form("weight_form"):
+                st.subheader("Add New Weight Record")
+                selected_animal = st.selectbox("Select Animal", options=list(animal_options.keys()))
+                month = st.date_input("Month")
+                weight = st.number_input("Weight (kg)", min_value=0.0, step=0.1)
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.form_submit_button("Add Weight Record"):
+                        animal_id = animal_options[selected_animal]
+                        if save_record("Monthly_Weight", {'animal_id': animal_id, 'month': month, 'weight_kg': weight}, "Weight record"):
                             st.session_state.show_add_weight = False
-            
-            # Update weight record form
-            if st.session_state.get('show_update_weight', False) and not weight_records.empty:
-                with st.form("update_weight_form"):
-                    st.subheader("Update Weight Record")
-                    
-                    selected_record = st.selectbox("Select Record to Update", 
-                                                 options=weight_records['month'].astype(str) + " - " + weight_records['tag_number'])
-                    
-                    if selected_record:
-                        record_date = pd.to_datetime(selected_record.split(" - ")[0]).date()
-                        tag_number = selected_record.split(" - ")[1]
+                            st.rerun()
+                with col2:
+                    if st.form_submit_button("Cancel"):
+                        close_form('show_add_weight')
+        
+        # Updates need the database; new records can be queued while it is unreachable
+        if not st.session_state.get('show_update_weight', False):
+            return
+        
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Update weight record form
+                if st.session_state.get('show_update_weight', False) and not weight_records.empty:
+                    with st.form("update_weight_form"):
+                        st.subheader("Update Weight Record")
                         
-                        cursor.execute("""
-                            SELECT mw.weight_id, mw.weight_kg 
-                            FROM Monthly_Weight mw
-                            JOIN Animal a ON mw.animal_id = a.animal_id
-                            WHERE mw.month = %s AND a.tag_number = %s
-                        """, (record_date, tag_number))
-                        record_data = cursor.fetchone()
+                        selected_record = st.selectbox("Select Record to Update", 
+                                                     options=weight_records['month'].dt.strftime('%Y-%m-%d') + " - " + weight_records['tag_number'])
                         
-                        if record_data:
-                            new_weight = st.number_input("New Weight (kg)", 
-                                                       min_value=0.0, 
-                                                       step=0.1,
-                                                       value=record_data['weight_kg'])
+                        if selected_record:
+                            record_date = pd.to_datetime(selected_record.split(" - ")[0]).date()
+                            tag_number = selected_record.split(" - ")[1]
                             
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                if st.form_submit_button("Update Weight"):
-                                    try:
-                                        cursor.execute("""
-                                            UPDATE Monthly_Weight 
-                                            SET weight_kg = %s
-                                            WHERE weight_id = %s
-                                        """, (new_weight, record_data['weight_id']))
-                                        connection.commit()
-                                        st.success("Weight record updated successfully!")
-                                        st.session_state.show_update_weight = False
-                                        st.rerun()
-                                    except Error as e:
-                                        st.error(f"Error updating weight record: {e}")
-                            with col2:
-                                if st.form_submit_button("Cancel"):
-                                    st.session_state.show_update_weight = False
-            
-        except Error as e:
-            st.error(f"Error retrieving data: {e}")
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
+                            cursor.execute("""
+                                SELECT mw.weight_id, mw.weight_kg 
+                                FROM Monthly_Weight mw
+                                JOIN Animal a ON mw.animal_id = a.animal_id
+                                WHERE mw.month = %s AND a.tag_number = %s AND a.farm_id = %s
+                            """, (record_date, tag_number, farm_id))
+                            record_data = cursor.fetchone()
+                            
+                            if record_data:
+                                new_weight = st.number_input("New Weight (kg)", 
+                                                           min_value=0.0, 
+                                                           step=0.1,
+                                                           value=record_data['weight_kg'])
+                                
+                                col1, col2 = st.columns(2)
+                                with col1:
+                                    if st.form_submit_button("Update Weight"):
+                                        try:
+                                            cursor.execute("""
+                                                UPDATE Monthly_Weight 
+                                                SET weight_kg = %s
+                                                WHERE weight_id = %s
+                                            """, (new_weight, record_data['weight_id']))
+                                            connection.commit()
+                                            st.success("Weight record updated successfully!")
+                                            st.session_state.show_update_weight = False
+                                            st.rerun()
+                                        except Error as e:
+                                            st.error(f"Error updating weight record: {e}")
+                                with col2:
+                                    if st.form_submit_button("Cancel"):
+                                        close_form('show_update_weight')
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    weight_view()
+    weight_actions()
 
 # Feed Records Page
 elif page == "Feed Records":
     st.title("Feed Records Management")
-    connection = create_connection()
     
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get animals for dropdown
-            cursor.execute("SELECT animal_id, tag_number FROM Animal")
-            animals = cursor.fetchall()
-            animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
-            
-            # View feed records
-            st.subheader("Feed Records")
-            selected_animal_view = st.selectbox("Select Animal to View", options=["All"] + list(animal_options.keys()))
-            start_date = st.date_input("Start Date")
-            end_date = st.date_input("End Date")
-            
-            if selected_animal_view != "All":
-                animal_id = animal_options[selected_animal_view]
-                cursor.execute("""
-                    SELECT fr.date, fr.feed_type, fr.quantity_kg, fr.cost, a.tag_number
-                    FROM Feed_Record fr
-                    JOIN Animal a ON fr.animal_id = a.animal_id
-                    WHERE fr.animal_id = %s AND fr.date BETWEEN %s AND %s
-                    ORDER BY fr.date DESC
-                """, (animal_id, start_date, end_date))
-            else:
-                cursor.execute("""
-                    SELECT fr.date, fr.feed_type, fr.quantity_kg, fr.cost, a.tag_number
-                    FROM Feed_Record fr
-                    JOIN Animal a ON fr.animal_id = a.animal_id
-                    WHERE fr.date BETWEEN %s AND %s
-                    ORDER BY fr.date DESC
-                """, (start_date, end_date))
-            
-            feed_records = pd.DataFrame(cursor.fetchall())
-            
-            if not feed_records.empty:
-                st.dataframe(feed_records, use_container_width=True)
+    # Data view reruns on its own when its filters change
+    @page_fragment
+    def feed_view():
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
                 
-                # Calculate total feed cost
-                total_cost = feed_records['cost'].sum()
-                st.metric("Total Feed Cost", f"${total_cost:,.2f}")
+                # Get animals for dropdown
+                cursor.execute("SELECT animal_id, tag_number FROM Animal WHERE farm_id = %s AND status = 'active'",
+                               (farm_id,))
+                animals = cursor.fetchall()
+                animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
+                write_queue.remember_animals(animal_options, farm_id)
+                
+                # View feed records
+                section_header("Feed Records")
+                selected_animal_view = st.selectbox("Select Animal to View", options=["All"] + list(animal_options.keys()))
+                start_date = st.date_input("Start Date")
+                end_date = st.date_input("End Date")
                 
-                # Plot feed types
                 if selected_animal_view != "All":
-                    fig = px.pie(feed_records, names='feed_type', values='quantity_kg',
-                                title=f"Feed Type Distribution for {selected_animal_view}")
-                    st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No feed records found for the selected period.")
-            
-            # Action buttons below the heading
-            st.subheader("Actions")
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                if st.button("➕ Add Feed Record"):
-                    st.session_state.show_add_feed = True
-            
-            with col2:
-                if not feed_records.empty:
-                    if st.button("✏️ Update Feed Record"):
-                        st.session_state.show_update_feed = True
-            
-            # Add new feed record form
-            if st.session_state.get('show_add_feed', False):
-                with st.form("feed_form"):
-                    st.subheader("Add New Feed Record")
-                    selected_animal = st.selectbox("Select Animal", options=list(animal_options.keys()))
-                    date = st.date_input("Date")
-                    feed_type = st.text_input("Feed Type*")
-                    quantity = st.number_input("Quantity (kg)*", min_value=0.0, step=0.1)
-                    cost = st.number_input("Cost ($)*", min_value=0.0, step=0.01)
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Add Feed Record"):
-                            if feed_type and quantity and cost:
-                                animal_id = animal_options[selected_animal]
-                                try:
-                                    cursor.execute("""
-                                        INSERT INTO Feed_Record (animal_id, date, feed_type, quantity_kg, cost)
-                                        VALUES (%s, %s, %s, %s, %s)
-                                    """, (animal_id, date, feed_type, quantity, cost))
-                                    connection.commit()
-                                    st.success("Feed record added successfully!")
-                                    st.session_state.show_add_feed = False
-                                    st.rerun()
-                                except Error as e:
-                                    st.error(f"Error adding feed record: {e}")
-                            else:
-                                st.error("Feed type, quantity, and cost are required")
-                    with col2:
-                        if st.form_submit_button("Cancel"):
-                            st.session_state.show_add_feed = False
-            
-            # Update feed record form
-            if st.session_state.get('show_update_feed', False) and not feed_records.empty:
-                with st.form("update_feed_form"):
-                    st.subheader("Update Feed Record")
+                    animal_id = animal_options[selected_animal_view]
+                    where, params = "fr.animal_id = %s AND fr.date BETWEEN %s AND %s", (animal_id, start_date, end_date)
+                else:
+                    where, params = "fr.farm_id = %s AND fr.date BETWEEN %s AND %s", (farm_id, start_date, end_date)
+                
+                # Totals and the per-feed-type breakdown are aggregated in SQL; only one page of rows is fetched
+                cursor.execute(f"""
+                    SELECT fr.feed_type, COUNT(*) as records, SUM(fr.quantity_kg) as quantity_kg, SUM(fr.cost) as cost
+                    FROM Feed_Record fr
+                    WHERE {where}
+                    GROUP BY fr.feed_type
+                    ORDER BY quantity_kg DESC
+                """, params)
+                feed_breakdown = pd.DataFrame(cursor.fetchall())
+                total_records = int(feed_breakdown['records'].sum()) if not feed_breakdown.empty else 0
+                feed_records = pd.DataFrame()
+                
+                if total_records:
+                    order_by, limit, offset = table_pager("feed", total_records, FEED_SORT_COLUMNS, "fr.feed_id")
+                    feed_records = frames.read_frame(connection, f"""
+                        SELECT fr.date, fr.feed_type, fr.quantity_kg, fr.cost, a.tag_number
+                        FROM Feed_Record fr
+                        JOIN Animal a ON fr.animal_id = a.animal_id
+                        WHERE {where}
+                        ORDER BY {order_by}
+                        LIMIT %s OFFSET %s
+                    """, (*params, limit, offset), frames.FEED_RECORD_KINDS)
+                    st.dataframe(feed_records, use_container_width=True,
+                                 column_config={'date': st.column_config.DateColumn(format="YYYY-MM-DD")})
                     
-                    selected_record = st.selectbox("Select Record to Update", 
-                                                options=feed_records['date'].astype(str) + " - " + 
-                                                feed_records['tag_number'] + " - " + 
-                                                feed_records['feed_type'])
+                    # Calculate total feed cost
+                    total_cost = feed_breakdown['cost'].sum()
+                    st.metric("Total Feed Cost", f"${total_cost:,.2f}")
                     
-                    if selected_record:
-                        parts = selected_record.split(" - ")
-                        record_date = pd.to_datetime(parts[0]).date()
-                        tag_number = parts[1]
-                        feed_type = parts[2]
+                    # Plot feed types
+                    title = "Feed Type Distribution"
+                    if selected_animal_view != "All":
+                        title += f" for {selected_animal_view}"
+                    fig = px.pie(feed_breakdown, names='feed_type', values='quantity_kg', title=title)
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("No feed records found for the selected period.")
+                
+                st.session_state.feed_animal_options = animal_options
+                st.session_state.feed_records_view = feed_records
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    # Buttons and forms rerun on their own; a successful submit reruns the page
+    @page_fragment
+    def feed_actions():
+        animal_options = st.session_state.get('feed_animal_options') or write_queue.cached_animals(farm_id)
+        feed_records = st.session_state.get('feed_records_view', pd.DataFrame())
+        
+        # Action buttons below the heading
+        section_header("Actions")
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if st.button("➕ Add Feed Record"):
+                st.session_state.show_add_feed = True
+        
+        with col2:
+            if not feed_records.empty:
+                if st.button("✏️ Update Feed Record"):
+                    st.session_state.show_update_feed = True
+        
+        if not form_open('show_add_feed', 'show_update_feed'):
+            return
+        
+        # Add new feed record form
+        if st.session_state.get('show_add_feed', False):
+            with st.form("feed_form"):
+                st.subheader("Add New Feed Record")
+                selected_animal = st.selectbox("Select Animal", options=list(animal_options.keys()))
+                date = st.date_input("Date")
+                feed_type = st.text_input("Feed Type*")
+                quantity = st.number_input("Quantity (kg)*", min_value=0.0, step=0.1)
+                cost = st.number_input("Cost ($)*", min_value=0.0, step=0.01)
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.form_submit_button("Add Feed Record"):
+                        if feed_type and quantity and cost:
+                            animal_id = animal_options[selected_animal]
+                            if save_record("Feed_Record", {
+                                    'animal_id': animal_id, 'date': date, 'feed_type': feed_type,
+                                    'quantity_kg': quantity, 'cost': cost,
+                                }, "Feed record"):
+                                st.session_state.show_add_feed = False
+                                st.rerun()
+                        else:
+                            st.error("Feed type, quantity, and cost are required")
+                with col2:
+                    if st.form_submit_button("Cancel"):
+                        close_form('show_add_feed')
+        
+        # Updates need the database; new records can be queued while it is unreachable
+        if not st.session_state.get('show_update_feed', False):
+            return
+        
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Update feed record form
+                if st.session_state.get('show_update_feed', False) and not feed_records.empty:
+                    with st.form("update_feed_form"):
+                        st.subheader("Update Feed Record")
                         
-                        cursor.execute("""
-                            SELECT fr.feed_id, fr.quantity_kg, fr.cost
-                            FROM Feed_Record fr
-                            JOIN Animal a ON fr.animal_id = a.animal_id
-                            WHERE fr.date = %s AND a.tag_number = %s AND fr.feed_type = %s
-                        """, (record_date, tag_number, feed_type))
-                        record_data = cursor.fetchone()
+                        selected_record = st.selectbox("Select Record to Update", 
+                                                    options=feed_records['date'].dt.strftime('%Y-%m-%d') + " - " + 
+                                                    feed_records['tag_number'] + " - " + 
+                                                    feed_records['feed_type'].astype(str))
                         
-                        if record_data:
-                            new_quantity = st.number_input("New Quantity (kg)", 
-                                                        min_value=0.0, 
-                                                        step=0.1,
-                                                        value=record_data['quantity_kg'])
-                            new_cost = st.number_input("New Cost ($)", 
-                                                    min_value=0.0, 
-                                                    step=0.01,
-                                                    value=record_data['cost'])
+                        if selected_record:
+                            parts = selected_record.split(" - ")
+                            record_date = pd.to_datetime(parts[0]).date()
+                            tag_number = parts[1]
+                            feed_type = parts[2]
                             
-                            col1, col2 = st.columns(2)
-                            with col1:
-                                if st.form_submit_button("Update Feed Record"):
-                                    try:
-                                        cursor.execute("""
-                                            UPDATE Feed_Record 
-                                            SET quantity_kg = %s, cost = %s
-                                            WHERE feed_id = %s
-                                        """, (new_quantity, new_cost, record_data['feed_id']))
-                                        connection.commit()
-                                        st.success("Feed record updated successfully!")
-                                        st.session_state.show_update_feed = False
-                                        st.rerun()
-                                    except Error as e:
-                                        st.error(f"Error updating feed record: {e}")
-                            with col2:
-                                if st.form_submit_button("Cancel"):
-                                    st.session_state.show_update_feed = False
-            
-        except Error as e:
-            st.error(f"Error retrieving data: {e}")
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
+                            cursor.execute("""
+                                SELECT fr.feed_id, fr.quantity_kg, fr.cost
+                                FROM Feed_Record fr
+                                JOIN Animal a ON fr.animal_id = a.animal_id
+                                WHERE fr.date = %s AND a.tag_number = %s AND fr.feed_type = %s AND a.farm_id = %s
+                            """, (record_date, tag_number, feed_type, farm_id))
+                            record_data = cursor.fetchone()
+                            
+                            if record_data:
+                                new_quantity = st.number_input("New Quantity (kg)", 
+                                                            min_value=0.0, 
+                                                            step=0.1,
+                                                            value=record_data['quantity_kg'])
+                                new_cost = st.number_input("New Cost ($)", 
+                                                        min_value=0.0, 
+                                                        step=0.01,
+                                                        value=record_data['cost'])
+                                
+                                col1, col2 = st.columns(2)
+                                with col1:
+                                    if st.form_submit_button("Update Feed Record"):
+                                        try:
+                                            cursor.execute("""
+                                                UPDATE Feed_Record 
+                                                SET quantity_kg = %s, cost = %s
+                                                WHERE feed_id = %s
+                                            """, (new_quantity, new_cost, record_data['feed_id']))
+                                            connection.commit()
+                                            st.success("Feed record updated successfully!")
+                                            st.session_state.show_update_feed = False
+                                            st.rerun()
+                                        except Error as e:
+                                            st.error(f"Error updating feed record: {e}")
+                                with col2:
+                                    if st.form_submit_button("Cancel"):
+                                        close_form('show_update_feed')
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    feed_view()
+    feed_actions()
 
 # Medical Records Page
 elif page == "Medical Records":
     st.title("Medical Records Management")
-    connection = create_connection()
     
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Get animals for dropdown
-            cursor.execute("SELECT animal_id, tag_number FROM Animal")
-            animals = cursor.fetchall()
-            animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
-            
-            # View medical records
-            st.subheader("Medical Records")
-            selected_animal_view = st.selectbox("Select Animal to View", options=["All"] + list(animal_options.keys()))
-            start_date = st.date_input("Start Date")
-            end_date = st.date_input("End Date")
-            
-            if selected_animal_view != "All":
-                animal_id = animal_options[selected_animal_view]
-                cursor.execute("""
-                    SELECT mr.date, mr.medicine_name, mr.quantity, mr.cost, mr.remarks, a.tag_number
-                    FROM Medicine_Record mr
-                    JOIN Animal a ON mr.animal_id = a.animal_id
-                    WHERE mr.animal_id = %s AND mr.date BETWEEN %s AND %s
-                    ORDER BY mr.date DESC
-                """, (animal_id, start_date, end_date))
-            else:
-                cursor.execute("""
-                    SELECT mr.date, mr.medicine_name, mr.quantity, mr.cost, mr.remarks, a.tag_number
+    # Data view reruns on its own when its filters change
+    @page_fragment
+    def medical_view():
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Get animals for dropdown
+                cursor.execute("SELECT animal_id, tag_number FROM Animal WHERE farm_id = %s AND status = 'active'",
+                               (farm_id,))
+                animals = cursor.fetchall()
+                animal_options = {f"{a['tag_number']} (ID: {a['animal_id']})": a['animal_id'] for a in animals}
+                write_queue.remember_animals(animal_options, farm_id)
+                
+                # View medical records
+                section_header("Medical Records")
+                selected_animal_view = st.selectbox("Select Animal to View", options=["All"] + list(animal_options.keys()))
+                start_date = st.date_input("Start Date")
+                end_date = st.date_input("End Date")
+                
+                if selected_animal_view != "All":
+                    animal_id = animal_options[selected_animal_view]
+                    where, params = "mr.animal_id = %s AND mr.date BETWEEN %s AND %s", (animal_id, start_date, end_date)
+                else:
+                    where, params = "mr.farm_id = %s AND mr.date BETWEEN %s AND %s", (farm_id, start_date, end_date)
+                
+                # Totals and the per-medicine breakdown are aggregated in SQL; only one page of rows is fetched
+                cursor.execute(f"""
+                    SELECT mr.medicine_name, COUNT(*) as records, SUM(mr.cost) as cost
                     FROM Medicine_Record mr
-                    JOIN Animal a ON mr.animal_id = a.animal_id
-                    WHERE mr.date BETWEEN %s AND %s
-                    ORDER BY mr.date DESC
-                """, (start_date, end_date))
-            
-            medical_records = pd.DataFrame(cursor.fetchall())
-            
+                    WHERE {where}
+                    GROUP BY mr.medicine_name
+                    ORDER BY cost DESC
+                """, params)
+                medicine_breakdown = pd.DataFrame(cursor.fetchall())
+                total_records = int(medicine_breakdown['records'].sum()) if not medicine_breakdown.empty else 0
+                medical_records = pd.DataFrame()
+                
+                if total_records:
+                    order_by, limit, offset = table_pager("medical", total_records, MEDICAL_SORT_COLUMNS,
+                                                          "mr.medicine_id")
+                    medical_records = frames.read_frame(connection, f"""
+                        SELECT mr.date, mr.medicine_name, mr.quantity, mr.cost, mr.remarks, a.tag_number
+                        FROM Medicine_Record mr
+                        JOIN Animal a ON mr.animal_id = a.animal_id
+                        WHERE {where}
+                        ORDER BY {order_by}
+                        LIMIT %s OFFSET %s
+                    """, (*params, limit, offset), frames.MEDICAL_RECORD_KINDS)
+                    st.dataframe(medical_records, use_container_width=True,
+                                 column_config={'date': st.column_config.DateColumn(format="YYYY-MM-DD")})
+                    
+                    # Calculate total medical cost
+                    total_cost = medicine_breakdown['cost'].sum()
+                    st.metric("Total Medical Cost", f"${total_cost:,.2f}")
+                    
+                    # Plot medicine distribution
+                    title = "Medicine Costs"
+                    if selected_animal_view != "All":
+                        title += f" for {selected_animal_view}"
+                    fig = px.bar(medicine_breakdown, x='medicine_name', y='cost', title=title)
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("No medical records found for the selected period.")
+                
+                st.session_state.medical_animal_options = animal_options
+                st.session_state.medical_records_view = medical_records
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    # Buttons and forms rerun on their own; a successful submit reruns the page
+    @page_fragment
+    def medical_actions():
+        animal_options = st.session_state.get('medical_animal_options') or write_queue.cached_animals(farm_id)
+        medical_records = st.session_state.get('medical_records_view', pd.DataFrame())
+        
+        # Action buttons below the heading
+        section_header("Actions")
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if st.button("➕ Add Medical Record"):
+                st.session_state.show_add_medical = True
+        
+        with col2:
             if not medical_records.empty:
-                st.dataframe(medical_records, use_container_width=True)
+                if st.button("✏️ Update Medical Record"):
+                    st.session_state.show_update_medical = True
+        
+        if not form_open('show_add_medical', 'show_update_medical'):
+            return
+        
+        # Add new medical record form
+        if st.session_state.get('show_add_medical', False):
+            with st.form("medical_form"):
+                st.subheader("Add New Medical Record")
+                selected_animal = st.selectbox("Select Animal", options=list(animal_options.keys()))
+                date = st.date_input("Date*")
+                medicine_name = st.text_input("Medicine Name*")
+                quantity = st.text_input("Quantity (e.g., 10ml)*")
+                cost = st.number_input("Cost ($)*", min_value=0.0, step=0.01)
+                remarks = st.text_area("Remarks")
                 
-                # Calculate total medical cost
-                total_cost = medical_records['cost'].sum()
-                st.metric("Total Medical Cost", f"${total_cost:,.2f}")
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.form_submit_button("Add Medical Record"):
+                        if medicine_name and quantity and cost:
+                            animal_id = animal_options[selected_animal]
+                            if save_record("Medicine_Record", {
+                                    'animal_id': animal_id, 'date': date, 'medicine_name': medicine_name,
+                                    'quantity': quantity, 'cost': cost, 'remarks': remarks,
+                                }, "Medical record"):
+                                st.session_state.show_add_medical = False
+                                st.rerun()
+                        else:
+                            st.error("Medicine name, quantity, and cost are required")
+                with col2:
+                    if st.form_submit_button("Cancel"):
+                        close_form('show_add_medical')
+        
+        # Updates need the database; new records can be queued while it is unreachable
+        if not st.session_state.get('show_update_medical', False):
+            return
+        
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
                 
-                # Plot medicine distribution
-                if selected_animal_view != "All":
-                    fig = px.bar(medical_records, x='medicine_name', y='cost',
-                                title=f"Medicine Costs for {selected_animal_view}")
+                # Update medical record form
+                if st.session_state.get('show_update_medical', False) and not medical_records.empty:
+                    with st.form("update_medical_form"):
+                        st.subheader("Update Medical Record")
+                        
+                        selected_record = st.selectbox("Select Record to Update", 
+                                                    options=medical_records['date'].dt.strftime('%Y-%m-%d') + " - " + 
+                                                    medical_records['tag_number'] + " - " + 
+                                                    medical_records['medicine_name'].astype(str))
+                        
+                        if selected_record:
+                            parts = selected_record.split(" - ")
+                            record_date = pd.to_datetime(parts[0]).date()
+                            tag_number = parts[1]
+                            medicine_name = parts[2]
+                            
+                            cursor.execute("""
+                                SELECT mr.medicine_id, mr.quantity, mr.cost, mr.remarks
+                                FROM Medicine_Record mr
+                                JOIN Animal a ON mr.animal_id = a.animal_id
+                                WHERE mr.date = %s AND a.tag_number = %s AND mr.medicine_name = %s AND a.farm_id = %s
+                            """, (record_date, tag_number, medicine_name, farm_id))
+                            record_data = cursor.fetchone()
+                            
+                            if record_data:
+                                new_quantity = st.text_input("New Quantity", value=record_data['quantity'])
+                                new_cost = st.number_input("New Cost ($)", 
+                                                        min_value=0.0, 
+                                                        step=0.01,
+                                                        value=record_data['cost'])
+                                new_remarks = st.text_area("New Remarks", value=record_data['remarks'] or "")
+                                
+                                col1, col2 = st.columns(2)
+                                with col1:
+                                    if st.form_submit_button("Update Medical Record"):
+                                        try:
+                                            cursor.execute("""
+                                                UPDATE Medicine_Record 
+                                                SET quantity = %s, cost = %s, remarks = %s
+                                                WHERE medicine_id = %s
+                                            """, (new_quantity, new_cost, new_remarks, record_data['medicine_id']))
+                                            connection.commit()
+                                            st.success("Medical record updated successfully!")
+                                            st.session_state.show_update_medical = False
+                                            st.rerun()
+                                        except Error as e:
+                                            st.error(f"Error updating medical record: {e}")
+                                with col2:
+                                    if st.form_submit_button("Cancel"):
+                                        close_form('show_update_medical')
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    medical_view()
+    medical_actions()
+
+# Animal Timeline Page
+elif page == "Animal Timeline":
+    st.title("Animal Timeline")
+    
+    # Rows per timeline page; one more is fetched to tell whether older events exist
+    TIMELINE_ROWS = 100
+    
+    # Keys of the last event on each page shown so far; the newest page has none
+    def reset_timeline():
+        st.session_state.timeline_cursors = [None]
+    
+    def older_events(cursor_key):
+        st.session_state.timeline_cursors.append(cursor_key)
+    
+    def newer_events():
+        st.session_state.timeline_cursors.pop()
+    
+    @page_fragment
+    def timeline_view():
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                cursor.execute("""
+                    SELECT animal_id, tag_number, breed, arrival_date, initial_weight_kg
+                    FROM Animal WHERE farm_id = %s ORDER BY tag_number
+                """, (farm_id,))
+                animals = {f"{a['tag_number']} (ID: {a['animal_id']})": a for a in cursor.fetchall()}
+                if not animals:
+                    st.info("No animals found. Add some animals first!")
+                    return
+                
+                selected_animal = st.selectbox("Select Animal", options=list(animals.keys()))
+                animal = animals[selected_animal]
+                st.caption(f"{animal['breed']} · arrived {animal['arrival_date']} at {animal['initial_weight_kg']} kg")
+                if st.session_state.get('timeline_animal') != animal['animal_id']:
+                    st.session_state.timeline_animal = animal['animal_id']
+                    reset_timeline()
+                before = st.session_state.timeline_cursors[-1] or (None, None, None)
+                
+                # Weights, feeds and medicines in one pass over the animal's indexed rows. Running totals
+                # are windowed over the whole history, then the page is cut by keyset on (date, kind, id).
+                timeline = frames.read_frame(connection, """
+                    WITH events AS (
+                        SELECT mw.month AS event_date, 'weight' AS kind, mw.weight_id AS event_id,
+                               NULL AS item, NULL AS quantity, mw.weight_kg AS weight_kg, NULL AS cost
+                        FROM Monthly_Weight mw WHERE mw.animal_id = %(animal_id)s
+                        UNION ALL
+                        SELECT fr.date, 'feed', fr.feed_id, fr.feed_type, CAST(fr.quantity_kg AS CHAR), NULL, fr.cost
+                        FROM Feed_Record fr WHERE fr.animal_id = %(animal_id)s
+                        UNION ALL
+                        SELECT mr.date, 'medicine', mr.medicine_id, mr.medicine_name, mr.quantity, NULL, mr.cost
+                        FROM Medicine_Record mr WHERE mr.animal_id = %(animal_id)s
+                    ), timeline AS (
+                        SELECT events.*,
+                               SUM(COALESCE(cost, 0)) OVER (ORDER BY event_date, kind, event_id) AS cumulative_cost,
+                               weight_kg - LAG(weight_kg) OVER (PARTITION BY kind ORDER BY event_date, event_id)
+                                   AS weight_change_kg,
+                               weight_kg - %(initial_weight)s AS gain_since_arrival_kg
+                        FROM events
+                    )
+                    SELECT * FROM timeline
+                    WHERE %(before_date)s IS NULL
+                       OR (event_date, kind, event_id) < (%(before_date)s, %(before_kind)s, %(before_id)s)
+                    ORDER BY event_date DESC, kind DESC, event_id DESC
+                    LIMIT %(rows)s
+                """, {'animal_id': animal['animal_id'], 'initial_weight': animal['initial_weight_kg'],
+                      'before_date': before[0], 'before_kind': before[1], 'before_id': before[2],
+                      'rows': TIMELINE_ROWS + 1}, frames.TIMELINE_KINDS)
+                
+                has_older = len(timeline) > TIMELINE_ROWS
+                timeline = timeline.iloc[:TIMELINE_ROWS]
+                
+                if not timeline.empty:
+                    newest = timeline.iloc[0]
+                    weights = timeline['weight_kg'].dropna()
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric(f"Cost to {newest['event_date']:%Y-%m-%d}", f"${newest['cumulative_cost']:,.2f}")
+                    with col2:
+                        st.metric("Latest weight on this page", f"{weights.iloc[0]:.1f} kg" if not weights.empty else "—")
+                    with col3:
+                        st.metric("Events on this page", len(timeline))
+                    
+                    st.dataframe(timeline.drop(columns=['event_id']), use_container_width=True,
+                                 column_config={'event_date': st.column_config.DateColumn("date", format="YYYY-MM-DD")})
+                    
+                    fig = px.line(timeline, x='event_date', y='cumulative_cost',
+                                 title=f"Cumulative Cost for {animal['tag_number']}")
                     st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No medical records found for the selected period.")
+                else:
+                    st.info("No weight, feed or medical records for this animal yet.")
+                
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.button("⬅️ Newer", disabled=len(st.session_state.timeline_cursors) == 1,
+                              on_click=newer_events)
+                with col2:
+                    last = timeline.iloc[-1] if not timeline.empty else None
+                    st.button("Older ➡️", disabled=not has_older, on_click=older_events,
+                              args=((last['event_date'].date(), str(last['kind']), int(last['event_id'])),)
+                              if has_older else None)
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    timeline_view()
+
+# Cohort Analytics Page
+elif page == "Cohort Analytics":
+    st.title("Cohort Analytics")
+    
+    # Cohort definitions; only these expressions reach the SQL
+    COHORTS = {
+        "Breed": "COALESCE(a.breed, 'Unknown')",
+        "Category": "COALESCE(ac.name, 'Uncategorized')",
+        "Arrival month": "DATE_FORMAT(a.arrival_date, '%%Y-%%m')",
+        "Arrival year": "CAST(YEAR(a.arrival_date) AS CHAR)",
+    }
+    # Every animal the farm has had, archived ones included, so cohort sizes and mortality still
+    # count the animals that left; their records are read from the archive tables alike
+    COHORT_ANIMALS = """
+        SELECT animal_id, category_id, breed, arrival_date, initial_weight_kg, status
+        FROM Animal WHERE farm_id = %(farm_id)s
+        UNION ALL
+        SELECT animal_id, category_id, breed, arrival_date, initial_weight_kg, status
+        FROM Animal_Archive WHERE farm_id = %(farm_id)s
+    """
+    COHORT_WEIGHTS = """
+        SELECT weight_id, animal_id, month, weight_kg FROM Monthly_Weight WHERE farm_id = %(farm_id)s
+        UNION ALL
+        SELECT weight_id, animal_id, month, weight_kg FROM Monthly_Weight_Archive WHERE farm_id = %(farm_id)s
+    """
+    
+    # Reports are cached per farm and cohort definition; records added since show up once the
+    # cache expires or the report is refreshed
+    @st.cache_data(ttl=int(os.environ.get("FARM_COHORT_CACHE_SECONDS", "600")), show_spinner=False)
+    def cohort_report(farm_id, cohort):
+        expression = COHORTS[cohort]
+        # Per-animal costs and latest weight are aggregated by the database, then rolled up per
+        # cohort; the farm_animal indexes cover each per-animal pass
+        results = run_queries({
+            'cohorts': (f"""
+                WITH herd AS ({COHORT_ANIMALS}
+                ), feed AS (
+                    SELECT animal_id, SUM(cost) AS feed_cost FROM (
+                        SELECT animal_id, cost FROM Feed_Record WHERE farm_id = %(farm_id)s
+                        UNION ALL
+                        SELECT animal_id, cost FROM Feed_Record_Archive WHERE farm_id = %(farm_id)s
+                    ) records GROUP BY animal_id
+                ), medicine AS (
+                    SELECT animal_id, SUM(cost) AS medicine_cost FROM (
+                        SELECT animal_id, cost FROM Medicine_Record WHERE farm_id = %(farm_id)s
+                        UNION ALL
+                        SELECT animal_id, cost FROM Medicine_Record_Archive WHERE farm_id = %(farm_id)s
+                    ) records GROUP BY animal_id
+                ), weights AS (
+                    SELECT animal_id, month, weight_kg,
+                           ROW_NUMBER() OVER (PARTITION BY animal_id ORDER BY month DESC, weight_id DESC) AS newest
+                    FROM ({COHORT_WEIGHTS}) records
+                ), animals AS (
+                    SELECT {expression} AS cohort, a.status,
+                           w.weight_kg - a.initial_weight_kg AS gain_kg,
+                           (w.weight_kg - a.initial_weight_kg) / NULLIF(DATEDIFF(w.month, a.arrival_date), 0)
+                               AS daily_gain_kg,
+                           COALESCE(feed.feed_cost, 0) AS feed_cost,
+                           COALESCE(medicine.medicine_cost, 0) AS medicine_cost
+                    FROM herd a
+                    LEFT JOIN Animal_Category ac ON a.category_id = ac.category_id
+                    LEFT JOIN weights w ON w.animal_id = a.animal_id AND w.newest = 1
+                    LEFT JOIN feed ON feed.animal_id = a.animal_id
+                    LEFT JOIN medicine ON medicine.animal_id = a.animal_id
+                )
+                SELECT cohort, COUNT(*) AS animals,
+                       100.0 * COUNT(*) / SUM(COUNT(*)) OVER () AS herd_share_pct,
+                       100.0 * SUM(CASE WHEN status = 'deceased' THEN 1 ELSE 0 END) / COUNT(*) AS mortality_pct,
+                       AVG(gain_kg) AS avg_gain_kg, AVG(daily_gain_kg) AS avg_daily_gain_kg,
+                       AVG(feed_cost) AS avg_feed_cost, AVG(medicine_cost) AS avg_medicine_cost,
+                       SUM(CASE WHEN gain_kg IS NOT NULL THEN feed_cost + medicine_cost END)
+                           / NULLIF(SUM(gain_kg), 0) AS cost_per_kg_gain,
+                       RANK() OVER (ORDER BY AVG(daily_gain_kg) DESC) AS gain_rank
+                FROM animals GROUP BY cohort ORDER BY cohort
+            """, {'farm_id': farm_id}, frames.COHORT_KINDS),
+            'trend': (f"""
+                WITH herd AS ({COHORT_ANIMALS})
+                SELECT {expression} AS cohort, mw.month, AVG(mw.weight_kg) AS avg_weight_kg
+                FROM ({COHORT_WEIGHTS}) mw
+                JOIN herd a ON mw.animal_id = a.animal_id
+                LEFT JOIN Animal_Category ac ON a.category_id = ac.category_id
+                GROUP BY cohort, mw.month ORDER BY mw.month
+            """, {'farm_id': farm_id}, frames.COHORT_TREND_KINDS),
+        }, shard=farms.shard_of(farm_id))
+        results['computed_at'] = datetime.now()
+        return results
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        cohort = st.selectbox("Group animals by", options=list(COHORTS))
+    with col2:
+        if st.button("🔄 Refresh"):
+            cohort_report.clear()
+    
+    try:
+        report = cohort_report(farm_id, cohort)
+        cohorts = report['cohorts']
+        
+        if not cohorts.empty:
+            st.caption(f"Computed at {report['computed_at']:%Y-%m-%d %H:%M}")
+            st.dataframe(cohorts, use_container_width=True, hide_index=True, column_config={
+                'herd_share_pct': st.column_config.NumberColumn("herd share", format="%.1f%%"),
+                'mortality_pct': st.column_config.NumberColumn("mortality", format="%.1f%%"),
+                'avg_gain_kg': st.column_config.NumberColumn("avg gain (kg)", format="%.1f"),
+                'avg_daily_gain_kg': st.column_config.NumberColumn("avg daily gain (kg)", format="%.3f"),
+                'avg_feed_cost': st.column_config.NumberColumn("avg feed cost", format="$%.2f"),
+                'avg_medicine_cost': st.column_config.NumberColumn("avg medicine cost", format="$%.2f"),
+                'cost_per_kg_gain': st.column_config.NumberColumn("cost per kg gained", format="$%.2f"),
+            })
             
-            # Action buttons below the heading
-            st.subheader("Actions")
             col1, col2 = st.columns(2)
-            
             with col1:
-                if st.button("➕ Add Medical Record"):
-                    st.session_state.show_add_medical = True
-            
+                fig = px.bar(cohorts, x='cohort', y='avg_daily_gain_kg',
+                             title=f"Average Daily Gain by {cohort}",
+                             labels={'avg_daily_gain_kg': 'kg / day'})
+                st.plotly_chart(fig, use_container_width=True)
             with col2:
-                if not medical_records.empty:
-                    if st.button("✏️ Update Medical Record"):
-                        st.session_state.show_update_medical = True
+                fig = px.bar(cohorts, x='cohort', y=['avg_feed_cost', 'avg_medicine_cost'],
+                             title=f"Average Cost per Animal by {cohort}",
+                             labels={'value': 'Amount ($)', 'variable': 'Category'})
+                st.plotly_chart(fig, use_container_width=True)
             
-            # Add new medical record form
-            if st.session_state.get('show_add_medical', False):
-                with st.form("medical_form"):
-                    st.subheader("Add New Medical Record")
-                    selected_animal = st.selectbox("Select Animal", options=list(animal_options.keys()))
-                    date = st.date_input("Date*")
-                    medicine_name = st.text_input("Medicine Name*")
-                    quantity = st.text_input("Quantity (e.g., 10ml)*")
-                    cost = st.number_input("Cost ($)*", min_value=0.0, step=0.01)
-                    remarks = st.text_area("Remarks")
-                    
-                    col1, col2 = st.columns(2)
+            trend = report['trend']
+            if not trend.empty:
+                fig = px.line(trend, x='month', y='avg_weight_kg', color='cohort',
+                             title=f"Average Weight by {cohort}")
+                st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No animals found. Add some animals first!")
+    except Error as e:
+        st.error(f"Error retrieving data: {e}")
+
+# Forecasts Page
+elif page == "Forecasts":
+    st.title("Forecasts")
+    
+    # Weight projections re-read only when their inputs change
+    @page_fragment
+    def weight_forecast_view():
+        section_header("Projected Weights")
+        col1, col2 = st.columns(2)
+        with col1:
+            target_date = st.date_input("Target Date", value=datetime.now().date() + timedelta(days=90))
+        with col2:
+            sale_weight = st.number_input("Sale Weight (kg)", min_value=0.0, value=500.0, step=10.0)
+        
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Each animal's fitted line is extended to the target date in SQL; only one page of rows is fetched
+                projection = "wf.anchor_kg + wf.gain_kg_per_day * DATEDIFF(%(target)s, wf.anchor_month)"
+                params = {'farm_id': farm_id, 'target': target_date, 'sale_kg': sale_weight}
+                cursor.execute(f"""
+                    SELECT COUNT(*) AS animals,
+                           COALESCE(SUM(CASE WHEN {projection} >= %(sale_kg)s THEN 1 ELSE 0 END), 0) AS ready,
+                           AVG({projection}) AS avg_projected_kg
+                    FROM Weight_Forecast wf
+                    JOIN Animal a ON wf.animal_id = a.animal_id
+                    WHERE wf.farm_id = %(farm_id)s AND a.status = 'active'
+                """, params)
+                summary = cursor.fetchone()
+                
+                if summary['animals']:
+                    col1, col2, col3 = st.columns(3)
                     with col1:
-                        if st.form_submit_button("Add Medical Record"):
-                            if medicine_name and quantity and cost:
-                                animal_id = animal_options[selected_animal]
-                                try:
-                                    cursor.execute("""
-                                        INSERT INTO Medicine_Record (animal_id, date, medicine_name, quantity, cost, remarks)
-                                        VALUES (%s, %s, %s, %s, %s, %s)
-                                    """, (animal_id, date, medicine_name, quantity, cost, remarks))
-                                    connection.commit()
-                                    st.success("Medical record added successfully!")
-                                    st.session_state.show_add_medical = False
-                                    st.rerun()
-                                except Error as e:
-                                    st.error(f"Error adding medical record: {e}")
-                            else:
-                                st.error("Medicine name, quantity, and cost are required")
+                        st.metric("Animals Forecast", f"{summary['animals']:,}")
                     with col2:
-                        if st.form_submit_button("Cancel"):
-                            st.session_state.show_add_medical = False
-            
-            # Update medical record form
-            if st.session_state.get('show_update_medical', False) and not medical_records.empty:
-                with st.form("update_medical_form"):
-                    st.subheader("Update Medical Record")
-                    
-                    selected_record = st.selectbox("Select Record to Update", 
-                                                options=medical_records['date'].astype(str) + " - " + 
-                                                medical_records['tag_number'] + " - " + 
-                                                medical_records['medicine_name'])
+                        st.metric(f"At {sale_weight:,.0f} kg by {target_date}", f"{summary['ready']:,}")
+                    with col3:
+                        st.metric("Average Projected Weight", f"{summary['avg_projected_kg']:,.1f} kg")
                     
-                    if selected_record:
-                        parts = selected_record.split(" - ")
-                        record_date = pd.to_datetime(parts[0]).date()
-                        tag_number = parts[1]
-                        medicine_name = parts[2]
+                    order_by, limit, offset = table_pager("forecast", summary['animals'], FORECAST_SORT_COLUMNS,
+                                                          "wf.animal_id")
+                    projections = frames.read_frame(connection, f"""
+                        SELECT a.tag_number, a.breed, wf.anchor_month, {projection} AS projected_kg,
+                               wf.gain_kg_per_day, wf.residual_kg, wf.points, wf.mean_offset_days, wf.spread_days2,
+                               DATEDIFF(%(target)s, wf.anchor_month) AS days_ahead
+                        FROM Weight_Forecast wf
+                        JOIN Animal a ON wf.animal_id = a.animal_id
+                        WHERE wf.farm_id = %(farm_id)s AND a.status = 'active'
+                        ORDER BY {order_by}
+                        LIMIT %(limit)s OFFSET %(offset)s
+                    """, dict(params, limit=limit, offset=offset), frames.WEIGHT_FORECAST_KINDS)
+                    projections['give_or_take_kg'] = forecast.prediction_interval(projections)
+                    projections['reaches_sale_weight'] = projections['projected_kg'] >= sale_weight
+                    st.dataframe(projections[['tag_number', 'breed', 'anchor_month', 'gain_kg_per_day', 'projected_kg',
+                                              'give_or_take_kg', 'reaches_sale_weight']],
+                                 use_container_width=True, hide_index=True, column_config={
+                                     'anchor_month': st.column_config.DateColumn("last weighed", format="YYYY-MM"),
+                                     'gain_kg_per_day': st.column_config.NumberColumn("gain (kg/day)", format="%.2f"),
+                                     'projected_kg': st.column_config.NumberColumn("projected (kg)", format="%.1f"),
+                                     'give_or_take_kg': st.column_config.NumberColumn("± kg (95%)", format="%.1f"),
+                                 })
+                else:
+                    st.info("No forecasts yet; animals need two weigh-ins in different months.")
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    weight_forecast_view()
+    
+    try:
+        results = run_queries({
+            'expense_forecast': ("""
+                SELECT month, category, amount FROM Expense_Forecast WHERE farm_id = %s ORDER BY month
+            """, (farm_id,), frames.EXPENSE_FORECAST_KINDS),
+            'expense_history': ("""
+                SELECT month, total_expense FROM Expense_Summary WHERE farm_id = %s ORDER BY month DESC LIMIT 24
+            """, (farm_id,), frames.EXPENSE_KINDS),
+        })
+        
+        # Projected monthly expenses next to the months they continue from
+        section_header("Projected Expenses")
+        expense_forecast = results['expense_forecast']
+        
+        if not expense_forecast.empty:
+            projected = expense_forecast.pivot_table(index='month', columns='category', values='amount',
+                                                     aggfunc='sum', observed=True)
+            projected.columns = projected.columns.astype(str)
+            projected = projected.reset_index()
+            history = results['expense_history']
+            trend = pd.concat([history.assign(series='Recorded'),
+                               projected[['month', 'total_expense']].assign(series='Projected')])
+            fig = px.line(trend.sort_values('month'), x='month', y='total_expense', color='series',
+                          title="Monthly Expenses", markers=True)
+            st.plotly_chart(fig, use_container_width=True)
+            
+            fig = px.bar(projected, x='month', y=list(forecast.EXPENSE_CATEGORIES),
+                         title="Projected Expense Breakdown",
+                         labels={'value': 'Amount ($)', 'variable': 'Category'})
+            st.plotly_chart(fig, use_container_width=True)
+            
+            projected['month'] = projected['month'].dt.strftime('%Y-%m')
+            st.dataframe(projected, use_container_width=True, hide_index=True)
+        else:
+            st.info("No expense forecast yet; it needs two months of expense summaries.")
+    except Error as e:
+        st.error(f"Error retrieving data: {e}")
+
+# Staff Management Page
+elif page == "Staff Management":
+    st.title("Staff Management")
+    
+    # Buttons and forms rerun on their own; a successful submit reruns the page
+    @page_fragment
+    def staff_actions(staff):
+        # Action buttons below the heading
+        section_header("Actions")
+        col1, col2, col3 = st.columns(3)
+        
+        with col1:
+            if st.button("➕ Add New Staff"):
+                st.session_state.show_add_staff = True
+        
+        with col2:
+            if staff:
+                if st.button("✏️ Update Staff"):
+                    st.session_state.show_update_staff = True
+        
+        with col3:
+            if staff:
+                if st.button("🗑️ Delete Staff"):
+                    st.session_state.show_delete_staff = True
+        
+        if not form_open('show_add_staff', 'show_update_staff', 'show_delete_staff'):
+            return
+        
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Add new staff form
+                if st.session_state.get('show_add_staff', False):
+                    with st.form("staff_form"):
+                        st.subheader("Add New Staff Member")
+                        name = st.text_input("Name*")
+                        role = st.text_input("Role*")
+                        salary = st.number_input("Monthly Salary ($)*", min_value=0.0, step=0.01)
+                        image = st.file_uploader("Staff Photo", type=['jpg', 'jpeg', 'png'])
                         
-                        cursor.execute("""
-                            SELECT mr.medicine_id, mr.quantity, mr.cost, mr.remarks
-                            FROM Medicine_Record mr
-                            JOIN Animal a ON mr.animal_id = a.animal_id
-                            WHERE mr.date = %s AND a.tag_number = %s AND mr.medicine_name = %s
-                        """, (record_date, tag_number, medicine_name))
-                        record_data = cursor.fetchone()
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if st.form_submit_button("Add Staff"):
+                                if name and role and salary:
+                                    try:
+                                        image_job = images.new_job() if image else None
+                                        cursor.execute("""
+                                            INSERT INTO Staff (farm_id, name, role, salary_per_month, image_job)
+                                            VALUES (%s, %s, %s, %s, %s)
+                                        """, (farm_id, name, role, salary, image_job))
+                                        connection.commit()
+                                        queue_image("Staff", cursor.lastrowid, image_job, image)
+                                        st.success("Staff member added successfully!")
+                                        st.session_state.show_add_staff = False
+                                        st.rerun()
+                                    except Error as e:
+                                        st.error(f"Error adding staff member: {e}")
+                                else:
+                                    st.error("Name, role, and salary are required")
+                        with col2:
+                            if st.form_submit_button("Cancel"):
+                                close_form('show_add_staff')
+                
+                # Update staff form
+                if st.session_state.get('show_update_staff', False) and staff:
+                    with st.form("edit_staff_form"):
+                        st.subheader("Update Staff Member")
+                        
+                        staff_options = {f"{s['name']} (ID: {s['staff_id']})": s['staff_id'] for s in staff}
+                        selected_staff = st.selectbox("Select Staff", options=list(staff_options.keys()))
                         
-                        if record_data:
-                            new_quantity = st.text_input("New Quantity", value=record_data['quantity'])
-                            new_cost = st.number_input("New Cost ($)", 
-                                                    min_value=0.0, 
-                                                    step=0.01,
-                                                    value=record_data['cost'])
-                            new_remarks = st.text_area("New Remarks", value=record_data['remarks'] or "")
+                        if selected_staff:
+                            staff_id = staff_options[selected_staff]
+                            cursor.execute("SELECT * FROM Staff WHERE staff_id = %s AND farm_id = %s", (staff_id, farm_id))
+                            staff_data = cursor.fetchone()
+                            
+                            new_name = st.text_input("Name", value=staff_data['name'])
+                            new_role = st.text_input("Role", value=staff_data['role'])
+                            new_salary = st.number_input(
+                                "Monthly Salary ($)", 
+                                min_value=0.0, 
+                                step=0.01,
+                                value=staff_data['salary_per_month']
+                            )
+                            new_image = st.file_uploader("Update Photo", type=['jpg', 'jpeg', 'png'])
+                            
+                            if staff_data['image'] or staff_data['image_hash'] or staff_data['image_job']:
+                                st.markdown("**Current Photo:**")
+                                display_card_image(staff_data)
                             
                             col1, col2 = st.columns(2)
                             with col1:
-                                if st.form_submit_button("Update Medical Record"):
+                                if st.form_submit_button("Update Staff"):
                                     try:
+                                        image_job = images.new_job() if new_image else None
                                         cursor.execute("""
-                                            UPDATE Medicine_Record 
-                                            SET quantity = %s, cost = %s, remarks = %s
-                                            WHERE medicine_id = %s
-                                        """, (new_quantity, new_cost, new_remarks, record_data['medicine_id']))
+                                            UPDATE Staff 
+                                            SET name = %s, role = %s, salary_per_month = %s, image_job = COALESCE(%s, image_job)
+                                            WHERE staff_id = %s AND farm_id = %s
+                                        """, (new_name, new_role, new_salary, image_job, staff_id, farm_id))
                                         connection.commit()
-                                        st.success("Medical record updated successfully!")
-                                        st.session_state.show_update_medical = False
+                                        queue_image("Staff", staff_id, image_job, new_image)
+                                        st.success("Staff member updated successfully!")
+                                        st.session_state.show_update_staff = False
                                         st.rerun()
                                     except Error as e:
-                                        st.error(f"Error updating medical record: {e}")
+                                        st.error(f"Error updating staff member: {e}")
                             with col2:
                                 if st.form_submit_button("Cancel"):
-                                    st.session_state.show_update_medical = False
-            
-        except Error as e:
-            st.error(f"Error retrieving data: {e}")
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
-
-# Staff Management Page
-elif page == "Staff Management":
-    st.title("Staff Management")
+                                    close_form('show_update_staff')
+                
+                # Delete staff form
+                if st.session_state.get('show_delete_staff', False) and staff:
+                    with st.form("delete_staff_form"):
+                        st.subheader("Delete Staff Member")
+                        st.warning("Warning: This action cannot be undone")
+                        
+                        staff_options = {f"{s['name']} (ID: {s['staff_id']})": s['staff_id'] for s in staff}
+                        selected_staff = st.selectbox("Select Staff to Delete", options=list(staff_options.keys()))
+                        
+                        if selected_staff:
+                            staff_id = staff_options[selected_staff]
+                            
+                            col1, col2 = st.columns(2)
+                            with col1:
+                                if st.form_submit_button("Delete Staff"):
+                                    try:
+                                        cursor.execute("DELETE FROM Staff WHERE staff_id = %s AND farm_id = %s", (staff_id, farm_id))
+                                        connection.commit()
+                                        st.success("Staff member deleted successfully!")
+                                        st.session_state.show_delete_staff = False
+                                        st.rerun()
+                                    except Error as e:
+                                        st.error(f"Error deleting staff member: {e}")
+                            with col2:
+                                if st.form_submit_button("Cancel"):
+                                    close_form('show_delete_staff')
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
     connection = create_connection()
     
     if connection:
@@ -1223,149 +2237,36 @@ elif page == "Staff Management":
             cursor = connection.cursor(dictionary=True)
             
             # Display all staff
-            st.subheader("All Staff Members")
+            section_header("All Staff Members")
             
-            cursor.execute("SELECT * FROM Staff")
+            cursor.execute("SELECT * FROM Staff WHERE farm_id = %s", (farm_id,))
             staff = cursor.fetchall()
             
             if staff:
-                cols = st.columns(3)
-                for idx, staff_member in enumerate(staff):
-                    with cols[idx % 3]:
-                        st.markdown(f"""
-                            <div class="animal-card">
-                                <h3>{staff_member['name']}</h3>
-                                <p><strong>Role:</strong> {staff_member['role']}</p>
-                                <p><strong>Salary:</strong> ${staff_member['salary_per_month']:,.2f}/month</p>
-                        """, unsafe_allow_html=True)
-                        if staff_member['image']:
-                            display_image(staff_member['image'])
-                        st.markdown("</div>", unsafe_allow_html=True)
+                if use_gallery(staff):
+                    gallery.render_gallery([
+                        gallery.card(staff_member['name'], [
+                            ("Role", staff_member['role']),
+                            ("Salary", f"${staff_member['salary_per_month']:,.2f}/month"),
+                        ], card_image_url(staff_member), staff_member['image_job'])
+                        for staff_member in staff
+                    ])
+                else:
+                    cols = st.columns(3)
+                    for idx, staff_member in enumerate(staff):
+                        with cols[idx % 3]:
+                            st.markdown(f"""
+                                <div class="animal-card">
+                                    <h3>{staff_member['name']}</h3>
+                                    <p><strong>Role:</strong> {staff_member['role']}</p>
+                                    <p><strong>Salary:</strong> ${staff_member['salary_per_month']:,.2f}/month</p>
+                            """, unsafe_allow_html=True)
+                            display_card_image(staff_member)
+                            st.markdown("</div>", unsafe_allow_html=True)
             else:
                 st.info("No staff members found.")
             
-            # Action buttons below the heading
-            st.subheader("Actions")
-            col1, col2, col3 = st.columns(3)
-            
-            with col1:
-                if st.button("➕ Add New Staff"):
-                    st.session_state.show_add_staff = True
-            
-            with col2:
-                if staff:
-                    if st.button("✏️ Update Staff"):
-                        st.session_state.show_update_staff = True
-            
-            with col3:
-                if staff:
-                    if st.button("🗑️ Delete Staff"):
-                        st.session_state.show_delete_staff = True
-            
-            # Add new staff form
-            if st.session_state.get('show_add_staff', False):
-                with st.form("staff_form"):
-                    st.subheader("Add New Staff Member")
-                    name = st.text_input("Name*")
-                    role = st.text_input("Role*")
-                    salary = st.number_input("Monthly Salary ($)*", min_value=0.0, step=0.01)
-                    image = st.file_uploader("Staff Photo", type=['jpg', 'jpeg', 'png'])
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Add Staff"):
-                            if name and role and salary:
-                                try:
-                                    image_data = image.read() if image else None
-                                    cursor.execute("""
-                                        INSERT INTO Staff (name, role, salary_per_month, image)
-                                        VALUES (%s, %s, %s, %s)
-                                    """, (name, role, salary, image_data))
-                                    connection.commit()
-                                    st.success("Staff member added successfully!")
-                                    st.session_state.show_add_staff = False
-                                    st.rerun()
-                                except Error as e:
-                                    st.error(f"Error adding staff member: {e}")
-                            else:
-                                st.error("Name, role, and salary are required")
-                    with col2:
-                        if st.form_submit_button("Cancel"):
-                            st.session_state.show_add_staff = False
-            
-            # Update staff form
-            if st.session_state.get('show_update_staff', False) and staff:
-                with st.form("edit_staff_form"):
-                    st.subheader("Update Staff Member")
-                    
-                    staff_options = {f"{s['name']} (ID: {s['staff_id']})": s['staff_id'] for s in staff}
-                    selected_staff = st.selectbox("Select Staff", options=list(staff_options.keys()))
-                    
-                    if selected_staff:
-                        staff_id = staff_options[selected_staff]
-                        cursor.execute("SELECT * FROM Staff WHERE staff_id = %s", (staff_id,))
-                        staff_data = cursor.fetchone()
-                        
-                        new_name = st.text_input("Name", value=staff_data['name'])
-                        new_role = st.text_input("Role", value=staff_data['role'])
-                        new_salary = st.number_input(
-                            "Monthly Salary ($)", 
-                            min_value=0.0, 
-                            step=0.01,
-                            value=staff_data['salary_per_month']
-                        )
-                        new_image = st.file_uploader("Update Photo", type=['jpg', 'jpeg', 'png'])
-                        
-                        if staff_data['image']:
-                            st.markdown("**Current Photo:**")
-                            display_image(staff_data['image'])
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            if st.form_submit_button("Update Staff"):
-                                try:
-                                    image_data = new_image.read() if new_image else staff_data['image']
-                                    cursor.execute("""
-                                        UPDATE Staff 
-                                        SET name = %s, role = %s, salary_per_month = %s, image = %s
-                                        WHERE staff_id = %s
-                                    """, (new_name, new_role, new_salary, image_data, staff_id))
-                                    connection.commit()
-                                    st.success("Staff member updated successfully!")
-                                    st.session_state.show_update_staff = False
-                                    st.rerun()
-                                except Error as e:
-                                    st.error(f"Error updating staff member: {e}")
-                        with col2:
-                            if st.form_submit_button("Cancel"):
-                                st.session_state.show_update_staff = False
-            
-            # Delete staff form
-            if st.session_state.get('show_delete_staff', False) and staff:
-                with st.form("delete_staff_form"):
-                    st.subheader("Delete Staff Member")
-                    st.warning("Warning: This action cannot be undone")
-                    
-                    staff_options = {f"{s['name']} (ID: {s['staff_id']})": s['staff_id'] for s in staff}
-                    selected_staff = st.selectbox("Select Staff to Delete", options=list(staff_options.keys()))
-                    
-                    if selected_staff:
-                        staff_id = staff_options[selected_staff]
-                        
-                        col1, col2 = st.columns(2)
-                        with col1:
-                            if st.form_submit_button("Delete Staff"):
-                                try:
-                                    cursor.execute("DELETE FROM Staff WHERE staff_id = %s", (staff_id,))
-                                    connection.commit()
-                                    st.success("Staff member deleted successfully!")
-                                    st.session_state.show_delete_staff = False
-                                    st.rerun()
-                                except Error as e:
-                                    st.error(f"Error deleting staff member: {e}")
-                        with col2:
-                            if st.form_submit_button("Cancel"):
-                                st.session_state.show_delete_staff = False
+            staff_actions([{'staff_id': s['staff_id'], 'name': s['name']} for s in staff])
             
         except Error as e:
             st.error(f"Error retrieving data: {e}")
@@ -1377,256 +2278,391 @@ elif page == "Staff Management":
 # Financial Overview Page
 elif page == "Financial Overview":
     st.title("Financial Overview")
-    connection = create_connection()
     
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            
-            # Display expense summary
-            st.subheader("Expense Summary")
-            
-            cursor.execute("SELECT * FROM Expense_Summary ORDER BY month DESC")
-            expenses = pd.DataFrame(cursor.fetchall())
-            
+    # Buttons and forms rerun on their own; a successful submit reruns the page
+    @page_fragment
+    def expense_actions(expenses):
+        # Action buttons below the heading
+        section_header("Actions")
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if st.button("➕ Add Expense Summary"):
+                st.session_state.show_add_expense = True
+        
+        with col2:
             if not expenses.empty:
-                # Convert month to string if not datetime
-                if not pd.api.types.is_datetime64_any_dtype(expenses['month']):
-                    expenses['month'] = pd.to_datetime(expenses['month']).dt.strftime('%Y-%m')
-                else:
-                    expenses['month'] = expenses['month'].dt.strftime('%Y-%m')
-                st.dataframe(expenses, use_container_width=True)
-                
-                # Expense trends chart
-                st.subheader("Expense Trends")
-                fig = px.line(expenses, x='month', y='total_expense',
-                             title="Total Monthly Expenses",
-                             markers=True)
-                st.plotly_chart(fig, use_container_width=True)
+                if st.button("✏️ Update Expense Summary"):
+                    st.session_state.show_update_expense = True
+        
+        if not form_open('show_add_expense', 'show_update_expense'):
+            return
+        
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
                 
-                # Expense composition chart
-                st.subheader("Expense Composition")
-                fig = px.bar(expenses, x='month',
-                            y=['total_feed_cost', 'total_medicine_cost',
-                               'total_salaries', 'total_utilities', 'other_expenses'],
-                            title="Expense Breakdown by Category",
-                            labels={'value': 'Amount ($)', 'variable': 'Category'})
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No expense records found.")
-            
-            # Action buttons below the heading
-            st.subheader("Actions")
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                if st.button("➕ Add Expense Summary"):
-                    st.session_state.show_add_expense = True
-            
-            with col2:
-                if not expenses.empty:
-                    if st.button("✏️ Update Expense Summary"):
-                        st.session_state.show_update_expense = True
-            
-            # Add new expense summary form
-            if st.session_state.get('show_add_expense', False):
-                with st.form("expense_form"):
-                    st.subheader("Add New Expense Summary")
-                    month = st.date_input("Month*")
-                    feed_cost = st.number_input("Total Feed Cost ($)", min_value=0.0, step=0.01)
-                    medicine_cost = st.number_input("Total Medicine Cost ($)", min_value=0.0, step=0.01)
-                    salaries = st.number_input("Total Salaries ($)", min_value=0.0, step=0.01)
-                    utilities = st.number_input("Total Utilities ($)", min_value=0.0, step=0.01)
-                    other_expenses = st.number_input("Other Expenses ($)", min_value=0.0, step=0.01)
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Add Expense Summary"):
-                            total = feed_cost + medicine_cost + salaries + utilities + other_expenses
-                            try:
-                                cursor.execute("""
-                                    INSERT INTO Expense_Summary 
-                                    (month, total_feed_cost, total_medicine_cost, total_salaries, 
-                                     total_utilities, other_expenses, total_expense)
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                                """, (month, feed_cost, medicine_cost, salaries, utilities, other_expenses, total))
-                                connection.commit()
-                                st.success("Expense summary added successfully!")
-                                st.session_state.show_add_expense = False
-                                st.rerun()
-                            except Error as e:
-                                st.error(f"Error adding expense summary: {e}")
-                    with col2:
-                        if st.form_submit_button("Cancel"):
-                            st.session_state.show_add_expense = False
-            
-            # Update expense summary form
-            if st.session_state.get('show_update_expense', False) and not expenses.empty:
-                with st.form("update_expense_form"):
-                    st.subheader("Update Expense Summary")
-                    
-                    selected_month = st.selectbox("Select Month to Update", options=expenses['month'])
-                    
-                    cursor.execute("SELECT * FROM Expense_Summary WHERE month = %s", 
-                                 (pd.to_datetime(selected_month),))
-                    expense_data = cursor.fetchone()
-                    
-                    if expense_data:
-                        new_feed = st.number_input("Feed Cost ($)", 
-                                                 min_value=0.0, 
-                                                 step=0.01,
-                                                 value=expense_data['total_feed_cost'])
-                        new_med = st.number_input("Medicine Cost ($)", 
-                                                 min_value=0.0, 
-                                                 step=0.01,
-                                                 value=expense_data['total_medicine_cost'])
-                        new_salaries = st.number_input("Salaries ($)", 
-                                                      min_value=0.0, 
-                                                      step=0.01,
-                                                      value=expense_data['total_salaries'])
-                        new_utils = st.number_input("Utilities ($)", 
-                                                   min_value=0.0, 
-                                                   step=0.01,
-                                                   value=expense_data['total_utilities'])
-                        new_other = st.number_input("Other Expenses ($)", 
-                                                    min_value=0.0, 
-                                                    step=0.01,
-                                                    value=expense_data['other_expenses'])
+                # Add new expense summary form
+                if st.session_state.get('show_add_expense', False):
+                    with st.form("expense_form"):
+                        st.subheader("Add New Expense Summary")
+                        month = st.date_input("Month*")
+                        feed_cost = st.number_input("Total Feed Cost ($)", min_value=0.0, step=0.01)
+                        medicine_cost = st.number_input("Total Medicine Cost ($)", min_value=0.0, step=0.01)
+                        salaries = st.number_input("Total Salaries ($)", min_value=0.0, step=0.01)
+                        utilities = st.number_input("Total Utilities ($)", min_value=0.0, step=0.01)
+                        other_expenses = st.number_input("Other Expenses ($)", min_value=0.0, step=0.01)
                         
                         col1, col2 = st.columns(2)
                         with col1:
-                            if st.form_submit_button("Update Expense Summary"):
+                            if st.form_submit_button("Add Expense Summary"):
+                                total = feed_cost + medicine_cost + salaries + utilities + other_expenses
                                 try:
-                                    total = new_feed + new_med + new_salaries + new_utils + new_other
                                     cursor.execute("""
-                                        UPDATE Expense_Summary 
-                                        SET total_feed_cost = %s, total_medicine_cost = %s, 
-                                            total_salaries = %s, total_utilities = %s, 
-                                            other_expenses = %s, total_expense = %s
-                                        WHERE expense_id = %s
-                                    """, (new_feed, new_med, new_salaries, new_utils, new_other, total, expense_data['expense_id']))
+                                        INSERT INTO Expense_Summary 
+                                        (farm_id, month, total_feed_cost, total_medicine_cost, total_salaries, 
+                                         total_utilities, other_expenses, total_expense)
+                                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                                    """, (farm_id, month, feed_cost, medicine_cost, salaries, utilities, other_expenses, total))
+                                    rollups.refresh_finance(connection, farm_id, [month.year])
                                     connection.commit()
-                                    st.success("Expense summary updated successfully!")
-                                    st.session_state.show_update_expense = False
+                                    st.success("Expense summary added successfully!")
+                                    st.session_state.show_add_expense = False
                                     st.rerun()
                                 except Error as e:
-                                    st.error(f"Error updating expense summary: {e}")
+                                    st.error(f"Error adding expense summary: {e}")
                         with col2:
                             if st.form_submit_button("Cancel"):
-                                st.session_state.show_update_expense = False
-            
-            # Utility bills section
-            st.subheader("Utility Bills")
-            
-            cursor.execute("SELECT * FROM Utility_Bill ORDER BY month DESC")
-            utility_bills = pd.DataFrame(cursor.fetchall())
-            
-            if not utility_bills.empty:
-                # Convert month to string if not datetime
-                if not pd.api.types.is_datetime64_any_dtype(utility_bills['month']):
-                    utility_bills['month'] = pd.to_datetime(utility_bills['month']).dt.strftime('%Y-%m')
-                else:
-                    utility_bills['month'] = utility_bills['month'].dt.strftime('%Y-%m')
-                st.dataframe(utility_bills, use_container_width=True)
+                                close_form('show_add_expense')
                 
-                # Utility costs chart
-                st.subheader("Utility Costs by Type")
-                fig = px.pie(utility_bills, names='type', values='amount',
-                             title="Utility Cost Distribution")
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No utility bills found.")
-            
-            # Action buttons below the heading
-            st.subheader("Utility Actions")
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                if st.button("➕ Add Utility Bill"):
-                    st.session_state.show_add_utility = True
-            
-            with col2:
-                if not utility_bills.empty:
-                    if st.button("✏️ Update Utility Bill"):
-                        st.session_state.show_update_utility = True
-            
-            # Add new utility bill form
-            if st.session_state.get('show_add_utility', False):
-                with st.form("utility_form"):
-                    st.subheader("Add New Utility Bill")
-                    month = st.date_input("Bill Month*")
-                    bill_type = st.selectbox("Bill Type*", ["Electricity", "Water", "Gas", "Internet", "Other"])
-                    amount = st.number_input("Amount ($)*", min_value=0.0, step=0.01)
-                    
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        if st.form_submit_button("Add Utility Bill"):
-                            try:
-                                cursor.execute("""
-                                    INSERT INTO Utility_Bill (month, type, amount)
-                                    VALUES (%s, %s, %s)
-                                """, (month, bill_type, amount))
-                                connection.commit()
-                                st.success("Utility bill added successfully!")
-                                st.session_state.show_add_utility = False
-                                st.rerun()
-                            except Error as e:
-                                st.error(f"Error adding utility bill: {e}")
-                    with col2:
-                        if st.form_submit_button("Cancel"):
-                            st.session_state.show_add_utility = False
-            
-            # Update utility bill form
-            if st.session_state.get('show_update_utility', False) and not utility_bills.empty:
-                with st.form("update_utility_form"):
-                    st.subheader("Update Utility Bill")
-                    
-                    selected_bill = st.selectbox("Select Bill to Update", 
-                                               options=utility_bills['month'] + " - " + utility_bills['type'])
-                    
-                    if selected_bill:
-                        parts = selected_bill.split(" - ")
-                        bill_month = pd.to_datetime(parts[0]).date()
-                        bill_type = parts[1]
+                # Update expense summary form
+                if st.session_state.get('show_update_expense', False) and not expenses.empty:
+                    with st.form("update_expense_form"):
+                        st.subheader("Update Expense Summary")
                         
-                        cursor.execute("""
-                            SELECT bill_id, amount 
-                            FROM Utility_Bill 
-                            WHERE month = %s AND type = %s
-                        """, (bill_month, bill_type))
-                        bill_data = cursor.fetchone()
+                        selected_month = st.selectbox("Select Month to Update", options=expenses['month'])
                         
-                        if bill_data:
-                            new_amount = st.number_input("New Amount ($)", 
+                        cursor.execute("SELECT * FROM Expense_Summary WHERE month = %s AND farm_id = %s", 
+                                     (pd.to_datetime(selected_month), farm_id))
+                        expense_data = cursor.fetchone()
+                        
+                        if expense_data:
+                            new_feed = st.number_input("Feed Cost ($)", 
+                                                     min_value=0.0, 
+                                                     step=0.01,
+                                                     value=expense_data['total_feed_cost'])
+                            new_med = st.number_input("Medicine Cost ($)", 
+                                                     min_value=0.0, 
+                                                     step=0.01,
+                                                     value=expense_data['total_medicine_cost'])
+                            new_salaries = st.number_input("Salaries ($)", 
+                                                          min_value=0.0, 
+                                                          step=0.01,
+                                                          value=expense_data['total_salaries'])
+                            new_utils = st.number_input("Utilities ($)", 
                                                        min_value=0.0, 
                                                        step=0.01,
-                                                       value=bill_data['amount'])
+                                                       value=expense_data['total_utilities'])
+                            new_other = st.number_input("Other Expenses ($)", 
+                                                        min_value=0.0, 
+                                                        step=0.01,
+                                                        value=expense_data['other_expenses'])
                             
                             col1, col2 = st.columns(2)
                             with col1:
-                                if st.form_submit_button("Update Utility Bill"):
+                                if st.form_submit_button("Update Expense Summary"):
                                     try:
+                                        total = new_feed + new_med + new_salaries + new_utils + new_other
                                         cursor.execute("""
-                                            UPDATE Utility_Bill 
-                                            SET amount = %s
-                                            WHERE bill_id = %s
-                                        """, (new_amount, bill_data['bill_id']))
+                                            UPDATE Expense_Summary 
+                                            SET total_feed_cost = %s, total_medicine_cost = %s, 
+                                                total_salaries = %s, total_utilities = %s, 
+                                                other_expenses = %s, total_expense = %s
+                                            WHERE expense_id = %s
+                                        """, (new_feed, new_med, new_salaries, new_utils, new_other, total, expense_data['expense_id']))
+                                        rollups.refresh_finance(connection, farm_id, [expense_data['month'].year])
                                         connection.commit()
-                                        st.success("Utility bill updated successfully!")
-                                        st.session_state.show_update_utility = False
+                                        st.success("Expense summary updated successfully!")
+                                        st.session_state.show_update_expense = False
                                         st.rerun()
                                     except Error as e:
-                                        st.error(f"Error updating utility bill: {e}")
+                                        st.error(f"Error updating expense summary: {e}")
                             with col2:
                                 if st.form_submit_button("Cancel"):
-                                    st.session_state.show_update_utility = False
-            
-        except Error as e:
-            st.error(f"Error retrieving data: {e}")
-        finally:
-            if connection.is_connected():
-                cursor.close()
-                connection.close()
+                                    close_form('show_update_expense')
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    # Buttons and forms rerun on their own; a successful submit reruns the page
+    @page_fragment
+    def utility_actions(utility_bills):
+        # Action buttons below the heading
+        section_header("Utility Actions")
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            if st.button("➕ Add Utility Bill"):
+                st.session_state.show_add_utility = True
+        
+        with col2:
+            if not utility_bills.empty:
+                if st.button("✏️ Update Utility Bill"):
+                    st.session_state.show_update_utility = True
+        
+        if not form_open('show_add_utility', 'show_update_utility'):
+            return
+        
+        connection = create_connection()
+        
+        if connection:
+            try:
+                cursor = connection.cursor(dictionary=True)
+                
+                # Add new utility bill form
+                if st.session_state.get('show_add_utility', False):
+                    with st.form("utility_form"):
+                        st.subheader("Add New Utility Bill")
+                        month = st.date_input("Bill Month*")
+                        bill_type = st.selectbox("Bill Type*", ["Electricity", "Water", "Gas", "Internet", "Other"])
+                        amount = st.number_input("Amount ($)*", min_value=0.0, step=0.01)
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            if st.form_submit_button("Add Utility Bill"):
+                                try:
+                                    cursor.execute("""
+                                        INSERT INTO Utility_Bill (farm_id, month, type, amount)
+                                        VALUES (%s, %s, %s, %s)
+                                    """, (farm_id, month, bill_type, amount))
+                                    rollups.refresh_finance(connection, farm_id, [month.year])
+                                    connection.commit()
+                                    st.success("Utility bill added successfully!")
+                                    st.session_state.show_add_utility = False
+                                    st.rerun()
+                                except Error as e:
+                                    st.error(f"Error adding utility bill: {e}")
+                        with col2:
+                            if st.form_submit_button("Cancel"):
+                                close_form('show_add_utility')
+                
+                # Update utility bill form
+                if st.session_state.get('show_update_utility', False) and not utility_bills.empty:
+                    with st.form("update_utility_form"):
+                        st.subheader("Update Utility Bill")
+                        
+                        selected_bill = st.selectbox("Select Bill to Update", 
+                                                   options=utility_bills['month'] + " - " + utility_bills['type'].astype(str))
+                        
+                        if selected_bill:
+                            parts = selected_bill.split(" - ")
+                            bill_month = pd.to_datetime(parts[0]).date()
+                            bill_type = parts[1]
+                            
+                            cursor.execute("""
+                                SELECT bill_id, amount 
+                                FROM Utility_Bill 
+                                WHERE month = %s AND type = %s AND farm_id = %s
+                            """, (bill_month, bill_type, farm_id))
+                            bill_data = cursor.fetchone()
+                            
+                            if bill_data:
+                                new_amount = st.number_input("New Amount ($)", 
+                                                           min_value=0.0, 
+                                                           step=0.01,
+                                                           value=bill_data['amount'])
+                                
+                                col1, col2 = st.columns(2)
+                                with col1:
+                                    if st.form_submit_button("Update Utility Bill"):
+                                        try:
+                                            cursor.execute("""
+                                                UPDATE Utility_Bill 
+                                                SET amount = %s
+                                                WHERE bill_id = %s
+                                            """, (new_amount, bill_data['bill_id']))
+                                            rollups.refresh_finance(connection, farm_id, [bill_month.year])
+                                            connection.commit()
+                                            st.success("Utility bill updated successfully!")
+                                            st.session_state.show_update_utility = False
+                                            st.rerun()
+                                        except Error as e:
+                                            st.error(f"Error updating utility bill: {e}")
+                                with col2:
+                                    if st.form_submit_button("Cancel"):
+                                        close_form('show_update_utility')
+            except Error as e:
+                st.error(f"Error retrieving data: {e}")
+            finally:
+                if connection.is_connected():
+                    cursor.close()
+                    connection.close()
+    
+    # Date range; the chart granularity follows its span, from monthly detail to yearly totals
+    col1, col2 = st.columns(2)
+    with col1:
+        start_date = st.date_input("Start Date", value=datetime.now().date().replace(day=1) - timedelta(days=365),
+                                   min_value=datetime(1990, 1, 1))
+    with col2:
+        end_date = st.date_input("End Date")
+    
+    try:
+        # The records in range and the chart rollups are needed up front, so fetch them side by side
+        tier, rollup_query = rollups.finance_query(farm_id, start_date, end_date)
+        results = run_queries({
+            'expenses': ("""
+                SELECT expense_id, farm_id, month, total_feed_cost, total_medicine_cost, total_salaries,
+                       total_utilities, other_expenses, total_expense
+                FROM Expense_Summary WHERE farm_id = %s AND month BETWEEN %s AND %s ORDER BY month DESC
+            """, (farm_id, start_date, end_date), frames.EXPENSE_KINDS),
+            'utility_bills': ("""
+                SELECT bill_id, farm_id, month, type, amount
+                FROM Utility_Bill WHERE farm_id = %s AND month BETWEEN %s AND %s ORDER BY month DESC
+            """, (farm_id, start_date, end_date), frames.UTILITY_BILL_KINDS),
+            'rollups': rollup_query,
+        })
+        
+        rollup = results['rollups']
+        rollup['period'] = [rollups.period_label(tier, day) for day in rollup['period_start'].dt.date]
+        expense_rollup = rollup[rollup['source'] == 'expense'].pivot_table(
+            index='period', columns='category', values='amount', aggfunc='sum', observed=True).reset_index()
+        utility_rollup = rollup[rollup['source'] == 'utility']
+        st.caption(f"Charts show {tier}ly totals")
+        
+        # Display expense summary
+        section_header("Expense Summary")
+        expenses = results['expenses']
+        
+        if not expenses.empty:
+            expenses['month'] = expenses['month'].dt.strftime('%Y-%m')
+            st.dataframe(expenses, use_container_width=True)
+        else:
+            st.info("No expense records found.")
+        
+        if not expense_rollup.empty:
+            # Expense trends chart
+            st.subheader("Expense Trends")
+            fig = px.line(expense_rollup, x='period', y='total_expense',
+                         title=f"Total Expenses by {tier.title()}",
+                         markers=True)
+            st.plotly_chart(fig, use_container_width=True)
+            
+            # Expense composition chart
+            st.subheader("Expense Composition")
+            fig = px.bar(expense_rollup, x='period',
+                        y=['total_feed_cost', 'total_medicine_cost',
+                           'total_salaries', 'total_utilities', 'other_expenses'],
+                        title="Expense Breakdown by Category",
+                        labels={'value': 'Amount ($)', 'variable': 'Category'})
+            st.plotly_chart(fig, use_container_width=True)
+        
+        expense_actions(expenses)
+        
+        # Costs summed from the individual records, aggregated by DuckDB over the analytics snapshot
+        if analytics.enabled():
+            section_header("Recorded Costs")
+            try:
+                recorded_costs = analytics.monthly_costs(farm_id)
+                if not recorded_costs.empty:
+                    recorded_costs['month'] = recorded_costs['month'].dt.strftime('%Y-%m')
+                    fig = px.bar(recorded_costs, x='month', y=['feed_cost', 'medicine_cost', 'utility_cost'],
+                                title="Recorded Costs by Month",
+                                labels={'value': 'Amount ($)', 'variable': 'Category'})
+                    st.plotly_chart(fig, use_container_width=True)
+                    st.caption(f"From the analytics snapshot of {analytics.refreshed_at(current_shard()):%Y-%m-%d %H:%M}")
+                else:
+                    st.info("No feed, medicine or utility records in the analytics snapshot.")
+            except analytics.SnapshotUnavailable:
+                st.info("The analytics snapshot is still being built.")
+        
+        # Utility bills section
+        section_header("Utility Bills")
+        utility_bills = results['utility_bills']
+        
+        if not utility_bills.empty:
+            utility_bills['month'] = utility_bills['month'].dt.strftime('%Y-%m')
+            st.dataframe(utility_bills, use_container_width=True)
+        else:
+            st.info("No utility bills found.")
+        
+        if not utility_rollup.empty:
+            # Utility costs chart
+            st.subheader("Utility Costs by Type")
+            fig = px.pie(utility_rollup, names='category', values='amount',
+                         title="Utility Cost Distribution")
+            st.plotly_chart(fig, use_container_width=True)
+        
+        utility_actions(utility_bills)
+        
+    except Error as e:
+        st.error(f"Error retrieving data: {e}")
+
+# Farm Comparison Page
+elif page == "Farm Comparison":
+    st.title("Farm Comparison")
+
+    try:
+        # The same reads run for every farm at once, each against its own shard
+        results = fan_out({
+            'herd': ("SELECT COUNT(*) as animals FROM Animal WHERE farm_id = %(farm_id)s AND status = 'active'", None),
+            'staff': ("""
+                SELECT COUNT(*) as staff, COALESCE(SUM(salary_per_month), 0) as monthly_payroll
+                FROM Staff WHERE farm_id = %(farm_id)s
+            """, None),
+            'gain': ("""
+                SELECT AVG(mw.weight_kg - a.initial_weight_kg) as avg_weight_gain
+                FROM Monthly_Weight mw
+                JOIN Animal a ON mw.animal_id = a.animal_id
+                WHERE mw.farm_id = %(farm_id)s AND a.status = 'active'
+                  AND mw.month = (SELECT MAX(month) FROM Monthly_Weight WHERE farm_id = %(farm_id)s)
+            """, None),
+            'costs': ("""
+                SELECT (SELECT COALESCE(SUM(cost), 0) FROM Feed_Record WHERE farm_id = %(farm_id)s) as feed_cost,
+                       (SELECT COALESCE(SUM(cost), 0) FROM Medicine_Record WHERE farm_id = %(farm_id)s) as medicine_cost
+            """, None),
+            'expenses': ("""
+                SELECT month, total_expense FROM Expense_Summary
+                WHERE farm_id = %(farm_id)s ORDER BY month
+            """, None),
+        })
+
+        # One row per farm, merged from the per-farm results
+        summary = pd.DataFrame(results['herd'])
+        for name in ('staff', 'gain', 'costs'):
+            summary = summary.merge(pd.DataFrame(results[name]), on=['farm_id', 'farm'])
+        summary = summary.set_index('farm').drop(columns='farm_id')
+
+        section_header("Farms at a Glance")
+        st.dataframe(summary, use_container_width=True)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            st.metric("Animals, all farms", f"{int(summary['animals'].sum()):,}")
+        with col2:
+            st.metric("Monthly payroll, all farms", f"${summary['monthly_payroll'].sum():,.2f}")
+
+        section_header("Feed and Medicine Costs")
+        fig = px.bar(summary.reset_index(), x='farm', y=['feed_cost', 'medicine_cost'],
+                     title="Costs by Farm", labels={'value': 'Amount ($)', 'variable': 'Category'})
+        st.plotly_chart(fig, use_container_width=True)
+
+        section_header("Monthly Expenses")
+        expenses = pd.DataFrame(results['expenses'])
+        if not expenses.empty:
+            expenses['month'] = pd.to_datetime(expenses['month']).dt.strftime('%Y-%m')
+            fig = px.line(expenses, x='month', y='total_expense', color='farm',
+                          title="Total Monthly Expenses by Farm", markers=True)
+            st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No expense records found.")
+
+    except Error as e:
+        st.error(f"Error retrieving data: {e}")
 
 # Footer
 st.markdown("---")
@@ -1634,4 +2670,10 @@ st.markdown("""
     <div style="text-align: center; color: #6c757d; padding: 10px;">
         Farm Management System © 2025 | Developed with Streamlit and MySQL
     </div>
-""", unsafe_allow_html=True)
\ No newline at end of file
+""", unsafe_allow_html=True)
+
+rerun = instrumentation.finish_rerun()
+if os.environ.get("FARM_METRICS_FILE"):
+    metrics.write_to_file(os.environ["FARM_METRICS_FILE"])
+if show_perf_panel and rerun:
+    render_perf_panel(rerun)
@@ -0,0 +1,216 @@
+import argparse
+import sys
+import time
+from datetime import date
+
+from mysql.connector import Error
+
+import analytics
+import database
+import farms
+import ingest_server
+import write_queue
+
+# Animals leave the herd in two steps. A disposition (sold, deceased, transferred) only sets the
+# animal's status, so it drops out of every active-herd query through the farm_status index while
+# its records still count in the reports. Archiving then moves the animal and all of its records
+# into the *_Archive tables in one transaction, so the live tables hold only the current herd.
+# Deleting an animal removes it and its records the same way without keeping a copy. Either way,
+# once the caller has committed, committed() marks the analytics snapshot of the shard to copy
+# those tables in full on its next refresh.
+DISPOSITIONS = ("sold", "deceased", "transferred")
+ACTIVE = "active"
+# Rows computed from an animal's records; they are not archived, only dropped with the animal
+DERIVED_TABLES = ("Weight_Rollup", "Health_Score", "Weight_Forecast")
+ANIMAL_COLUMNS = ("animal_id", "farm_id", "tag_number", "category_id", "breed", "arrival_date",
+                  "initial_weight_kg", "image", "image_hash", "status", "disposed_on")
+BATCH_ANIMALS = 500
+
+
+# Raised by delete() when the animals still have records the caller did not agree to delete, and
+# by archive() and delete() when they have records waiting in the write queue, which would be
+# rejected once they reach MySQL after the animals are gone
+class HasRecords(Exception):
+    pass
+
+
+def _in_list(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _check_queue(farm_id, animal_ids):
+    queued = write_queue.pending_for(farm_id, animal_ids)
+    if queued:
+        raise HasRecords(f"the selected animals have {queued} records waiting in the write queue; "
+                         f"try again once they have synced")
+
+
+# Call once a transaction that archived or deleted a farm's animals is committed. Marking the
+# snapshot earlier would let a refresh in between copy the old rows and clear the mark.
+def committed(farm_id):
+    analytics.mark_full(farms.shard_of(farm_id), database.ARCHIVED_TABLES)
+    ingest_server.forget_tags(farm_id)
+
+
+# Mark active animals of a farm as having left the herd, in the caller's transaction; returns
+# animals marked
+def dispose(connection, farm_id, animal_ids, status, on_date):
+    if status not in DISPOSITIONS:
+        raise ValueError(f"unknown disposition {status!r}")
+    if not animal_ids:
+        return 0
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"""
+            UPDATE Animal SET status = %s, disposed_on = %s
+            WHERE farm_id = %s AND status = '{ACTIVE}' AND animal_id IN ({_in_list(animal_ids)})
+        """, (status, on_date, farm_id, *animal_ids))
+        return cursor.rowcount
+    finally:
+        cursor.close()
+
+
+# Records held by the animals, as {table: rows}, in one round trip
+def _history_counts(cursor, animal_ids):
+    cursor.execute("SELECT " + ", ".join(
+        f"(SELECT COUNT(*) FROM {table} WHERE animal_id IN ({_in_list(animal_ids)}))"
+        for table in database.ARCHIVED_TABLES
+    ), tuple(animal_ids) * len(database.ARCHIVED_TABLES))
+    return dict(zip(database.ARCHIVED_TABLES, cursor.fetchone()))
+
+
+# Lock the farm's animals about to be moved, so no record is added to them meanwhile; returns
+# the ids that exist
+def _lock(cursor, farm_id, animal_ids, disposed_only):
+    status = f"AND status <> '{ACTIVE}'" if disposed_only else ""
+    cursor.execute(f"""
+        SELECT animal_id FROM Animal
+        WHERE farm_id = %s {status} AND animal_id IN ({_in_list(animal_ids)})
+        FOR UPDATE
+    """, (farm_id, *animal_ids))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _remove(cursor, animal_ids, keep):
+    ids = _in_list(animal_ids)
+    for table in DERIVED_TABLES:
+        cursor.execute(f"DELETE FROM {table} WHERE animal_id IN ({ids})", tuple(animal_ids))
+    for table in database.ARCHIVED_TABLES:
+        if keep:
+            # By name, since an archive migrated by init_database has its newer columns at the end
+            columns = ", ".join(database.table_columns(cursor, table))
+            cursor.execute(f"""
+                INSERT INTO {table}_Archive ({columns})
+                SELECT {columns} FROM {table} WHERE animal_id IN ({ids})
+            """, tuple(animal_ids))
+        cursor.execute(f"DELETE FROM {table} WHERE animal_id IN ({ids})", tuple(animal_ids))
+    if keep:
+        columns = ", ".join(ANIMAL_COLUMNS)
+        cursor.execute(f"""
+            INSERT INTO Animal_Archive ({columns})
+            SELECT {columns} FROM Animal WHERE animal_id IN ({ids})
+        """, tuple(animal_ids))
+    cursor.execute(f"DELETE FROM Animal WHERE animal_id IN ({ids})", tuple(animal_ids))
+
+
+# Move disposed animals of a farm and every record of theirs into the archive tables, in the
+# caller's transaction; active animals are left alone. Returns animals archived. Raises
+# HasRecords if any of them still has records in the write queue.
+def archive(connection, farm_id, animal_ids):
+    _check_queue(farm_id, animal_ids)
+    cursor = connection.cursor()
+    try:
+        archived = 0
+        for i in range(0, len(animal_ids), BATCH_ANIMALS):
+            batch = _lock(cursor, farm_id, animal_ids[i:i + BATCH_ANIMALS], True)
+            if batch:
+                _remove(cursor, batch, keep=True)
+                archived += len(batch)
+        return archived
+    finally:
+        cursor.close()
+
+
+# Delete animals of a farm, in the caller's transaction; returns animals deleted. Their records
+# go too with delete_records, otherwise HasRecords is raised if they have any. Records are counted
+# on the primary after the animals are locked, so none can be added between the check and the
+# delete. Records still in the local write queue for the animals also raise HasRecords, since
+# they would be rejected once synced; the caller rolls back either way.
+def delete(connection, farm_id, animal_ids, delete_records=False):
+    _check_queue(farm_id, animal_ids)
+    cursor = connection.cursor()
+    try:
+        deleted = 0
+        for i in range(0, len(animal_ids), BATCH_ANIMALS):
+            batch = _lock(cursor, farm_id, animal_ids[i:i + BATCH_ANIMALS], False)
+            if not batch:
+                continue
+            if not delete_records:
+                counts = _history_counts(cursor, batch)
+                if any(counts.values()):
+                    raise HasRecords(
+                        f"the selected animals have {counts['Monthly_Weight']} weight records, "
+                        f"{counts['Feed_Record']} feed records, {counts['Medicine_Record']} medical records "
+                        f"and {counts['Weight_Reading']} scale readings")
+            _remove(cursor, batch, keep=False)
+            deleted += len(batch)
+        return deleted
+    finally:
+        cursor.close()
+
+
+# Archive the shard's animals disposed of before a date (all disposed animals without one),
+# committing every BATCH_ANIMALS animals; returns animals archived
+def archive_shard(shard, disposed_before=None):
+    connection = database.open_connection(shard)
+    try:
+        cursor = connection.cursor()
+        try:
+            before = "AND disposed_on < %s" if disposed_before else ""
+            cursor.execute(f"""
+                SELECT farm_id, animal_id FROM Animal WHERE status <> '{ACTIVE}' {before}
+                ORDER BY farm_id, animal_id
+            """, (disposed_before,) if disposed_before else ())
+            by_farm = {}
+            for farm_id, animal_id in cursor.fetchall():
+                by_farm.setdefault(farm_id, []).append(animal_id)
+        finally:
+            cursor.close()
+
+        archived = 0
+        for farm_id, animal_ids in by_farm.items():
+            # Animals with records still in the write queue wait for a later run
+            queued = write_queue.queued_animals(farm_id)
+            animal_ids = [animal_id for animal_id in animal_ids if not queued[animal_id]]
+            for i in range(0, len(animal_ids), BATCH_ANIMALS):
+                try:
+                    moved = archive(connection, farm_id, animal_ids[i:i + BATCH_ANIMALS])
+                    connection.commit()
+                except Error:
+                    connection.rollback()
+                    raise
+                if moved:
+                    committed(farm_id)
+                    archived += moved
+        return archived
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Move disposed animals and their records to the archive tables.")
+    parser.add_argument("--shard", nargs="*", default=list(farms.SHARDS), choices=list(farms.SHARDS))
+    parser.add_argument("--disposed-before", type=date.fromisoformat,
+                        help="only archive animals disposed of before this date (YYYY-MM-DD)")
+    args = parser.parse_args(argv)
+    for shard in args.shard:
+        if not database.init_database(shard):
+            raise SystemExit(f"Could not prepare the schema of shard {shard}")
+        started = time.perf_counter()
+        archived = archive_shard(shard, args.disposed_before)
+        print(f"{shard}: archived {archived:,} animals in {(time.perf_counter() - started) * 1000:,.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import date
+
+from streamlit.testing.v1 import AppTest
+
+import database
+import farms
+import forecast
+import health
+import instrumentation
+import rollups
+import synthetic
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+PAGES = [
+    "Dashboard",
+    "Animal Categories",
+    "Animal Records",
+    "Weight Tracking",
+    "Feed Records",
+    "Medical Records",
+    "Animal Timeline",
+    "Cohort Analytics",
+    "Forecasts",
+    "Staff Management",
+    "Financial Overview",
+]
+
+# Metrics compared against a baseline report, with the smallest change worth flagging
+COMPARED = {
+    'rerun_p95_ms': 5.0,
+    'query_p95_ms': 2.0,
+    'queries': 0.0,
+    'bytes': 1024.0,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every page against a synthetic farm database.")
+    parser.add_argument("--database", default="farm_bench",
+                        help="scratch database to load (never the production one)")
+    parser.add_argument("--herd-size", type=int, default=200)
+    parser.add_argument("--years", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--image-width", type=int, default=800)
+    parser.add_argument("--runs", type=int, default=5, help="measured reruns per page")
+    parser.add_argument("--pages", nargs="*", default=PAGES)
+    parser.add_argument("--skip-load", action="store_true", help="reuse the data already in --database")
+    parser.add_argument("--output", help="write the JSON report to this path")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative growth over the baseline before failing")
+    return parser.parse_args(argv)
+
+
+def use_database(name):
+    if name == os.environ.get("FARM_DB_NAME", "farm_v5"):
+        raise SystemExit(f"Refusing to benchmark against the application database {name!r}")
+    database.DB_CONFIG['database'] = name
+
+
+def load_farm(farm):
+    database.init_database()
+    connection = database.create_connection()
+    if connection is None:
+        raise SystemExit("Could not connect to the benchmark database")
+    try:
+        synthetic.clear(connection)
+        started = time.perf_counter()
+        counts = synthetic.load(connection, farm)
+        # Financial Overview charts the finance rollups, the Dashboard lists the health scores and
+        # Forecasts reads the fits, so have them ready before the first page
+        rollups.refresh_finance_shard(farms.DEFAULT_SHARD)
+        health.rebuild(farms.DEFAULT_SHARD)
+        forecast.refresh_weights(farms.DEFAULT_SHARD, rebuild=True)
+        forecast.refresh_expenses(farms.DEFAULT_SHARD, rebuild=True)
+        print(f"Loaded {sum(counts.values()):,} rows in {time.perf_counter() - started:.1f}s")
+        for table, count in counts.items():
+            print(f"  {table:<16} {count:>10,}")
+        return counts
+    finally:
+        connection.close()
+
+
+# Widen the record pages' date filters to cover the whole synthetic history
+def select_page(at, page, start, end):
+    at.sidebar.radio[0].set_value(page)
+    for widget in at.date_input:
+        if widget.label == "Start Date":
+            widget.set_value(start)
+        elif widget.label == "End Date":
+            widget.set_value(end)
+
+
+def bench_page(at, page, runs, start, end):
+    select_page(at, page, start, end)
+    at.run()
+    # The first run applies the date filters; it is the warm-up
+    select_page(at, page, start, end)
+    at.run()
+    if at.exception:
+        raise RuntimeError(f"{page}: {at.exception[0].message}")
+
+    instrumentation.reset_history()
+    wall = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        at.run()
+        wall.append((time.perf_counter() - started) * 1000)
+
+    history = instrumentation.page_history().get(page, [])
+    if not history:
+        raise RuntimeError(f"{page}: no reruns were recorded")
+    return summarize(history, wall)
+
+
+def summarize(history, wall):
+    totals = [r['total_ms'] for r in history]
+    query_totals = [r['query_ms'] for r in history]
+    n = len(history)
+    return {
+        'reruns': n,
+        'rerun_p50_ms': instrumentation.percentile(totals, 50),
+        'rerun_p95_ms': instrumentation.percentile(totals, 95),
+        'query_p50_ms': instrumentation.percentile(query_totals, 50),
+        'query_p95_ms': instrumentation.percentile(query_totals, 95),
+        'render_p50_ms': instrumentation.percentile(wall, 50),
+        'render_p95_ms': instrumentation.percentile(wall, 95),
+        'queries': sum(r['queries'] for r in history) / n,
+        'rows': sum(r['rows'] for r in history) / n,
+        'bytes': sum(r['bytes'] for r in history) / n,
+    }
+
+
+def print_report(report):
+    header = f"{'page':<20} {'rerun p50':>10} {'rerun p95':>10} {'sql p50':>9} {'sql p95':>9} {'queries':>8} {'rows':>10} {'bytes':>12}"
+    print(header)
+    print("-" * len(header))
+    for page, r in report['pages'].items():
+        print(f"{page:<20} {r['rerun_p50_ms']:>10.1f} {r['rerun_p95_ms']:>10.1f} {r['query_p50_ms']:>9.1f} "
+              f"{r['query_p95_ms']:>9.1f} {r['queries']:>8.1f} {r['rows']:>10,.0f} {r['bytes']:>12,.0f}")
+
+
+# List regressions of the current report over a baseline report
+def compare(report, baseline, tolerance):
+    if report['params'] != baseline.get('params'):
+        print("warning: baseline was produced with different parameters; comparison is approximate")
+    regressions = []
+    for page, current in report['pages'].items():
+        previous = baseline.get('pages', {}).get(page)
+        if not previous:
+            continue
+        for metric, floor in COMPARED.items():
+            before, after = previous[metric], current[metric]
+            if after > before * (1 + tolerance) and after - before > floor:
+                regressions.append(f"{page}: {metric} {before:,.1f} -> {after:,.1f}")
+    return regressions
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    use_database(args.database)
+
+    farm = synthetic.SyntheticFarm(herd_size=args.herd_size, years=args.years,
+                                   seed=args.seed, image_width=args.image_width)
+    if not args.skip_load:
+        load_farm(farm)
+
+    at = AppTest.from_file(APP_PATH, default_timeout=600)
+    at.run()
+
+    report = {
+        'params': {
+            'herd_size': args.herd_size,
+            'years': args.years,
+            'seed': args.seed,
+            'image_width': args.image_width,
+            'runs': args.runs,
+        },
+        'created': date.today().isoformat(),
+        'pages': {},
+    }
+    for page in args.pages:
+        report['pages'][page] = bench_page(at, page, args.runs, farm.start, farm.end)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,618 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+import mysql.connector
+from mysql.connector import Error
+from mysql.connector.errors import PoolError
+from mysql.connector.pooling import MySQLConnectionPool
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import farms
+import frames
+import instrumentation
+import metrics
+import routing
+
+# Connection settings; defaults match the original single-server deployment
+DB_CONFIG = {
+    'host': os.environ.get("FARM_DB_HOST", "localhost"),
+    'port': int(os.environ.get("FARM_DB_PORT", "3306")),
+    'user': os.environ.get("FARM_DB_USER", "root"),
+    'password': os.environ.get("FARM_DB_PASSWORD", "1713$"),
+    'database': os.environ.get("FARM_DB_NAME", "farm_v5"),
+}
+
+# Tables whose rows belong to one farm
+FARM_TABLES = ("Animal_Category", "Animal", "Staff", "Expense_Summary",
+               "Monthly_Weight", "Feed_Record", "Medicine_Record", "Utility_Bill", "Weight_Reading",
+               "Weight_Rollup", "Finance_Rollup", "Health_Score", "Weight_Forecast",
+               "Expense_Forecast")
+
+# Records that follow an animal into the archive; each has a <table>_Archive copy of its layout
+ARCHIVED_TABLES = ("Monthly_Weight", "Feed_Record", "Medicine_Record", "Weight_Reading")
+
+# Connections shared by parallel page reads, and how long a page waits for them
+POOL_SIZE = int(os.environ.get("FARM_DB_POOL_SIZE", "8"))
+PAGE_QUERY_TIMEOUT = float(os.environ.get("FARM_PAGE_QUERY_TIMEOUT", "10"))
+
+# Pools by (shard, server), server being "primary" or a replica's host[:port]
+_pools = {}
+_pool_lock = threading.Lock()
+# One worker per pooled connection, so a worker never waits on an exhausted pool
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="farm-query")
+
+# Connection settings of a shard from the farm registry
+def shard_config(shard):
+    return dict(DB_CONFIG, **{k: v for k, v in farms.SHARDS[shard].items() if k != 'replicas'})
+
+def shard_replicas(shard):
+    return farms.SHARDS[shard].get('replicas', routing.REPLICAS if shard == farms.DEFAULT_SHARD else [])
+
+# Farm this browser session is working on, picked in the sidebar
+def current_farm():
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return farms.DEFAULT_FARM
+    farm_id = st.session_state.get('farm_id', farms.DEFAULT_FARM)
+    return farm_id if farm_id in farms.FARMS else farms.DEFAULT_FARM
+
+def current_shard():
+    return farms.shard_of(current_farm())
+
+def _connect(config):
+    try:
+        with instrumentation.timed("connect"):
+            connection = mysql.connector.connect(**config)
+    except Error:
+        metrics.CONNECTION_ERRORS.inc()
+        raise
+    metrics.CONNECTIONS.inc()
+    return connection
+
+# True if this browser session committed a write recently enough that a replica may not have it yet
+def _session_wrote_recently():
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return False
+    last_write = st.session_state.get('_db_last_write')
+    return last_write is not None and time.time() - last_write < routing.READ_YOUR_WRITES
+
+# Send this session's reads to the primary for a while, so it sees what it just wrote
+def note_session_write():
+    if get_script_run_ctx(suppress_warning=True) is not None:
+        st.session_state['_db_last_write'] = time.time()
+
+# Open an instrumented connection to a shard, by default the current farm's, raising Error on
+# failure. With replicas configured, reads on the shard's database are routed to a replica and
+# everything else to the primary.
+def open_connection(shard=None, **overrides):
+    shard = shard or current_shard()
+    config = dict(shard_config(shard), **overrides)
+    if config['database'] is None:
+        del config['database']
+    replicas = shard_replicas(shard)
+    if replicas and 'database' not in overrides and 'host' not in overrides:
+        connection = routing.RoutingConnection(config, _connect, replicas, pin_primary=_session_wrote_recently(),
+                                               on_commit=note_session_write)
+    else:
+        connection = _connect(config)
+    return instrumentation.InstrumentedConnection(connection)
+
+# Database connection function
+def create_connection(shard=None, **overrides):
+    try:
+        return open_connection(shard, **overrides)
+    except Error as e:
+        st.error(f"Error connecting to MySQL: {e}")
+        return None
+
+# Add a column to an existing table if an older schema lacks it
+def _ensure_column(cursor, table, column, definition):
+    cursor.execute("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+    """, (table, column))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+# A table's columns in definition order, as {name: type}
+def table_columns(cursor, table):
+    cursor.execute("""
+        SELECT COLUMN_NAME, COLUMN_TYPE FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s ORDER BY ORDINAL_POSITION
+    """, (table,))
+    return dict(cursor.fetchall())
+
+# Add an index to an existing table if an older schema lacks it
+def _ensure_index(cursor, table, name, columns):
+    cursor.execute("""
+        SELECT COUNT(*) FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+    """, (table, name))
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f"ALTER TABLE {table} ADD INDEX {name} ({columns})")
+
+# Make a key unique per farm on a table from before multi-farm support: add the unique index led
+# by farm_id, then drop the old one over the key alone
+def _ensure_farm_unique(cursor, table, name, columns):
+    cursor.execute("""
+        SELECT INDEX_NAME, COLUMN_NAME FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND NON_UNIQUE = 0 AND INDEX_NAME <> 'PRIMARY'
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+    """, (table,))
+    indexes = {}
+    for index, column in cursor.fetchall():
+        indexes.setdefault(index, []).append(column)
+    if ["farm_id", *columns] not in indexes.values():
+        cursor.execute(f"ALTER TABLE {table} ADD UNIQUE {name} (farm_id, {', '.join(columns)})")
+    for index, indexed in indexes.items():
+        if indexed == list(columns):
+            cursor.execute(f"ALTER TABLE {table} DROP INDEX {index}")
+
+# Initialize a shard's database schema
+def init_database(shard=farms.DEFAULT_SHARD):
+    database = shard_config(shard)['database']
+    connection = create_connection(shard, database=None)
+    if connection:
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{database}`")
+            cursor.execute(f"USE `{database}`")
+            
+            # Create tables
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Animal_Category (
+                    category_id INT AUTO_INCREMENT PRIMARY KEY,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    name VARCHAR(100),
+                    description TEXT,
+                    image LONGBLOB,
+                    image_job VARCHAR(32) NULL,
+                    image_hash CHAR(64) NULL,
+                    UNIQUE (farm_id, name)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Animal (
+                    animal_id INT AUTO_INCREMENT PRIMARY KEY,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    tag_number VARCHAR(50),
+                    category_id INT,
+                    breed VARCHAR(100),
+                    arrival_date DATE,
+                    initial_weight_kg FLOAT,
+                    image LONGBLOB,
+                    image_job VARCHAR(32) NULL,
+                    image_hash CHAR(64) NULL,
+                    status VARCHAR(12) NOT NULL DEFAULT 'active',
+                    disposed_on DATE NULL,
+                    UNIQUE (farm_id, tag_number),
+                    INDEX farm_status (farm_id, status),
+                    FOREIGN KEY (category_id) REFERENCES Animal_Category(category_id)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Staff (
+                    staff_id INT AUTO_INCREMENT PRIMARY KEY,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    name VARCHAR(100),
+                    role VARCHAR(100),
+                    salary_per_month FLOAT,
+                    image LONGBLOB,
+                    image_job VARCHAR(32) NULL,
+                    image_hash CHAR(64) NULL
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Expense_Summary (
+                    expense_id INT AUTO_INCREMENT PRIMARY KEY,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    month DATE,
+                    total_feed_cost FLOAT,
+                    total_medicine_cost FLOAT,
+                    total_salaries FLOAT,
+                    total_utilities FLOAT,
+                    other_expenses FLOAT,
+                    total_expense FLOAT,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX (updated_at)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Monthly_Weight (
+                    weight_id INT AUTO_INCREMENT PRIMARY KEY,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    animal_id INT,
+                    month DATE,
+                    weight_kg FLOAT,
+                    idempotency_key CHAR(32) NULL UNIQUE,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX (updated_at),
+                    INDEX farm_animal (farm_id, animal_id, month),
+                    FOREIGN KEY (animal_id) REFERENCES Animal(animal_id)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Feed_Record (
+                    feed_id INT AUTO_INCREMENT PRIMARY KEY,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    animal_id INT,
+                    date DATE,
+                    feed_type VARCHAR(100),
+                    quantity_kg FLOAT,
+                    cost FLOAT,
+                    idempotency_key CHAR(32) NULL UNIQUE,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX (updated_at),
+                    INDEX farm_date (farm_id, date),
+                    INDEX farm_animal (farm_id, animal_id, cost),
+                    FOREIGN KEY (animal_id) REFERENCES Animal(animal_id)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Medicine_Record (
+                    medicine_id INT AUTO_INCREMENT PRIMARY KEY,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    animal_id INT,
+                    date DATE,
+                    medicine_name VARCHAR(100),
+                    quantity VARCHAR(50),
+                    cost FLOAT,
+                    remarks TEXT,
+                    idempotency_key CHAR(32) NULL UNIQUE,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX (updated_at),
+                    INDEX farm_date (farm_id, date),
+                    INDEX farm_animal (farm_id, animal_id, cost),
+                    FOREIGN KEY (animal_id) REFERENCES Animal(animal_id)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Utility_Bill (
+                    bill_id INT AUTO_INCREMENT PRIMARY KEY,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    month DATE,
+                    type VARCHAR(50),
+                    amount FLOAT,
+                    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    INDEX (updated_at)
+                );
+            """)
+            # Raw scale readings from the ingest service; a re-sent reading hits the unique key and is ignored
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Weight_Reading (
+                    reading_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    animal_id INT NOT NULL,
+                    read_at DATETIME NOT NULL,
+                    weight_kg FLOAT NOT NULL,
+                    device VARCHAR(64) NOT NULL DEFAULT '',
+                    UNIQUE (animal_id, read_at, device),
+                    FOREIGN KEY (animal_id) REFERENCES Animal(animal_id)
+                );
+            """)
+            # Downsampled readings per animal: tier is day, week or month (see rollups.py)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Weight_Rollup (
+                    animal_id INT NOT NULL,
+                    tier VARCHAR(5) NOT NULL,
+                    period_start DATE NOT NULL,
+                    farm_id INT NOT NULL DEFAULT 1,
+                    readings INT NOT NULL,
+                    rejected INT NOT NULL,
+                    median_kg FLOAT NOT NULL,
+                    min_kg FLOAT NOT NULL,
+                    max_kg FLOAT NOT NULL,
+                    PRIMARY KEY (animal_id, tier, period_start),
+                    FOREIGN KEY (animal_id) REFERENCES Animal(animal_id)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Rollup_State (
+                    name VARCHAR(32) PRIMARY KEY,
+                    last_reading_id BIGINT NOT NULL
+                );
+            """)
+            # Reading ids below the watermark that were not there when it passed them: inserts that
+            # had not committed yet, or ids that will never be used
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Rollup_Gap (
+                    reading_id BIGINT PRIMARY KEY,
+                    noted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            # Expense summaries and utility bills per farm: tier is month, quarter or year, source is
+            # "expense" (category is an Expense_Summary column) or "utility" (category is the bill type)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Finance_Rollup (
+                    farm_id INT NOT NULL,
+                    tier VARCHAR(7) NOT NULL,
+                    period_start DATE NOT NULL,
+                    source VARCHAR(7) NOT NULL,
+                    category VARCHAR(50) NOT NULL,
+                    amount DOUBLE NOT NULL,
+                    entries INT NOT NULL,
+                    refreshed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (farm_id, tier, period_start, source, category)
+                );
+            """)
+            # Latest health signals per animal from its weight history (see health.py)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Health_Score (
+                    animal_id INT PRIMARY KEY,
+                    farm_id INT NOT NULL,
+                    latest_month DATE NOT NULL,
+                    latest_weight_kg FLOAT NOT NULL,
+                    monthly_gain_kg FLOAT NULL,
+                    gain_z FLOAT NULL,
+                    drop_pct FLOAT NOT NULL,
+                    gap_months INT NOT NULL,
+                    score FLOAT NOT NULL,
+                    source_updated_at DATETIME NOT NULL,
+                    INDEX farm_score (farm_id, score)
+                );
+            """)
+            # Weight lines per animal and projected expenses per farm (see forecast.py). A weight
+            # projection is anchor_kg + gain_kg_per_day * days after anchor_month.
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Weight_Forecast (
+                    animal_id INT PRIMARY KEY,
+                    farm_id INT NOT NULL,
+                    anchor_month DATE NOT NULL,
+                    anchor_kg FLOAT NOT NULL,
+                    gain_kg_per_day FLOAT NOT NULL,
+                    residual_kg FLOAT NULL,
+                    points INT NOT NULL,
+                    mean_offset_days FLOAT NOT NULL,
+                    spread_days2 DOUBLE NOT NULL,
+                    source_updated_at DATETIME NOT NULL,
+                    INDEX (farm_id)
+                );
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Expense_Forecast (
+                    farm_id INT NOT NULL,
+                    month DATE NOT NULL,
+                    category VARCHAR(50) NOT NULL,
+                    amount DOUBLE NOT NULL,
+                    fitted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (farm_id, month, category)
+                );
+            """)
+            # Animals that left the herd, moved out of the live tables with their records (see archive.py).
+            # A tag may be reused once its animal is archived, so it is not unique here.
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Animal_Archive (
+                    animal_id INT PRIMARY KEY,
+                    farm_id INT NOT NULL,
+                    tag_number VARCHAR(50),
+                    category_id INT,
+                    breed VARCHAR(100),
+                    arrival_date DATE,
+                    initial_weight_kg FLOAT,
+                    image LONGBLOB,
+                    image_hash CHAR(64) NULL,
+                    status VARCHAR(12) NOT NULL,
+                    disposed_on DATE NULL,
+                    archived_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                    INDEX farm_status (farm_id, status)
+                );
+            """)
+            # Deduplicated images, referenced by the image_hash columns
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS Image_Store (
+                    image_hash CHAR(64) PRIMARY KEY,
+                    data LONGBLOB NOT NULL,
+                    bytes INT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """)
+            
+            # Columns added after the first release
+            for table in ("Animal_Category", "Animal", "Staff"):
+                _ensure_column(cursor, table, "image_job", "VARCHAR(32) NULL")
+                _ensure_column(cursor, table, "image_hash", "CHAR(64) NULL")
+            for table in ("Monthly_Weight", "Feed_Record", "Medicine_Record"):
+                _ensure_column(cursor, table, "idempotency_key", "CHAR(32) NULL UNIQUE")
+            # Rows from before multi-farm support belong to farm 1
+            for table in FARM_TABLES:
+                _ensure_column(cursor, table, "farm_id", "INT NOT NULL DEFAULT 1")
+            # Several farms can share a shard, so tags and category names repeat across farms
+            _ensure_farm_unique(cursor, "Animal_Category", "farm_name", ("name",))
+            _ensure_farm_unique(cursor, "Animal", "farm_tag_number", ("tag_number",))
+            # Disposition of animals that left the herd; active-herd queries filter on farm_status
+            _ensure_column(cursor, "Animal", "status", "VARCHAR(12) NOT NULL DEFAULT 'active'")
+            _ensure_column(cursor, "Animal", "disposed_on", "DATE NULL")
+            _ensure_index(cursor, "Animal", "farm_status", "farm_id, status")
+            # Change tracking for the analytics snapshot (see analytics.py)
+            for table in ("Expense_Summary", "Monthly_Weight", "Feed_Record", "Medicine_Record", "Utility_Bill"):
+                _ensure_column(cursor, table, "updated_at",
+                               "TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP")
+                _ensure_index(cursor, table, "updated_at", "updated_at")
+            # Paged record lists filter by farm and date range
+            for table in ("Feed_Record", "Medicine_Record"):
+                _ensure_index(cursor, table, "farm_date", "farm_id, date")
+            # Per-animal rollups of the cohort report read these without touching the rows
+            _ensure_index(cursor, "Monthly_Weight", "farm_animal", "farm_id, animal_id, month")
+            for table in ("Feed_Record", "Medicine_Record"):
+                _ensure_index(cursor, table, "farm_animal", "farm_id, animal_id, cost")
+            # Archived records keep their table's layout, so they are copied once the live table is current;
+            # an archive created before the live table gained a column gets it too, empty for older rows
+            for table in ARCHIVED_TABLES:
+                cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_Archive LIKE {table}")
+                archived = table_columns(cursor, f"{table}_Archive")
+                for column, column_type in table_columns(cursor, table).items():
+                    if column not in archived:
+                        cursor.execute(f"ALTER TABLE {table}_Archive ADD COLUMN {column} {column_type} NULL")
+            connection.commit()
+            return True
+        except Error as e:
+            st.error(f"Error initializing database: {e}")
+        finally:
+            if connection.is_connected():
+                cursor.close()
+                connection.close()
+    return False
+
+def get_pool(shard=farms.DEFAULT_SHARD, server="primary"):
+    with _pool_lock:
+        if (shard, server) not in _pools:
+            config = shard_config(shard)
+            if server != "primary":
+                config = routing.replica_config(config, server)
+            try:
+                _pools[shard, server] = MySQLConnectionPool(pool_name=f"farm-{shard}-{server}",
+                                                            pool_size=POOL_SIZE, **config)
+                metrics.CONNECTIONS.inc(POOL_SIZE)
+            except Error:
+                metrics.CONNECTION_ERRORS.inc()
+                raise
+        return _pools[shard, server]
+
+# Pool for a page's reads on a shard: a replica within the lag limit, else the primary
+def _read_pool(shard, wrote_recently):
+    replicas = shard_replicas(shard)
+    if not replicas or wrote_recently:
+        return get_pool(shard)
+    for replica in routing.candidates(replicas):
+        try:
+            pool = get_pool(shard, replica)
+            if routing.needs_check(replica):
+                connection = pool.get_connection()
+                try:
+                    usable = routing.check(replica, connection)
+                finally:
+                    connection.close()
+                if not usable:
+                    continue
+            return pool
+        except PoolError:
+            # Every connection to the replica is busy; that says nothing about its health
+            continue
+        except Error:
+            routing.mark_down(replica)
+    return get_pool(shard)
+
+def _fetch_all(rerun, pool, sql, params, kinds=None):
+    with instrumentation.attached(rerun):
+        connection = instrumentation.InstrumentedConnection(pool.get_connection())
+        try:
+            if kinds is not None:
+                return frames.read_frame(connection, sql, params, kinds)
+            cursor = connection.cursor(dictionary=True)
+            try:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+            finally:
+                cursor.close()
+        finally:
+            # Returns the connection to the pool
+            connection.close()
+
+def _gather(futures, timeout):
+    done, pending = wait(futures.values(), timeout=timeout)
+    if pending:
+        for future in pending:
+            future.cancel()
+        raise Error(msg=f"Page queries did not finish within {timeout:g}s")
+    return {key: future.result() for key, future in futures.items()}
+
+# Run independent reads concurrently on pooled connections to a shard, by default the current farm's.
+# queries maps a name to (sql, params); returns a dict of name -> rows. A query given as
+# (sql, params, kinds) returns a typed DataFrame instead (see frames.read_frame).
+def run_queries(queries, timeout=PAGE_QUERY_TIMEOUT, shard=None):
+    rerun = instrumentation.current_rerun()
+    pool = _read_pool(shard or current_shard(), _session_wrote_recently())
+    return _gather({name: _executor.submit(_fetch_all, rerun, pool, *query)
+                    for name, query in queries.items()}, timeout)
+
+# Run the same reads for every farm in parallel, each on its own shard, and merge the results.
+# queries maps a name to (sql, params) with params a dict; the SQL picks out the farm with
+# %(farm_id)s. Returns a dict of name -> rows, each row tagged with farm_id and farm.
+def fan_out(queries, farm_ids=None, timeout=PAGE_QUERY_TIMEOUT):
+    rerun = instrumentation.current_rerun()
+    wrote_recently = _session_wrote_recently()
+    farm_ids = sorted(farm_ids or farms.FARMS)
+    pools = {shard: _read_pool(shard, wrote_recently) for shard in farms.by_shard(farm_ids)}
+    results = _gather({(name, farm_id): _executor.submit(_fetch_all, rerun, pools[farms.shard_of(farm_id)],
+                                                         sql, dict(params or {}, farm_id=farm_id))
+                       for name, (sql, params) in queries.items() for farm_id in farm_ids}, timeout)
+    merged = {name: [] for name in queries}
+    for (name, farm_id), rows in results.items():
+        merged[name].extend(dict(row, farm_id=farm_id, farm=farms.FARMS[farm_id].name) for row in rows)
+    return merged
+
+# Image bytes from a shard's store, or None if the hash is unknown
+def fetch_stored_image(image_hash, shard=None):
+    rows = run_queries({'image': ("SELECT data FROM Image_Store WHERE image_hash = %s", (image_hash,))},
+                       shard=shard)['image']
+    return rows[0]['data'] if rows else None
+
+# Recompute a table of per-animal rows derived from Monthly_Weight on a shard. compute(weights)
+# turns frames.read_weights output into a DataFrame of the table's columns, source_updated_at
+# among them. Only animals whose weigh-ins changed since the newest source_updated_at, less
+# overlap, are recomputed, batch_animals at a time; all of them when the table is empty or with
+# rebuild. Returns rows written by a full pass, or animals recomputed by an incremental one.
+def refresh_from_weights(shard, table, columns, compute, overlap, batch_animals, dates=(), rebuild=False):
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+
+    def write(cursor, frame):
+        rows = frames.to_rows(frame, columns, dates)
+        for i in range(0, len(rows), batch_animals):
+            cursor.executemany(insert, rows[i:i + batch_animals])
+
+    connection = open_connection(shard)
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(f"SELECT MAX(source_updated_at) FROM {table}")
+            watermark = cursor.fetchone()[0]
+            if rebuild or watermark is None:
+                computed = compute(frames.read_weights(connection))
+                cursor.execute(f"DELETE FROM {table}")
+                write(cursor, computed)
+                connection.commit()
+                return len(computed)
+
+            cursor.execute("SELECT DISTINCT animal_id FROM Monthly_Weight WHERE updated_at >= %s",
+                           (watermark - overlap,))
+            animal_ids = sorted(row[0] for row in cursor.fetchall() if row[0] is not None)
+            for i in range(0, len(animal_ids), batch_animals):
+                batch = animal_ids[i:i + batch_animals]
+                computed = compute(frames.read_weights(connection, batch))
+                # An animal left without weigh-ins loses its row
+                cursor.execute(f"DELETE FROM {table} WHERE animal_id IN ({', '.join(['%s'] * len(batch))})",
+                               tuple(batch))
+                write(cursor, computed)
+                connection.commit()
+            return len(animal_ids)
+        except Error:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+
+# Background jobs over every shard, by thread name
+_maintainers = {}
+_maintainers_lock = threading.Lock()
+
+def _run_maintainer(job, interval, logger, what, errors):
+    while True:
+        for shard in farms.SHARDS:
+            try:
+                job(shard)
+            except errors as e:
+                logger.warning("%s of shard %s failed, retrying later: %s", what, shard, e)
+        time.sleep(interval)
+
+# Background thread that runs job(shard) on every shard each interval seconds; a shard whose job
+# raises one of errors is logged and tried again next round. Started once per process per name.
+def start_maintainer(name, job, interval, logger, what, errors=(Error,)):
+    with _maintainers_lock:
+        if name not in _maintainers:
+            _maintainers[name] = threading.Thread(target=_run_maintainer,
+                                                  args=(job, interval, logger, what, errors),
+                                                  name=name, daemon=True)
+            _maintainers[name].start()
+        return _maintainers[name]
@@ -0,0 +1,54 @@
+import json
+import os
+from collections import namedtuple
+
+# Farm registry. FARM_REGISTRY names a JSON file listing the shards (database servers or schemas,
+# as overrides of the FARM_DB_* settings) and the farms stored on each:
+#
+#   {"shards": {"default": {}, "north": {"host": "db-north", "database": "farm_north",
+#                                        "replicas": ["db-north-r1"]}},
+#    "farms": [{"id": 1, "name": "Home Farm", "shard": "default"},
+#              {"id": 2, "name": "North Ranch", "shard": "north"}]}
+#
+# Several farms may share a shard; their rows are told apart by farm_id. Rows written before
+# farm_id existed belong to farm 1. Without a registry the deployment serves farm 1 alone from
+# the default database, as before.
+REGISTRY_PATH = os.environ.get("FARM_REGISTRY")
+DEFAULT_SHARD = "default"
+
+Farm = namedtuple("Farm", ["farm_id", "name", "shard"])
+
+
+def load_registry(path):
+    if not path:
+        return {1: Farm(1, "Main Farm", DEFAULT_SHARD)}, {DEFAULT_SHARD: {}}
+    with open(path) as f:
+        registry = json.load(f)
+    shards = registry.get("shards", {})
+    shards.setdefault(DEFAULT_SHARD, {})
+    farms = {}
+    for entry in registry["farms"]:
+        farm = Farm(int(entry["id"]), entry["name"], entry.get("shard", DEFAULT_SHARD))
+        if farm.shard not in shards:
+            raise ValueError(f"Farm {farm.farm_id} is on unknown shard {farm.shard!r}")
+        farms[farm.farm_id] = farm
+    if not farms:
+        raise ValueError(f"{path} lists no farms")
+    return farms, shards
+
+
+FARMS, SHARDS = load_registry(REGISTRY_PATH)
+DEFAULT_FARM = min(FARMS)
+
+
+def shard_of(farm_id):
+    return FARMS[farm_id].shard
+
+
+# farm ids grouped by the shard that stores them; ids missing from the registry are left out
+def by_shard(farm_ids):
+    groups = {}
+    for farm_id in farm_ids:
+        if farm_id in FARMS:
+            groups.setdefault(shard_of(farm_id), []).append(farm_id)
+    return groups
@@ -0,0 +1,215 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from mysql.connector import Error
+
+import database
+import farms
+import frames
+import rollups
+
+# Forecasts for planning sales and budgets, fit in batch and kept in the database:
+#
+#   Weight_Forecast    per animal, a least-squares line through its weigh-ins of the last year,
+#                      anchored at its latest weigh-in; the projection to a date is read in SQL
+#   Expense_Forecast   per farm, HORIZON months of each Expense_Summary category, from one
+#                      least-squares solve for all categories: a trend, plus month-of-year
+#                      terms once there are two years of history
+#
+# Every animal's line comes out of one vectorized pass: rows are sorted by animal and the sums
+# of the normal equations are taken with reduceat over each animal's run of rows. Like
+# health.py, later passes refit only the animals and farms whose rows changed.
+FIT_DAYS = int(os.environ.get("FARM_FORECAST_FIT_DAYS", "365"))
+HORIZON = int(os.environ.get("FARM_FORECAST_HORIZON", "12"))
+# Months of expense history needed before seasonal terms are fit
+SEASONAL_MONTHS = 24
+INTERVAL = float(os.environ.get("FARM_FORECAST_INTERVAL", "300"))
+# Rows are re-read this far behind the newest fitted change, to catch late commits
+OVERLAP = timedelta(seconds=float(os.environ.get("FARM_FORECAST_OVERLAP", "300")))
+BATCH_ANIMALS = 5000
+# Categories forecast; the total is their sum, so the projections add up
+EXPENSE_CATEGORIES = tuple(column for column in rollups.EXPENSE_COLUMNS if column != "total_expense")
+
+FIT_COLUMNS = ("animal_id", "farm_id", "anchor_month", "anchor_kg", "gain_kg_per_day", "residual_kg", "points",
+               "mean_offset_days", "spread_days2", "source_updated_at")
+
+logger = logging.getLogger("farm.forecast")
+
+
+# One line per animal with two or more weigh-ins in the FIT_DAYS before its latest. Offsets are
+# days relative to the latest weigh-in, so anchor_kg is the fitted weight on that day.
+def fit_weights(weights):
+    if weights.empty:
+        return pd.DataFrame(columns=list(FIT_COLUMNS))
+    days = weights['month'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    order = np.lexsort((weights['weight_id'].to_numpy(), days, weights['animal_id'].to_numpy()))
+    weights = weights.iloc[order].reset_index(drop=True)
+    days = days[order]
+    animal = weights['animal_id'].to_numpy()
+    kg = weights['weight_kg'].to_numpy(dtype=np.float64)
+
+    first = np.flatnonzero(np.append(True, animal[1:] != animal[:-1]))
+    last = np.append(first[1:] - 1, len(weights) - 1)
+    sizes = np.diff(np.append(first, len(weights)))
+    t = (days - np.repeat(days[last], sizes)).astype(np.float64)
+    used = (t >= -FIT_DAYS).astype(np.float64)
+
+    # Normal equations of y = a + b t over each animal's rows in the window
+    n = np.add.reduceat(used, first)
+    st = np.add.reduceat(used * t, first)
+    sy = np.add.reduceat(used * kg, first)
+    stt = np.add.reduceat(used * t * t, first)
+    sty = np.add.reduceat(used * t * kg, first)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        spread = stt - st * st / n
+        slope = (sty - st * sy / n) / spread
+        intercept = (sy - slope * st) / n
+        residuals = used * (kg - np.repeat(intercept, sizes) - np.repeat(slope, sizes) * t)
+        residual_sd = np.sqrt(np.add.reduceat(residuals * residuals, first) / (n - 2))
+    updated = np.maximum.reduceat(weights['updated_at'].to_numpy(), first)
+
+    latest = weights.iloc[last].reset_index(drop=True)
+    fits = pd.DataFrame({
+        'animal_id': latest['animal_id'], 'farm_id': latest['farm_id'], 'anchor_month': latest['month'],
+        'anchor_kg': intercept, 'gain_kg_per_day': slope, 'residual_kg': np.where(n > 2, residual_sd, np.nan),
+        'points': n.astype(np.int32), 'mean_offset_days': st / n, 'spread_days2': spread,
+        'source_updated_at': updated,
+    })
+    # Weigh-ins all in one month leave the slope undefined
+    return fits[(n >= 2) & (spread > 0)].reset_index(drop=True)
+
+
+# Month starts following last, for HORIZON months
+def _future_months(last):
+    return pd.date_range(last + pd.offsets.MonthBegin(1), periods=HORIZON, freq="MS")
+
+
+def _design(month_numbers, months_of_year, seasonal):
+    columns = [np.ones(len(month_numbers)), month_numbers.astype(np.float64)]
+    if seasonal:
+        # January is the baseline month
+        columns += [(months_of_year == m).astype(np.float64) for m in range(2, 13)]
+    return np.column_stack(columns)
+
+
+# HORIZON months of projected expenses per category for one farm's Expense_Summary rows, as
+# (month, category, amount) rows. All categories are solved together as one least-squares system.
+def fit_expenses(expenses):
+    expenses = expenses.dropna(subset=['month']).sort_values('month')
+    if len(expenses) < 2:
+        return []
+    months = expenses['month'].dt.year.to_numpy() * 12 + expenses['month'].dt.month.to_numpy()
+    seasonal = months[-1] - months[0] + 1 >= SEASONAL_MONTHS
+    amounts = expenses[list(EXPENSE_CATEGORIES)].to_numpy(dtype=np.float64)
+    amounts = np.nan_to_num(amounts)
+    coefficients = np.linalg.lstsq(_design(months - months[0], expenses['month'].dt.month.to_numpy(), seasonal),
+                                   amounts, rcond=None)[0]
+
+    future = _future_months(expenses['month'].iloc[-1])
+    future_numbers = future.year.to_numpy() * 12 + future.month.to_numpy() - months[0]
+    projected = np.clip(_design(future_numbers, future.month.to_numpy(), seasonal) @ coefficients, 0, None)
+    rows = []
+    for month, values in zip(future.date, projected):
+        rows.extend((month, category, round(float(value), 2)) for category, value in zip(EXPENSE_CATEGORIES, values))
+        rows.append((month, "total_expense", round(float(values.sum()), 2)))
+    return rows
+
+
+# Refit the animals whose weights changed since the last pass, or every animal when there are
+# no fits yet or rebuild is set; returns animals refit
+def refresh_weights(shard, rebuild=False):
+    return database.refresh_from_weights(shard, "Weight_Forecast", FIT_COLUMNS, fit_weights, OVERLAP,
+                                         BATCH_ANIMALS, dates=("anchor_month",), rebuild=rebuild)
+
+
+# Farms whose expense summaries changed since they were forecast, or that lost their forecast's
+# basis. A farm with fewer than two dated summaries gets no forecast rows, so it is left out until
+# it has two; otherwise it would never count as fitted and be refit on every pass.
+def _stale_expense_farms(cursor):
+    cursor.execute("""
+        SELECT farm_id, MAX(updated_at) FROM Expense_Summary WHERE month IS NOT NULL
+        GROUP BY farm_id HAVING COUNT(*) >= 2
+    """)
+    changed = dict(cursor.fetchall())
+    cursor.execute("SELECT farm_id, MIN(fitted_at) FROM Expense_Forecast GROUP BY farm_id")
+    fitted = dict(cursor.fetchall())
+    # Timestamps have whole seconds, so a change in the second of the fit counts as newer
+    return ({farm_id for farm_id, updated_at in changed.items()
+             if farm_id not in fitted or updated_at >= fitted[farm_id]}
+            | (fitted.keys() - changed.keys()))
+
+
+# Refit the expense forecasts of the farms that need it, or of every farm with rebuild; returns farms refit
+def refresh_expenses(shard, rebuild=False):
+    connection = database.open_connection(shard)
+    try:
+        cursor = connection.cursor()
+        try:
+            if rebuild:
+                cursor.execute("SELECT DISTINCT farm_id FROM Expense_Summary")
+                stale = {row[0] for row in cursor.fetchall()}
+                cursor.execute("DELETE FROM Expense_Forecast")
+            else:
+                stale = _stale_expense_farms(cursor)
+            for farm_id in sorted(stale):
+                expenses = frames.read_frame(connection, f"""
+                    SELECT month, {", ".join(EXPENSE_CATEGORIES)} FROM Expense_Summary WHERE farm_id = %s
+                """, (farm_id,), frames.EXPENSE_KINDS)
+                cursor.execute("DELETE FROM Expense_Forecast WHERE farm_id = %s", (farm_id,))
+                cursor.executemany("""
+                    INSERT INTO Expense_Forecast (farm_id, month, category, amount) VALUES (%s, %s, %s, %s)
+                """, [(farm_id, *row) for row in fit_expenses(expenses)])
+            connection.commit()
+            return len(stale)
+        except Error:
+            connection.rollback()
+            raise
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+
+
+def _maintain(shard):
+    animals = refresh_weights(shard)
+    expense_farms = refresh_expenses(shard)
+    if animals or expense_farms:
+        logger.info("Refit the forecasts of %d animals and %d farms on shard %s", animals, expense_farms, shard)
+
+
+# Background thread that keeps every shard's forecasts current; started once per process
+def start_maintainer(interval=INTERVAL):
+    return database.start_maintainer("forecasts", _maintain, interval, logger, "Forecasting")
+
+
+# Half-width of the 95% prediction interval of the projections in rows (columns of
+# Weight_Forecast plus the target's offset in days from the anchor); NaN where it is unknown
+def prediction_interval(rows):
+    offset = rows['days_ahead'] - rows['mean_offset_days']
+    return 1.96 * rows['residual_kg'] * np.sqrt(1 + 1 / rows['points'] + offset * offset / rows['spread_days2'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refit the weight and expense forecasts.")
+    parser.add_argument("--shard", nargs="*", default=list(farms.SHARDS), choices=list(farms.SHARDS))
+    parser.add_argument("--rebuild", action="store_true", help="refit every animal and farm")
+    args = parser.parse_args(argv)
+    for shard in args.shard:
+        if not database.init_database(shard):
+            raise SystemExit(f"Could not prepare the schema of shard {shard}")
+        started = time.perf_counter()
+        animals = refresh_weights(shard, args.rebuild)
+        expense_farms = refresh_expenses(shard, args.rebuild)
+        print(f"{shard}: fit {animals:,} animals and {expense_farms:,} farms "
+              f"in {(time.perf_counter() - started) * 1000:,.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
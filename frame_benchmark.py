@@ -0,0 +1,119 @@
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+import benchmark
+import database
+import frames
+import synthetic
+
+# Compares the record pages' two ways of building a DataFrame on a large synthetic farm: the old
+# dictionary cursor + pd.DataFrame(fetchall()) + pd.to_datetime, and frames.read_frame. Reports
+# load time, peak Python allocations while loading and the finished frame's size.
+
+QUERIES = {
+    'weight records': ("""
+        SELECT mw.month, mw.weight_kg, a.tag_number, a.breed
+        FROM Monthly_Weight mw JOIN Animal a ON mw.animal_id = a.animal_id
+        WHERE mw.farm_id = %s ORDER BY mw.month DESC
+    """, 'month', frames.WEIGHT_RECORD_KINDS),
+    'feed records': ("""
+        SELECT fr.date, fr.feed_type, fr.quantity_kg, fr.cost, a.tag_number
+        FROM Feed_Record fr JOIN Animal a ON fr.animal_id = a.animal_id
+        WHERE fr.farm_id = %s ORDER BY fr.date DESC
+    """, 'date', frames.FEED_RECORD_KINDS),
+    'medical records': ("""
+        SELECT mr.date, mr.medicine_name, mr.quantity, mr.cost, mr.remarks, a.tag_number
+        FROM Medicine_Record mr JOIN Animal a ON mr.animal_id = a.animal_id
+        WHERE mr.farm_id = %s ORDER BY mr.date DESC
+    """, 'date', frames.MEDICAL_RECORD_KINDS),
+    'utility bills': ("""
+        SELECT bill_id, farm_id, month, type, amount FROM Utility_Bill
+        WHERE farm_id = %s ORDER BY month DESC
+    """, 'month', frames.UTILITY_BILL_KINDS),
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark DataFrame loading for the record pages.")
+    parser.add_argument("--database", default="farm_frame_bench",
+                        help="scratch database to load (never the production one)")
+    parser.add_argument("--herd-size", type=int, default=2000)
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--runs", type=int, default=3, help="measured loads per query and loader")
+    parser.add_argument("--skip-load", action="store_true", help="reuse the data already in --database")
+    return parser.parse_args(argv)
+
+
+def load_dicts(connection, sql, date_column):
+    cursor = connection.cursor(dictionary=True)
+    try:
+        cursor.execute(sql, (1,))
+        df = pd.DataFrame(cursor.fetchall())
+    finally:
+        cursor.close()
+    if not df.empty:
+        df[date_column] = pd.to_datetime(df[date_column])
+    return df
+
+
+def load_typed(connection, sql, date_column, kinds):
+    return frames.read_frame(connection, sql, (1,), kinds)
+
+
+# (best load ms, peak traced KB, frame KB, rows) for one loader. Allocations are traced in a
+# separate run, as tracing slows allocation-heavy code down and would skew the timings.
+def measure(load, runs):
+    times = []
+    for _ in range(runs):
+        gc.collect()
+        started = time.perf_counter()
+        df = load()
+        times.append((time.perf_counter() - started) * 1000)
+    del df
+    gc.collect()
+    tracemalloc.start()
+    try:
+        df = load()
+        peak = tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+    return min(times), peak, df.memory_usage(deep=True).sum() / 1024, len(df)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    benchmark.use_database(args.database)
+    if not args.skip_load:
+        benchmark.load_farm(synthetic.SyntheticFarm(herd_size=args.herd_size, years=args.years, seed=args.seed,
+                                                    image_width=32))
+    connection = database.create_connection()
+    if connection is None:
+        raise SystemExit("Could not connect to the benchmark database")
+
+    header = (f"{'query':<16} {'loader':<7} {'rows':>9} {'load ms':>9} {'peak KB':>11} {'frame KB':>10}")
+    print(header)
+    print("-" * len(header))
+    try:
+        for name, (sql, date_column, kinds) in QUERIES.items():
+            results = {
+                'dicts': measure(lambda: load_dicts(connection, sql, date_column), args.runs),
+                'typed': measure(lambda: load_typed(connection, sql, date_column, kinds), args.runs),
+            }
+            for loader, (ms, peak, size, rows) in results.items():
+                print(f"{name:<16} {loader:<7} {rows:>9,} {ms:>9.1f} {peak:>11,.0f} {size:>10,.0f}")
+            old, new = results['dicts'], results['typed']
+            print(f"{'':<16} {'saved':<7} {'':>9} {1 - new[0] / old[0]:>9.0%} {1 - new[1] / old[1]:>11.0%} "
+                  f"{1 - new[2] / old[2]:>10.0%}")
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
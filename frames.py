@@ -0,0 +1,130 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+# Typed DataFrame loading for the record pages. Rows are fetched as tuples in chunks and each
+# chunk is converted straight into its column's dtype, so no dict is built per row and no column
+# is left as Python objects to be re-parsed later. Column kinds:
+#
+#   "date"      DATE/DATETIME -> datetime64 (NULL -> NaT)
+#   "float32"   FLOAT columns; MySQL FLOAT is single precision anyway (NULL -> NaN)
+#   "float64"   sums and other double precision values (NULL -> NaN)
+#   "int32"     ids and counts; NULL is not allowed
+#   "category"  repetitive text such as feed_type or breed, stored as codes (NULL -> NaN)
+#
+# Columns without a kind are left to pandas, e.g. free text and tag numbers.
+FETCH_ROWS = 5000
+
+
+class _Column:
+    def __init__(self, kind):
+        self.kind = kind
+        self.chunks = []
+        # category -> code, in order of first appearance
+        self.categories = {}
+
+    def add(self, values):
+        if self.kind == "date":
+            self.chunks.append(pd.DatetimeIndex(values).as_unit("us").to_numpy())
+        elif self.kind in ("float32", "float64"):
+            try:
+                self.chunks.append(np.array(values, dtype=self.kind))
+            except TypeError:
+                # The chunk has NULLs
+                self.chunks.append(np.fromiter((math.nan if v is None else v for v in values),
+                                               dtype=self.kind, count=len(values)))
+        elif self.kind == "int32":
+            self.chunks.append(np.fromiter(values, dtype=np.int32, count=len(values)))
+        elif self.kind == "category":
+            # Code the chunk, then map its few distinct values onto the column's categories
+            codes, uniques = pd.factorize(np.array(values, dtype=object))
+            mapping = np.array([self.categories.setdefault(v, len(self.categories)) for v in uniques] + [-1],
+                               dtype=np.int32)
+            self.chunks.append(mapping[codes])
+        else:
+            self.chunks.append(np.array(values, dtype=object))
+
+    def finish(self):
+        values = np.concatenate(self.chunks) if self.chunks else np.array([], dtype=_EMPTY[self.kind])
+        if self.kind == "category":
+            return pd.Categorical.from_codes(values, categories=list(self.categories))
+        return values
+
+
+_EMPTY = {"date": "datetime64[us]", "float32": np.float32, "float64": np.float64, "int32": np.int32,
+          "category": np.int32, None: object}
+
+
+# Run a query on its own tuple cursor and load the result into a DataFrame typed by kinds,
+# a dict of column name -> kind
+def read_frame(connection, sql, params=None, kinds=None, chunk_rows=FETCH_ROWS):
+    kinds = kinds or {}
+    cursor = connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        names = [d[0] for d in cursor.description]
+        columns = [_Column(kinds.get(name)) for name in names]
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            for column, values in zip(columns, zip(*rows)):
+                column.add(values)
+    finally:
+        cursor.close()
+    return pd.DataFrame({name: column.finish() for name, column in zip(names, columns)}, copy=False)
+
+
+# A shard's weigh-ins, or only those of the given animals, typed for the weight models
+def read_weights(connection, animal_ids=None):
+    where = ""
+    if animal_ids is not None:
+        where = f"AND animal_id IN ({', '.join(['%s'] * len(animal_ids))})"
+    return read_frame(connection, f"""
+        SELECT weight_id, animal_id, farm_id, month, weight_kg, updated_at FROM Monthly_Weight
+        WHERE animal_id IS NOT NULL AND month IS NOT NULL AND weight_kg IS NOT NULL {where}
+    """, tuple(animal_ids or ()), WEIGHT_HISTORY_KINDS)
+
+
+# A DataFrame's columns as tuples for executemany: NaN and NaT become None, and datetime64 columns
+# become datetimes, or dates for the columns named in dates
+def to_rows(frame, columns, dates=()):
+    values = []
+    for name in columns:
+        column = frame[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            stamps = [None if v is pd.NaT else v for v in column.dt.to_pydatetime().tolist()]
+            values.append([v and v.date() for v in stamps] if name in dates else stamps)
+        else:
+            values.append([None if v != v else v for v in column.tolist()])
+    return list(zip(*values))
+
+
+# Column kinds of the record pages' DataFrames
+WEIGHT_RECORD_KINDS = {'month': 'date', 'weight_kg': 'float32', 'breed': 'category'}
+FEED_RECORD_KINDS = {'date': 'date', 'feed_type': 'category', 'quantity_kg': 'float32', 'cost': 'float32'}
+MEDICAL_RECORD_KINDS = {'date': 'date', 'medicine_name': 'category', 'cost': 'float32'}
+EXPENSE_KINDS = {'expense_id': 'int32', 'farm_id': 'int32', 'month': 'date', 'total_feed_cost': 'float32',
+                 'total_medicine_cost': 'float32', 'total_salaries': 'float32', 'total_utilities': 'float32',
+                 'other_expenses': 'float32', 'total_expense': 'float32'}
+UTILITY_BILL_KINDS = {'bill_id': 'int32', 'farm_id': 'int32', 'month': 'date', 'type': 'category',
+                      'amount': 'float32'}
+TIMELINE_KINDS = {'event_date': 'date', 'kind': 'category', 'event_id': 'int32', 'item': 'category',
+                  'weight_kg': 'float32', 'cost': 'float32', 'cumulative_cost': 'float64',
+                  'weight_change_kg': 'float32', 'gain_since_arrival_kg': 'float32'}
+COHORT_KINDS = {'animals': 'int32', 'herd_share_pct': 'float64', 'mortality_pct': 'float64', 'avg_gain_kg': 'float64',
+                'avg_daily_gain_kg': 'float64', 'avg_feed_cost': 'float64', 'avg_medicine_cost': 'float64',
+                'cost_per_kg_gain': 'float64', 'gain_rank': 'int32'}
+COHORT_TREND_KINDS = {'month': 'date', 'avg_weight_kg': 'float64'}
+FINANCE_ROLLUP_KINDS = {'period_start': 'date', 'source': 'category', 'category': 'category', 'amount': 'float64'}
+HEALTH_ALERT_KINDS = {'animal_id': 'int32', 'breed': 'category', 'latest_month': 'date',
+                      'latest_weight_kg': 'float32', 'monthly_gain_kg': 'float32', 'gain_z': 'float32',
+                      'drop_pct': 'float32', 'gap_months': 'int32', 'overdue_months': 'int32', 'score': 'float32',
+                      'priority': 'float64'}
+WEIGHT_HISTORY_KINDS = {'weight_id': 'int32', 'animal_id': 'int32', 'farm_id': 'int32', 'month': 'date',
+                        'weight_kg': 'float32', 'updated_at': 'date'}
+WEIGHT_FORECAST_KINDS = {'breed': 'category', 'anchor_month': 'date', 'projected_kg': 'float64',
+                         'gain_kg_per_day': 'float32', 'residual_kg': 'float32', 'points': 'int32',
+                         'mean_offset_days': 'float32', 'spread_days2': 'float64', 'days_ahead': 'int32'}
+EXPENSE_FORECAST_KINDS = {'month': 'date', 'category': 'category', 'amount': 'float64'}
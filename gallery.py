@@ -0,0 +1,159 @@
+import json
+import math
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+# Virtualized card gallery: the browser gets the card text as JSON and builds DOM nodes only for
+# the rows in or near its scroll window, so the page stays the same size for 20 or 20,000 cards.
+# Photos are <img loading="lazy"> pointing at the image server and load as their row scrolls in.
+GALLERY_HEIGHT = 720
+CARD_HEIGHT = 380
+MIN_CARD_WIDTH = 240
+GAP = 16
+
+_TEMPLATE = """
+<style>
+    body { margin: 0; font-family: "Source Sans Pro", sans-serif; }
+    #viewport { overflow-y: auto; position: relative; }
+    #spacer { position: relative; }
+    .card {
+        box-sizing: border-box;
+        background-color: white;
+        border-radius: 10px;
+        padding: 15px;
+        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+        overflow: hidden;
+    }
+    .card h3 { margin: 0 0 8px 0; }
+    .card p { margin: 4px 0; }
+    .card img, .card .placeholder {
+        width: 100%;
+        height: 180px;
+        margin-top: 10px;
+        border-radius: 8px;
+        object-fit: cover;
+        background-color: #f0f2f6;
+    }
+    .card .placeholder { display: flex; align-items: center; justify-content: center; color: #6c757d; }
+</style>
+<div id="viewport" style="height: __HEIGHT__px"><div id="spacer"></div></div>
+<script>
+const cards = __CARDS__;
+const CARD_HEIGHT = __CARD_HEIGHT__, MIN_WIDTH = __MIN_WIDTH__, GAP = __GAP__, OVERSCAN = 2;
+const ROW_HEIGHT = CARD_HEIGHT + GAP;
+const viewport = document.getElementById("viewport");
+const spacer = document.getElementById("spacer");
+const rendered = new Map();
+let columns = 1;
+
+function placeholder(text) {
+    const div = document.createElement("div");
+    div.className = "placeholder";
+    div.textContent = text;
+    return div;
+}
+
+function build(card) {
+    const el = document.createElement("div");
+    el.className = "card";
+    const title = document.createElement("h3");
+    title.textContent = card.title;
+    el.appendChild(title);
+    for (const [label, value] of card.lines) {
+        const p = document.createElement("p");
+        if (label) {
+            const strong = document.createElement("strong");
+            strong.textContent = label + ": ";
+            p.appendChild(strong);
+        }
+        p.appendChild(document.createTextNode(value));
+        el.appendChild(p);
+    }
+    if (card.pending) {
+        el.appendChild(placeholder("🖼️ Processing photo…"));
+    } else if (card.image) {
+        const img = document.createElement("img");
+        img.loading = "lazy";
+        img.decoding = "async";
+        img.alt = card.title;
+        img.src = card.image;
+        el.appendChild(img);
+    } else {
+        el.appendChild(placeholder("No image available"));
+    }
+    return el;
+}
+
+function update() {
+    const rows = Math.ceil(cards.length / columns);
+    const first = Math.max(0, Math.floor(viewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+    const last = Math.min(rows - 1, Math.ceil((viewport.scrollTop + viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+    const start = first * columns;
+    const end = Math.min(cards.length, (last + 1) * columns);
+
+    for (const [index, el] of rendered) {
+        if (index < start || index >= end) {
+            el.remove();
+            rendered.delete(index);
+        }
+    }
+    const width = (viewport.clientWidth - GAP * (columns - 1)) / columns;
+    for (let index = start; index < end; index++) {
+        if (rendered.has(index)) continue;
+        const el = build(cards[index]);
+        const row = Math.floor(index / columns), column = index % columns;
+        el.style.cssText = `position: absolute; top: ${row * ROW_HEIGHT}px; left: ${column * (width + GAP)}px; ` +
+                           `width: ${width}px; height: ${CARD_HEIGHT}px;`;
+        spacer.appendChild(el);
+        rendered.set(index, el);
+    }
+}
+
+function layout() {
+    columns = Math.max(1, Math.floor((viewport.clientWidth + GAP) / (MIN_WIDTH + GAP)));
+    spacer.style.height = Math.ceil(cards.length / columns) * ROW_HEIGHT + "px";
+    for (const el of rendered.values()) el.remove();
+    rendered.clear();
+    update();
+}
+
+let frame = null;
+viewport.addEventListener("scroll", () => {
+    if (frame === null) {
+        frame = requestAnimationFrame(() => { frame = null; update(); });
+    }
+}, { passive: true });
+new ResizeObserver(layout).observe(viewport);
+layout();
+</script>
+"""
+
+
+# One gallery card; lines are (label, value) pairs, label None for a plain paragraph
+def card(title, lines, image_url=None, pending=False):
+    return {
+        'title': str(title),
+        'lines': [[label, str(value)] for label, value in lines],
+        'image': image_url,
+        'pending': bool(pending),
+    }
+
+
+def render_gallery(cards, height=GALLERY_HEIGHT, card_height=CARD_HEIGHT, min_card_width=MIN_CARD_WIDTH):
+    # Shrink to fit short galleries, assuming the usual three columns
+    rows = math.ceil(len(cards) / 3)
+    height = min(height, rows * (card_height + GAP))
+    # No "<" may reach the script element, or a record could close it
+    payload = json.dumps(cards).replace("<", "\\u003c")
+    document = (_TEMPLATE
+                .replace("__CARDS__", payload)
+                .replace("__HEIGHT__", str(height))
+                .replace("__CARD_HEIGHT__", str(card_height))
+                .replace("__MIN_WIDTH__", str(min_card_width))
+                .replace("__GAP__", str(GAP)))
+    # st.iframe replaces components.html in newer Streamlit releases
+    if hasattr(st, "iframe"):
+        st.iframe(document, height=height + 8)
+    else:
+        components.html(document, height=height + 8)
@@ -0,0 +1,175 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import database
+import farms
+import frames
+
+# Herd health alerts from the weight history. Every animal's Monthly_Weight rows are scored in
+# one vectorized pass over arrays sorted by animal and month, and the result is kept in
+# Health_Score, one row per animal:
+#
+#   gain_z      the latest monthly gain against the animal's own earlier gains, in standard
+#               deviations; a stalled or losing animal scores well below zero
+#   drop_pct    weight lost since the previous weigh-in, as a fraction of it
+#   gap_months  weigh-ins missed just before the latest one
+#
+# Later passes re-score only the animals whose rows changed since the newest change already
+# scored. Weigh-ins that are overdue now are counted when the alerts are read.
+Z_ALERT = float(os.environ.get("FARM_HEALTH_Z", "2.0"))
+DROP_ALERT = float(os.environ.get("FARM_HEALTH_DROP", "0.03"))
+# Earlier gains needed before the latest one is judged against them
+MIN_HISTORY = 3
+# Spread below which an animal's gains count as steady, so a very even grower is not flagged
+# for an ordinary month
+MIN_GAIN_STD_KG = 2.0
+# Animals unweighed for longer have most likely left the farm and are not listed
+OVERDUE_MONTHS = int(os.environ.get("FARM_HEALTH_OVERDUE_MONTHS", "6"))
+INTERVAL = float(os.environ.get("FARM_HEALTH_INTERVAL", "60"))
+# Rows are re-read this far behind the newest scored change, to catch late commits
+OVERLAP = timedelta(seconds=float(os.environ.get("FARM_HEALTH_OVERLAP", "300")))
+BATCH_ANIMALS = 5000
+ALERT_ROWS = 25
+
+SCORE_COLUMNS = ("animal_id", "farm_id", "latest_month", "latest_weight_kg", "monthly_gain_kg", "gain_z",
+                 "drop_pct", "gap_months", "score", "source_updated_at")
+
+logger = logging.getLogger("farm.health")
+
+
+# One row per animal in weights (frames.read_weights rows), scored without a
+# Python loop over animals or rows: the rows are sorted by animal, and per-animal sums are taken
+# with reduceat over each animal's run of rows
+def score(weights):
+    if weights.empty:
+        return pd.DataFrame(columns=list(SCORE_COLUMNS))
+    month = (weights['month'].dt.year * 12 + weights['month'].dt.month).to_numpy()
+    order = np.lexsort((weights['weight_id'].to_numpy(), month, weights['animal_id'].to_numpy()))
+    weights = weights.iloc[order].reset_index(drop=True)
+    month = month[order]
+    animal = weights['animal_id'].to_numpy()
+    kg = weights['weight_kg'].to_numpy(dtype=np.float64)
+
+    # Each row against the animal's previous weigh-in; a second weigh-in in one month has no gain
+    same = np.zeros(len(weights), dtype=bool)
+    same[1:] = animal[1:] == animal[:-1]
+    gap = np.where(same, np.diff(month, prepend=0), 0)
+    change = np.where(same, np.diff(kg, prepend=np.nan), np.nan)
+    gain = np.where(gap > 0, change / np.maximum(gap, 1), np.nan)
+    first = np.flatnonzero(~same)
+    last = np.append(first[1:] - 1, len(weights) - 1)
+
+    # Mean and spread of each animal's gains before its latest
+    earlier = gain.copy()
+    earlier[last] = np.nan
+    known = ~np.isnan(earlier)
+    earlier[~known] = 0
+    count = np.add.reduceat(known.astype(np.int32), first)
+    total = np.add.reduceat(earlier, first)
+    squares = np.add.reduceat(earlier * earlier, first)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        std = np.sqrt(np.maximum(squares - total * mean, 0) / (count - 1))
+        latest_gain = gain[last]
+        z = np.where(count >= MIN_HISTORY, (latest_gain - mean) / np.maximum(std, MIN_GAIN_STD_KG), np.nan)
+        drop = np.nan_to_num(np.clip(-change[last] / (kg[last] - change[last]), 0, None))
+    missed = np.maximum(gap[last] - 1, 0)
+    updated = np.maximum.reduceat(weights['updated_at'].to_numpy(), first)
+
+    # Each signal past its threshold adds its size in thresholds; zero means nothing to report
+    severity = (np.where(z <= -Z_ALERT, -z / Z_ALERT, 0) + np.where(drop >= DROP_ALERT, drop / DROP_ALERT, 0)
+                + missed)
+    latest = weights.iloc[last].reset_index(drop=True)
+    return pd.DataFrame({
+        'animal_id': latest['animal_id'], 'farm_id': latest['farm_id'], 'latest_month': latest['month'],
+        'latest_weight_kg': latest['weight_kg'], 'monthly_gain_kg': latest_gain, 'gain_z': z,
+        'drop_pct': drop, 'gap_months': missed, 'score': severity, 'source_updated_at': updated,
+    })
+
+
+# Score every animal of the shard from scratch; returns animals scored
+def rebuild(shard):
+    return refresh(shard, rebuild=True)
+
+
+# Re-score the animals whose weights changed since the last pass, or every animal when there are
+# no scores yet or rebuild is set; returns animals re-scored
+def refresh(shard, rebuild=False):
+    return database.refresh_from_weights(shard, "Health_Score", SCORE_COLUMNS, score, OVERLAP, BATCH_ANIMALS,
+                                         dates=("latest_month",), rebuild=rebuild)
+
+
+def _maintain(shard):
+    started = time.perf_counter()
+    scored = refresh(shard)
+    if scored:
+        logger.info("Scored the health of %d animals on shard %s in %.0f ms", scored, shard,
+                    (time.perf_counter() - started) * 1000)
+
+
+# Background thread that keeps every shard's scores current; started once per process
+def start_maintainer(interval=INTERVAL):
+    return database.start_maintainer("health-scores", _maintain, interval, logger, "Health scoring")
+
+
+# Query for run_queries listing a farm's animals most in need of a look, worst first. Weigh-ins
+# are overdue when the animal's latest is older than the farm's latest.
+def alerts_query(farm_id, rows=ALERT_ROWS):
+    return ("""
+        WITH ref AS (
+            SELECT MAX(latest_month) AS month FROM Health_Score WHERE farm_id = %(farm_id)s
+        ), scored AS (
+            SELECT hs.animal_id, a.tag_number, a.breed, hs.latest_month, hs.latest_weight_kg,
+                   hs.monthly_gain_kg, hs.gain_z, hs.drop_pct, hs.gap_months,
+                   (YEAR(ref.month) - YEAR(hs.latest_month)) * 12 + MONTH(ref.month) - MONTH(hs.latest_month)
+                       AS overdue_months,
+                   hs.score
+            FROM Health_Score hs
+            CROSS JOIN ref
+            JOIN Animal a ON a.animal_id = hs.animal_id
+            WHERE hs.farm_id = %(farm_id)s AND a.status = 'active'
+        )
+        SELECT scored.*, score + overdue_months AS priority FROM scored
+        WHERE overdue_months <= %(overdue)s AND (score > 0 OR overdue_months > 0)
+        ORDER BY priority DESC, animal_id
+        LIMIT %(rows)s
+    """, {'farm_id': farm_id, 'overdue': OVERDUE_MONTHS, 'rows': rows}, frames.HEALTH_ALERT_KINDS)
+
+
+# Why an alert row is listed, for display
+def reasons(alert):
+    found = []
+    if alert['gain_z'] <= -Z_ALERT:
+        found.append(f"gain {-alert['gain_z']:.1f} sd below usual")
+    if alert['drop_pct'] >= DROP_ALERT:
+        found.append(f"lost {alert['drop_pct']:.0%}")
+    if alert['gap_months']:
+        found.append(f"{alert['gap_months']} weigh-in(s) missed")
+    if alert['overdue_months']:
+        found.append(f"weigh-in {alert['overdue_months']} month(s) overdue")
+    return ", ".join(found)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score herd health from the weight history.")
+    parser.add_argument("--shard", nargs="*", default=list(farms.SHARDS), choices=list(farms.SHARDS))
+    parser.add_argument("--rebuild", action="store_true", help="score every animal again")
+    args = parser.parse_args(argv)
+    for shard in args.shard:
+        if not database.init_database(shard):
+            raise SystemExit(f"Could not prepare the schema of shard {shard}")
+        started = time.perf_counter()
+        scored = rebuild(shard) if args.rebuild else refresh(shard)
+        print(f"{shard}: scored {scored:,} animals in {(time.perf_counter() - started) * 1000:,.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
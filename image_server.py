@@ -0,0 +1,110 @@
+import re
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from mysql.connector import Error
+
+import farms
+import metrics
+from database import fetch_stored_image
+
+# Serves Image_Store entries at /images/<sha256>, from the default shard or the one named by
+# ?shard=. The URL names the content, so a response never changes and browsers may keep it for
+# a year without revalidating.
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+CACHE_SIZE = 256
+
+_HASH_PATH = re.compile(r"^/images/([0-9a-f]{64})$")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def content_type(data):
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    return "application/octet-stream"
+
+
+def _load(image_hash, shard):
+    with _cache_lock:
+        data = _cache.get(image_hash)
+        if data is not None:
+            _cache.move_to_end(image_hash)
+    metrics.count_cache("served_images", data is not None)
+    if data is None:
+        data = fetch_stored_image(image_hash, shard)
+        if data is not None:
+            with _cache_lock:
+                _cache[image_hash] = data
+                while len(_cache) > CACHE_SIZE:
+                    _cache.popitem(last=False)
+    return data
+
+
+class _ImageHandler(BaseHTTPRequestHandler):
+    def _respond(self, send_body):
+        url = urlsplit(self.path)
+        match = _HASH_PATH.match(url.path)
+        shard = parse_qs(url.query).get("shard", [farms.DEFAULT_SHARD])[0]
+        if not match or shard not in farms.SHARDS:
+            self.send_error(404)
+            return
+        image_hash = match.group(1)
+        etag = f'"{image_hash}"'
+
+        # The hash is the version, so a matching tag needs no database lookup at all
+        if_none_match = self.headers.get("If-None-Match", "")
+        if if_none_match == "*" or etag in if_none_match:
+            metrics.IMAGE_REQUESTS.inc(status="304")
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", CACHE_CONTROL)
+            self.end_headers()
+            return
+
+        try:
+            data = _load(image_hash, shard)
+        except Error:
+            metrics.IMAGE_REQUESTS.inc(status="503")
+            self.send_error(503)
+            return
+        if data is None:
+            metrics.IMAGE_REQUESTS.inc(status="404")
+            self.send_error(404)
+            return
+
+        metrics.IMAGE_REQUESTS.inc(status="200")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type(data))
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", CACHE_CONTROL)
+        self.send_header("X-Content-Type-Options", "nosniff")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+            metrics.IMAGE_BYTES.inc(len(data))
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /images/<hash> on a local port from a daemon thread
+def start_http_server(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _ImageHandler)
+    thread = threading.Thread(target=server.serve_forever, name="image-server", daemon=True)
+    thread.start()
+    return server
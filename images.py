@@ -0,0 +1,160 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import mysql.connector
+from PIL import Image, ImageOps
+
+import metrics
+
+# Uploaded photos are normalised off the request path: validated, turned upright,
+# stripped of EXIF/GPS metadata, capped in size and re-encoded as WebP.
+MAX_UPLOAD_BYTES = int(os.environ.get("FARM_IMAGE_MAX_UPLOAD_MB", "25")) * 2**20
+MAX_PIXELS = int(os.environ.get("FARM_IMAGE_MAX_PIXELS", str(64 * 10**6)))
+MAX_SIDE = int(os.environ.get("FARM_IMAGE_MAX_SIDE", "1024"))
+WEBP_QUALITY = int(os.environ.get("FARM_IMAGE_QUALITY", "80"))
+WORKERS = int(os.environ.get("FARM_IMAGE_WORKERS", "2"))
+
+ACCEPTED_FORMATS = {"JPEG", "PNG", "WEBP", "MPO"}
+
+# Tables with an uploadable image, and their primary keys
+IMAGE_TABLES = {
+    "Animal_Category": "category_id",
+    "Animal": "animal_id",
+    "Staff": "staff_id",
+}
+
+logger = logging.getLogger("farm.images")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class InvalidImage(ValueError):
+    pass
+
+
+# Validate an upload and return it as a size-capped WebP without metadata
+def process_image(data, max_side=MAX_SIDE, quality=WEBP_QUALITY):
+    if not data:
+        raise InvalidImage("empty upload")
+    if len(data) > MAX_UPLOAD_BYTES:
+        raise InvalidImage(f"upload is {len(data) / 2**20:.1f} MiB, over the {MAX_UPLOAD_BYTES // 2**20} MiB limit")
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format not in ACCEPTED_FORMATS:
+            raise InvalidImage(f"unsupported image format {image.format}")
+        if image.width * image.height > MAX_PIXELS:
+            raise InvalidImage(f"image is {image.width}x{image.height}, too many pixels")
+        image.load()
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImage(f"not a readable image: {e}") from e
+
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buffer = io.BytesIO()
+    # A freshly built image carries no EXIF, ICC or XMP unless they are passed to save()
+    image.save(buffer, format="WEBP", quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def content_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+# Add image bytes to the shared store; identical images are stored once. Returns the hash.
+def store_image(cursor, data):
+    image_hash = content_hash(data)
+    cursor.execute("INSERT IGNORE INTO Image_Store (image_hash, data, bytes) VALUES (%s, %s, %s)",
+                   (image_hash, data, len(data)))
+    return image_hash
+
+
+# Runs in a worker process: process the upload and store it, unless a newer upload replaced it
+def process_and_store(db_config, table, key, job, data):
+    key_column = IMAGE_TABLES[table]
+    try:
+        image = process_image(data)
+        failure = None
+    except InvalidImage as e:
+        image, failure = None, str(e)
+
+    connection = mysql.connector.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        if image is None:
+            # Keep whatever image the row had before this upload
+            cursor.execute(f"UPDATE {table} SET image_job = NULL WHERE {key_column} = %s AND image_job = %s",
+                           (key, job))
+        else:
+            image_hash = store_image(cursor, image)
+            cursor.execute(f"UPDATE {table} SET image = NULL, image_hash = %s, image_job = NULL "
+                           f"WHERE {key_column} = %s AND image_job = %s", (image_hash, key, job))
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+    return {'table': table, 'key': key, 'bytes_in': len(data),
+            'bytes_out': len(image) if image else 0, 'error': failure}
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Spawned, not forked: the parent is a multi-threaded Streamlit server
+            _executor = ProcessPoolExecutor(max_workers=WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+# Give up on a job that never reached its row, so the card falls back to the row's previous image
+def _clear_job(db_config, table, key, job):
+    connection = mysql.connector.connect(**db_config)
+    try:
+        cursor = connection.cursor()
+        cursor.execute(f"UPDATE {table} SET image_job = NULL WHERE {IMAGE_TABLES[table]} = %s AND image_job = %s",
+                       (key, job))
+        connection.commit()
+        cursor.close()
+    finally:
+        connection.close()
+
+
+def _job_done(db_config, table, key, job, future):
+    try:
+        result = future.result()
+    except Exception as e:
+        metrics.IMAGE_JOBS.inc(status="error")
+        logger.error("Image worker failed for %s %s: %s", table, key, e)
+        try:
+            _clear_job(db_config, table, key, job)
+        except mysql.connector.Error as e:
+            logger.error("Could not clear the failed image job of %s %s: %s", table, key, e)
+        return
+    if result['error']:
+        metrics.IMAGE_JOBS.inc(status="rejected")
+        logger.warning("Rejected upload for %s %s: %s", result['table'], result['key'], result['error'])
+    else:
+        metrics.IMAGE_JOBS.inc(status="stored")
+
+
+# New job id to store in the row's image_job column alongside the write that accepts the upload
+def new_job():
+    return uuid.uuid4().hex
+
+
+# Hand an accepted upload to the worker pool; call after the row with image_job = job is committed
+def submit(db_config, table, key, job, data):
+    future = _get_executor().submit(process_and_store, dict(db_config), table, key, job, data)
+    future.add_done_callback(partial(_job_done, dict(db_config), table, key, job))
+    return future
@@ -0,0 +1,139 @@
+import argparse
+import csv
+import io
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timedelta
+
+import benchmark
+import database
+import ingest_server
+import instrumentation
+import synthetic
+
+# Measures ingest throughput: loads a synthetic herd into a scratch database, starts the ingest
+# service in-process and posts readings from several device threads until all are written.
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scale/RFID ingest service.")
+    parser.add_argument("--database", default="farm_ingest_bench",
+                        help="scratch database to load (never the production one)")
+    parser.add_argument("--herd-size", type=int, default=500)
+    parser.add_argument("--readings", type=int, default=100_000, help="readings to send in total")
+    parser.add_argument("--batch", type=int, default=500, help="readings per request")
+    parser.add_argument("--devices", type=int, default=8, help="concurrent device threads")
+    parser.add_argument("--format", choices=["json", "csv"], default="json")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--skip-load", action="store_true", help="reuse the herd already in --database")
+    return parser.parse_args(argv)
+
+
+def encode(readings, fmt):
+    if fmt == "csv":
+        out = io.StringIO()
+        writer = csv.DictWriter(out, fieldnames=["tag_number", "weight_kg", "read_at"])
+        writer.writeheader()
+        writer.writerows(readings)
+        return out.getvalue().encode("utf-8"), "text/csv"
+    return json.dumps({'readings': readings}).encode("utf-8"), "application/json"
+
+
+class Device(threading.Thread):
+    def __init__(self, device_id, url, batches, fmt):
+        super().__init__(name=f"device-{device_id}", daemon=True)
+        self.url = f"{url}/readings?device=scale-{device_id}"
+        self.batches = batches
+        self.fmt = fmt
+        self.accepted = 0
+        self.retries = 0
+        self.latencies = []
+
+    def post(self, body, content_type):
+        request = urllib.request.Request(self.url, data=body, headers={'Content-Type': content_type})
+        started = time.perf_counter()
+        with urllib.request.urlopen(request) as response:
+            result = json.load(response)
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        return result
+
+    def run(self):
+        for batch in self.batches:
+            body, content_type = encode(batch, self.fmt)
+            while True:
+                try:
+                    self.accepted += self.post(body, content_type)['accepted']
+                    break
+                except urllib.error.HTTPError as e:
+                    if e.code != 503:
+                        raise
+                    # Backpressure: wait as the service asks, then resend the same batch
+                    self.retries += 1
+                    time.sleep(float(e.headers.get("Retry-After", "1")))
+
+
+def make_batches(tags, start, args):
+    rng = random.Random(args.seed)
+    readings = [{
+        'tag_number': rng.choice(tags),
+        'weight_kg': round(rng.uniform(150, 700), 1),
+        'read_at': (start + timedelta(seconds=i)).isoformat(),
+    } for i in range(args.readings)]
+    batches = [readings[i:i + args.batch] for i in range(0, len(readings), args.batch)]
+    return [batches[i::args.devices] for i in range(args.devices)]
+
+
+def reading_stats():
+    row = database.run_queries({'stats': ("SELECT COUNT(*) as n, MAX(read_at) as latest FROM Weight_Reading",
+                                           None)})['stats'][0]
+    return row['n'], row['latest']
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    benchmark.use_database(args.database)
+    if not args.skip_load:
+        benchmark.load_farm(synthetic.SyntheticFarm(herd_size=args.herd_size, years=1, seed=args.seed,
+                                                    image_width=32))
+    tags = [row['tag_number'] for row in
+            database.run_queries({'tags': ("SELECT tag_number FROM Animal", None)})['tags']]
+    if not tags:
+        raise SystemExit("The benchmark database has no animals")
+
+    server = ingest_server.start_http_server(0)
+    url = f"http://127.0.0.1:{server.server_port}"
+    before, latest = reading_stats()
+    # Start after any earlier run's readings, which the service would ignore as duplicates
+    start = latest + timedelta(seconds=1) if latest else datetime(2025, 1, 1)
+    devices = [Device(i, url, batches, args.format) for i, batches in enumerate(make_batches(tags, start, args))]
+
+    started = time.perf_counter()
+    for device in devices:
+        device.start()
+    for device in devices:
+        device.join()
+    accepted_at = time.perf_counter()
+    if not ingest_server.wait_idle(600):
+        raise SystemExit("Readings were still queued after 10 minutes")
+    written_at = time.perf_counter()
+    server.shutdown()
+
+    accepted = sum(d.accepted for d in devices)
+    written = reading_stats()[0] - before
+    latencies = [ms for d in devices for ms in d.latencies]
+    print(f"readings sent          {args.readings:,} in batches of {args.batch} from {args.devices} devices")
+    print(f"accepted               {accepted:,} ({accepted / (accepted_at - started):,.0f}/s)")
+    print(f"written                {written:,} ({written / (written_at - started):,.0f}/s end to end)")
+    print(f"503 retries            {sum(d.retries for d in devices):,}")
+    print(f"request p50 / p95      {instrumentation.percentile(latencies, 50):.1f} / "
+          f"{instrumentation.percentile(latencies, 95):.1f} ms")
+    return 0 if written == accepted else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+import argparse
+import csv
+import io
+import json
+import logging
+import math
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from mysql.connector import Error
+from mysql.connector.errors import InterfaceError, OperationalError
+
+import database
+import farms
+import metrics
+import rollups
+
+# HTTP ingestion for weigh scales and RFID readers. Devices POST batches of readings as JSON or
+# CSV to /readings?farm=<id>; tags are resolved through a cached tag -> animal_id map and the
+# readings are queued for one writer thread per shard, which coalesces them into multi-row
+# INSERTs into Weight_Reading (rolled up into daily, weekly and monthly tiers by rollups.py).
+# When the queue is full the service answers 503 with Retry-After, so devices slow down
+# instead of the database falling behind. A 202 means the readings are
+# queued in memory; a reading re-sent after a lost response is ignored as a duplicate.
+MAX_BODY_BYTES = int(os.environ.get("FARM_INGEST_MAX_BODY", str(5 * 1024 * 1024)))
+MAX_READINGS = int(os.environ.get("FARM_INGEST_MAX_READINGS", "10000"))
+QUEUE_LIMIT = int(os.environ.get("FARM_INGEST_QUEUE", "100000"))
+BATCH_ROWS = int(os.environ.get("FARM_INGEST_BATCH", "2000"))
+# A tag missing from the cache reloads a farm's tags at most this often
+TAG_REFRESH_INTERVAL = float(os.environ.get("FARM_INGEST_TAG_REFRESH", "30"))
+# A farm's tags are reloaded once they are this old even without a miss, so tags of animals that
+# left the herd, or were reused, stop resolving to the old animal
+TAG_MAX_AGE = float(os.environ.get("FARM_INGEST_TAG_MAX_AGE", "300"))
+# Devices send "Authorization: Bearer <token>" when a token is configured
+TOKEN = os.environ.get("FARM_INGEST_TOKEN")
+MAX_WEIGHT_KG = 5000.0
+RETRY_AFTER_SECONDS = 1
+
+INSERT_SQL = ("INSERT IGNORE INTO Weight_Reading (farm_id, animal_id, read_at, weight_kg, device) "
+              "VALUES (%s, %s, %s, %s, %s)")
+
+logger = logging.getLogger("farm.ingest")
+
+# farm_id -> (loaded at, {tag_number: animal_id})
+_tags = {}
+_tags_lock = threading.Lock()
+
+# Readings accepted but not yet written, across all shards
+_pending = 0
+_pending_lock = threading.Condition()
+# shard -> queue of (farm_id, rows) batches, each drained by its own writer thread
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+class InvalidReading(ValueError):
+    pass
+
+
+def parse_time(value):
+    if value in (None, ""):
+        return datetime.now().replace(microsecond=0)
+    # JSON true and false arrive as ints; neither is a timestamp
+    if isinstance(value, bool):
+        raise InvalidReading(f"unreadable timestamp {value!r}")
+    if isinstance(value, (int, float)):
+        try:
+            return datetime.fromtimestamp(value)
+        except (OverflowError, OSError, ValueError):
+            raise InvalidReading(f"timestamp {value!r} is out of range")
+    try:
+        moment = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        raise InvalidReading(f"unreadable timestamp {value!r}")
+    # Stored in the server's local time, like the rest of the app's dates
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+
+# (tag_number, read_at, weight_kg, device) from one submitted reading
+def clean(reading, default_device):
+    if not isinstance(reading, dict):
+        raise InvalidReading("a reading must be an object")
+    tag = str(reading.get('tag_number') or "").strip()
+    if not tag:
+        raise InvalidReading("tag_number is missing")
+    try:
+        if isinstance(reading['weight_kg'], bool):
+            raise TypeError
+        weight = float(reading['weight_kg'])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidReading(f"{tag}: weight_kg is missing or not a number")
+    if not 0 < weight <= MAX_WEIGHT_KG:
+        raise InvalidReading(f"{tag}: weight_kg {weight} is out of range")
+    device = str(reading.get('device') or default_device or "")[:64]
+    return tag, parse_time(reading.get('read_at')), weight, device
+
+
+# Raw readings from a request body: a JSON list, {"device": ..., "readings": [...]}, or CSV with a header row
+def parse_body(body, content_type):
+    if content_type.startswith("text/csv"):
+        try:
+            return list(csv.DictReader(io.StringIO(body.decode("utf-8-sig")))), None
+        except UnicodeDecodeError as e:
+            raise InvalidReading(f"body is not UTF-8: {e}")
+        except csv.Error as e:
+            raise InvalidReading(f"body is not valid CSV: {e}")
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        raise InvalidReading(f"body is not valid JSON: {e}")
+    if isinstance(payload, dict):
+        return payload.get('readings', []), payload.get('device')
+    return payload, None
+
+
+def _load_tags(farm_id):
+    rows = database.run_queries({'tags': ("SELECT tag_number, animal_id FROM Animal "
+                                          "WHERE farm_id = %s AND status = 'active'",
+                                          (farm_id,))}, shard=farms.shard_of(farm_id))['tags']
+    return {row['tag_number']: row['animal_id'] for row in rows}
+
+
+# animal_id for each tag that is known. The farm's tags are reloaded when the copy is older than
+# TAG_MAX_AGE, or on an unknown tag once it is older than TAG_REFRESH_INTERVAL.
+def resolve_tags(farm_id, tags):
+    with _tags_lock:
+        loaded_at, tag_map = _tags.get(farm_id, (None, {}))
+    age = math.inf if loaded_at is None else time.monotonic() - loaded_at
+    missing = any(tag not in tag_map for tag in tags)
+    metrics.count_cache("ingest_tags", not missing and age < TAG_MAX_AGE)
+    if age >= TAG_MAX_AGE or (missing and age >= TAG_REFRESH_INTERVAL):
+        tag_map = _load_tags(farm_id)
+        with _tags_lock:
+            _tags[farm_id] = (time.monotonic(), tag_map)
+    return {tag: tag_map[tag] for tag in tags if tag in tag_map}
+
+
+# Drop a farm's cached tags after its animals were disposed of, archived or deleted
+def forget_tags(farm_id):
+    with _tags_lock:
+        _tags.pop(farm_id, None)
+
+
+# Reserve queue space for n readings; False when the queue is full
+def _reserve(n):
+    global _pending
+    with _pending_lock:
+        if _pending + n > QUEUE_LIMIT:
+            return False
+        _pending += n
+        return True
+
+
+def _release(n):
+    global _pending
+    with _pending_lock:
+        _pending -= n
+        _pending_lock.notify_all()
+
+
+def pending():
+    with _pending_lock:
+        return _pending
+
+
+# Block until every accepted reading has been written or the timeout passes; True if drained
+def wait_idle(timeout):
+    deadline = time.monotonic() + timeout
+    with _pending_lock:
+        while _pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            _pending_lock.wait(remaining)
+    return True
+
+
+def _shard_queue(shard):
+    with _queues_lock:
+        if shard not in _queues:
+            _queues[shard] = queue.Queue()
+            threading.Thread(target=_run_writer, args=(shard, _queues[shard]),
+                             name=f"ingest-{shard}", daemon=True).start()
+        return _queues[shard]
+
+
+# Take one queued batch and whatever else is waiting, up to BATCH_ROWS rows
+def _next_batch(batches):
+    rows = list(batches.get())
+    while len(rows) < BATCH_ROWS:
+        try:
+            rows.extend(batches.get_nowait())
+        except queue.Empty:
+            break
+    return rows
+
+
+# Write rows in one multi-row INSERT, or row by row if the database rejects the batch; returns rows rejected
+def _write(connection, rows):
+    cursor = connection.cursor()
+    try:
+        try:
+            cursor.executemany(INSERT_SQL, rows)
+            connection.commit()
+            return 0
+        except (InterfaceError, OperationalError):
+            raise
+        except Error:
+            connection.rollback()
+        rejected = 0
+        for row in rows:
+            try:
+                cursor.execute(INSERT_SQL, row)
+                connection.commit()
+            except (InterfaceError, OperationalError):
+                raise
+            except Error as e:
+                connection.rollback()
+                rejected += 1
+                logger.warning("Rejected reading %s: %s", row, e)
+        return rejected
+    finally:
+        cursor.close()
+
+
+def _run_writer(shard, batches):
+    connection = None
+    delay = 0.5
+    while True:
+        rows = _next_batch(batches)
+        while True:
+            try:
+                if connection is None:
+                    connection = database.open_connection(shard, connection_timeout=5)
+                rejected = _write(connection, rows)
+                break
+            except Error as e:
+                # Keep the batch and retry; meanwhile the full queue pushes back on the devices
+                logger.warning("Shard %s unavailable, retrying %d readings: %s", shard, len(rows), e)
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Error:
+                        pass
+                    connection = None
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+        delay = 0.5
+        metrics.INGEST_READINGS.inc(len(rows) - rejected, status="written")
+        if rejected:
+            metrics.INGEST_READINGS.inc(rejected, status="rejected")
+        _release(len(rows))
+
+
+# Validate, resolve and queue one request's readings; returns (HTTP status, response body)
+def ingest(farm_id, raw_readings, default_device=None):
+    if not isinstance(raw_readings, list):
+        return 400, {'error': "readings must be a list"}
+    if len(raw_readings) > MAX_READINGS:
+        return 413, {'error': f"at most {MAX_READINGS} readings per request"}
+
+    readings, errors = [], []
+    for reading in raw_readings:
+        try:
+            readings.append(clean(reading, default_device))
+        except InvalidReading as e:
+            errors.append(str(e))
+    animal_ids = resolve_tags(farm_id, {tag for tag, _, _, _ in readings})
+    rows = [(farm_id, animal_ids[tag], read_at, weight, device)
+            for tag, read_at, weight, device in readings if tag in animal_ids]
+    unknown_tags = sorted({tag for tag, _, _, _ in readings if tag not in animal_ids})
+
+    if rows:
+        if not _reserve(len(rows)):
+            metrics.INGEST_READINGS.inc(len(rows), status="busy")
+            return 503, {'error': "ingest queue is full, retry later"}
+        for start in range(0, len(rows), BATCH_ROWS):
+            _shard_queue(farms.shard_of(farm_id)).put(rows[start:start + BATCH_ROWS])
+    metrics.INGEST_READINGS.inc(len(rows), status="accepted")
+    metrics.INGEST_READINGS.inc(len(errors), status="invalid")
+    metrics.INGEST_READINGS.inc(len(raw_readings) - len(rows) - len(errors), status="unknown_tag")
+    return 202, {
+        'accepted': len(rows),
+        'invalid': len(errors),
+        'unknown_tags': unknown_tags,
+        'errors': errors[:20],
+    }
+
+
+class _IngestHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/health":
+            self.send_error(404)
+            return
+        self._send_json(200, {'pending': pending(), 'queue_limit': QUEUE_LIMIT})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/readings":
+            self.send_error(404)
+            return
+        if TOKEN and self.headers.get("Authorization") != f"Bearer {TOKEN}":
+            self._send_json(401, {'error': "missing or wrong token"})
+            return
+        query = parse_qs(url.query)
+        try:
+            farm_id = int(query.get("farm", [farms.DEFAULT_FARM])[0])
+        except ValueError:
+            farm_id = None
+        if farm_id not in farms.FARMS:
+            self._send_json(404, {'error': "unknown farm"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self._send_json(400, {'error': "Content-Length must be a non-negative integer"})
+            return
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {'error': f"body larger than {MAX_BODY_BYTES} bytes"})
+            return
+
+        body = self.rfile.read(length)
+        try:
+            raw_readings, device = parse_body(body, self.headers.get("Content-Type", "application/json"))
+            status, response = ingest(farm_id, raw_readings, device or query.get("device", [None])[0])
+        except InvalidReading as e:
+            status, response = 400, {'error': str(e)}
+        except Error as e:
+            status, response = 503, {'error': f"database unavailable: {e}"}
+        headers = [("Retry-After", str(RETRY_AFTER_SECONDS))] if status == 503 else []
+        self._send_json(status, response, headers)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Serve /readings and /health on a local port from a daemon thread, keeping the rollups current
+def start_http_server(port, host="127.0.0.1"):
+    rollups.start_maintainer()
+    server = ThreadingHTTPServer((host, port), _IngestHandler)
+    thread = threading.Thread(target=server.serve_forever, name="ingest-server", daemon=True)
+    thread.start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Accept scale and RFID readings over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8503)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    for shard in farms.SHARDS:
+        if not database.init_database(shard):
+            raise SystemExit(f"Could not prepare the schema of shard {shard}")
+    server = start_http_server(args.port, args.host)
+    print(f"Accepting readings on http://{args.host}:{server.server_port}/readings")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
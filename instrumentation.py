@@ -0,0 +1,316 @@
+import logging
+import math
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+import metrics
+
+# Thresholds and output locations for the slow-query log
+SLOW_QUERY_MS = float(os.environ.get("FARM_SLOW_QUERY_MS", "200"))
+SLOW_RERUN_MS = float(os.environ.get("FARM_SLOW_RERUN_MS", "2000"))
+SLOW_QUERY_LOG = os.environ.get("FARM_SLOW_QUERY_LOG", "slow_queries.log")
+
+# Number of reruns kept per page for the rolling percentile summary
+HISTORY_SIZE = int(os.environ.get("FARM_PERF_HISTORY", "200"))
+
+slow_log = logging.getLogger("farm.slow_queries")
+
+_local = threading.local()
+_history = defaultdict(lambda: deque(maxlen=HISTORY_SIZE))
+_history_lock = threading.Lock()
+_last_rerun = None
+
+
+def _slow_log():
+    if not slow_log.handlers and SLOW_QUERY_LOG:
+        handler = logging.FileHandler(SLOW_QUERY_LOG)
+        handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+        slow_log.addHandler(handler)
+        slow_log.setLevel(logging.INFO)
+        slow_log.propagate = False
+    return slow_log
+
+
+# Timings collected for a single script rerun
+class Rerun:
+    def __init__(self, page):
+        self.page = page
+        self.started = time.perf_counter()
+        self.queries = []
+        self.sections = []
+        self.total_ms = None
+        self._section = None
+
+    @property
+    def query_ms(self):
+        return sum(q['duration_ms'] for q in self.queries)
+
+    @property
+    def rows(self):
+        return sum(q['rows'] for q in self.queries)
+
+    @property
+    def bytes(self):
+        return sum(q['bytes'] for q in self.queries)
+
+    def close_section(self):
+        if self._section:
+            name, started = self._section
+            self.sections.append({
+                'section': name,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+            })
+            self._section = None
+
+
+def start_rerun(page):
+    _local.rerun = Rerun(page)
+    return _local.rerun
+
+
+def current_rerun():
+    return getattr(_local, 'rerun', None)
+
+
+# Most recently finished rerun in any session, full page or fragment
+def last_rerun():
+    with _history_lock:
+        return _last_rerun
+
+
+# Record work done on a worker thread against the caller's rerun
+@contextmanager
+def attached(rerun):
+    previous = current_rerun()
+    _local.rerun = rerun
+    try:
+        yield
+    finally:
+        _local.rerun = previous
+
+
+def finish_rerun():
+    rerun = current_rerun()
+    if rerun is None:
+        return None
+    rerun.close_section()
+    rerun.total_ms = (time.perf_counter() - rerun.started) * 1000
+    _local.rerun = None
+
+    global _last_rerun
+    with _history_lock:
+        _last_rerun = rerun
+        _history[rerun.page].append({
+            'total_ms': rerun.total_ms,
+            'query_ms': rerun.query_ms,
+            'queries': len(rerun.queries),
+            'rows': rerun.rows,
+            'bytes': rerun.bytes,
+        })
+
+    metrics.RERUNS.inc(page=rerun.page)
+    metrics.RENDER_SECONDS.observe(rerun.total_ms / 1000, page=rerun.page)
+
+    if rerun.total_ms >= SLOW_RERUN_MS:
+        _slow_log().info("slow rerun page=%r total_ms=%.1f queries=%d query_ms=%.1f",
+                         rerun.page, rerun.total_ms, len(rerun.queries), rerun.query_ms)
+    return rerun
+
+
+# Mark the start of a named render section; it runs until the next mark
+def section(name):
+    rerun = current_rerun()
+    if rerun is not None:
+        rerun.close_section()
+        rerun._section = (name, time.perf_counter())
+
+
+# Time an explicit block, e.g. a helper called many times per rerun
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        rerun = current_rerun()
+        if rerun is not None:
+            rerun.sections.append({
+                'section': name,
+                'duration_ms': (time.perf_counter() - started) * 1000,
+            })
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+# Rolling per-page summary over the last HISTORY_SIZE reruns
+def page_summary():
+    history = page_history()
+
+    summary = []
+    for page, runs in sorted(history.items()):
+        totals = [r['total_ms'] for r in runs]
+        summary.append({
+            'page': page,
+            'reruns': len(runs),
+            'p50_ms': percentile(totals, 50),
+            'p95_ms': percentile(totals, 95),
+            'max_ms': max(totals),
+            'avg_queries': sum(r['queries'] for r in runs) / len(runs),
+            'avg_query_ms': sum(r['query_ms'] for r in runs) / len(runs),
+        })
+    return summary
+
+
+# Raw per-rerun totals for each page, oldest first
+def page_history():
+    with _history_lock:
+        return {page: list(runs) for page, runs in _history.items()}
+
+
+def reset_history():
+    with _history_lock:
+        _history.clear()
+
+
+def _params_shape(params):
+    if params is None:
+        return ""
+    if isinstance(params, dict):
+        return "{" + ", ".join(f"{k}: {_value_shape(v)}" for k, v in params.items()) + "}"
+    return "(" + ", ".join(_value_shape(v) for v in params) + ")"
+
+
+def _value_shape(value):
+    if isinstance(value, (bytes, bytearray)):
+        return f"bytes[{len(value)}]"
+    return type(value).__name__
+
+
+def _value_bytes(value):
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+    return 8
+
+
+def _row_bytes(row):
+    if row is None:
+        return 0
+    values = row.values() if isinstance(row, dict) else row
+    return sum(_value_bytes(v) for v in values)
+
+
+def _observe(record):
+    page = record['page'] or "none"
+    metrics.QUERY_SECONDS.observe(record['duration_ms'] / 1000, page=page)
+    metrics.QUERY_ROWS.inc(record['rows'], page=page)
+    if record['duration_ms'] >= SLOW_QUERY_MS:
+        _slow_log().info("slow query page=%r duration_ms=%.1f rows=%d bytes=%d params=%s sql=%s",
+                         record['page'], record['duration_ms'], record['rows'],
+                         record['bytes'], record['params'], record['sql'])
+
+
+# Cursor proxy that records SQL text, params shape, duration, rows and bytes
+class InstrumentedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._record = None
+
+    def _begin(self, operation, params, started):
+        rerun = current_rerun()
+        self._record = {
+            'page': rerun.page if rerun else None,
+            'sql': " ".join(str(operation).split()),
+            'params': _params_shape(params),
+            'duration_ms': (time.perf_counter() - started) * 1000,
+            'rows': 0,
+            'bytes': 0,
+        }
+        if rerun is not None:
+            rerun.queries.append(self._record)
+
+    def _settle(self):
+        if self._record is not None:
+            if self._record['rows'] == 0 and self._cursor.rowcount and self._cursor.rowcount > 0:
+                self._record['rows'] = self._cursor.rowcount
+            _observe(self._record)
+            self._record = None
+
+    def _fetched(self, started, rows):
+        if self._record is not None:
+            self._record['duration_ms'] += (time.perf_counter() - started) * 1000
+            self._record['rows'] += len(rows)
+            self._record['bytes'] += sum(_row_bytes(r) for r in rows)
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        self._settle()
+        started = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            self._begin(operation, params, started)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        seq_params = list(seq_params)
+        self._settle()
+        started = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            self._begin(operation, seq_params[0] if seq_params else None, started)
+            if self._record is not None:
+                self._record['params'] = f"{len(seq_params)} x {self._record['params']}"
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(started, [row] if row is not None else [])
+        return row
+
+    def fetchmany(self, size=1):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(size)
+        self._fetched(started, rows)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(started, rows)
+        return rows
+
+    def close(self):
+        self._settle()
+        return self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+# Connection proxy handing out instrumented cursors and timing commits
+class InstrumentedConnection:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs))
+
+    def commit(self):
+        with timed("commit"):
+            return self._connection.commit()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
@@ -0,0 +1,213 @@
+import argparse
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+from mysql.connector import Error
+from streamlit.testing.v1 import AppTest
+
+import benchmark
+import database
+import instrumentation
+import metrics
+import synthetic
+
+# Relative frequency of page visits in a typical co-op working day
+NAVIGATION = [
+    ("Dashboard", 15),
+    ("Animal Records", 10),
+    ("Weight Tracking", 15),
+    ("Feed Records", 15),
+    ("Medical Records", 10),
+    ("Animal Timeline", 5),
+    ("Cohort Analytics", 5),
+    ("Forecasts", 5),
+    ("Financial Overview", 10),
+    ("Animal Categories", 5),
+    ("Staff Management", 5),
+]
+
+# Data-entry forms: the button that opens them, the fields to fill and the submit button
+FORMS = {
+    "Weight Tracking": ("➕ Add Weight Record", [
+        ("number_input", "Weight (kg)", lambda rng: round(rng.uniform(150, 600), 1)),
+    ], "Add Weight Record"),
+    "Feed Records": ("➕ Add Feed Record", [
+        ("text_input", "Feed Type*", lambda rng: rng.choice(synthetic.FEED_TYPES)),
+        ("number_input", "Quantity (kg)*", lambda rng: round(rng.uniform(4, 14), 1)),
+        ("number_input", "Cost ($)*", lambda rng: round(rng.uniform(1, 8), 2)),
+    ], "Add Feed Record"),
+    "Medical Records": ("➕ Add Medical Record", [
+        ("text_input", "Medicine Name*", lambda rng: rng.choice(synthetic.MEDICINES)),
+        ("text_input", "Quantity (e.g., 10ml)*", lambda rng: f"{rng.randrange(2, 30)}ml"),
+        ("number_input", "Cost ($)*", lambda rng: round(rng.uniform(5, 80), 2)),
+    ], "Add Medical Record"),
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent Streamlit sessions against a scratch database.")
+    parser.add_argument("--database", default="farm_load",
+                        help="scratch database to load (never the production one)")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds to run")
+    parser.add_argument("--think", type=float, default=0.5, help="mean pause between user actions, seconds")
+    parser.add_argument("--submit-rate", type=float, default=0.3,
+                        help="chance that a visit to a record page submits a form")
+    parser.add_argument("--herd-size", type=int, default=200)
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--skip-load", action="store_true", help="reuse the data already in --database")
+    return parser.parse_args(argv)
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def server_status(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN ('Connections', 'Threads_connected')")
+        return {name: int(value) for name, value in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+# Samples the server's connection counters while the sessions run
+class ConnectionMonitor(threading.Thread):
+    def __init__(self, interval=0.5):
+        super().__init__(name="connection-monitor", daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        try:
+            self.connection = database.open_connection()
+        except Error as e:
+            raise SystemExit(f"Could not connect to the load test database: {e}")
+        self.start_status = server_status(self.connection)
+        self.peak_threads = self.start_status['Threads_connected']
+        self.end_status = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            status = server_status(self.connection)
+            self.peak_threads = max(self.peak_threads, status['Threads_connected'])
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.end_status = server_status(self.connection)
+        self.connection.close()
+
+
+class Session(threading.Thread):
+    def __init__(self, session_id, args, farm, deadline):
+        super().__init__(name=f"session-{session_id}", daemon=True)
+        self.rng = random.Random(args.seed * 1000 + session_id)
+        self.args = args
+        self.farm = farm
+        self.deadline = deadline
+        self.latencies = []
+        self.submits = 0
+        self.errors = []
+
+    def _run(self, at):
+        started = time.perf_counter()
+        at.run()
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        if at.exception:
+            self.errors.append(at.exception[0].message)
+
+    def _click(self, at, label):
+        for button in at.button:
+            if button.label == label:
+                button.click()
+                self._run(at)
+                return True
+        return False
+
+    def _submit_form(self, at, page):
+        open_label, fields, submit_label = FORMS[page]
+        if not self._click(at, open_label):
+            return
+        for kind, label, value in fields:
+            for widget in getattr(at, kind):
+                if widget.label == label:
+                    widget.set_value(value(self.rng))
+        if self._click(at, submit_label):
+            self.submits += 1
+
+    def run(self):
+        pages, weights = zip(*NAVIGATION)
+        at = AppTest.from_file(benchmark.APP_PATH, default_timeout=300)
+        self._run(at)
+        while time.time() < self.deadline:
+            page = self.rng.choices(pages, weights)[0]
+            benchmark.select_page(at, page, self.farm.start, self.farm.end)
+            self._run(at)
+            if page in FORMS and self.rng.random() < self.args.submit_rate:
+                self._submit_form(at, page)
+            time.sleep(self.rng.expovariate(1 / self.args.think) if self.args.think else 0)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    benchmark.use_database(args.database)
+
+    farm = synthetic.SyntheticFarm(herd_size=args.herd_size, years=args.years, seed=args.seed)
+    if not args.skip_load:
+        benchmark.load_farm(farm)
+
+    instrumentation.reset_history()
+    monitor = ConnectionMonitor()
+    app_connections = metrics.CONNECTIONS.value()
+    baseline_rss = rss_bytes()
+
+    started = time.time()
+    sessions = [Session(i, args, farm, started + args.duration) for i in range(args.sessions)]
+    monitor.start()
+    for session in sessions:
+        session.start()
+    peak_rss = baseline_rss
+    while any(session.is_alive() for session in sessions):
+        peak_rss = max(peak_rss, rss_bytes())
+        time.sleep(0.5)
+    elapsed = time.time() - started
+    monitor.stop()
+
+    latencies = [ms for session in sessions for ms in session.latencies]
+    errors = [error for session in sessions for error in session.errors]
+    opened = monitor.end_status['Connections'] - monitor.start_status['Connections']
+
+    print(f"sessions               {args.sessions}")
+    print(f"elapsed                {elapsed:.1f}s")
+    print(f"reruns                 {len(latencies)}")
+    print(f"form submits           {sum(s.submits for s in sessions)}")
+    print(f"throughput             {len(latencies) / elapsed:.2f} reruns/s")
+    print(f"rerun latency p50      {instrumentation.percentile(latencies, 50):.1f} ms")
+    print(f"rerun latency p95      {instrumentation.percentile(latencies, 95):.1f} ms")
+    print(f"rerun latency max      {max(latencies, default=0):.1f} ms")
+    print(f"connections opened     {opened} (app: {metrics.CONNECTIONS.value() - app_connections})")
+    print(f"connections per rerun  {opened / max(1, len(latencies)):.2f}")
+    print(f"peak threads connected {monitor.peak_threads}")
+    print(f"memory per session     {(peak_rss - baseline_rss) / max(1, args.sessions) / 2**20:.1f} MiB")
+    print(f"errors                 {len(errors)}")
+    for error in sorted(set(errors))[:10]:
+        print(f"  {error}")
+
+    print()
+    for row in instrumentation.page_summary():
+        print(f"{row['page']:<20} reruns={row['reruns']:<5} p50={row['p50_ms']:.1f}ms "
+              f"p95={row['p95_ms']:.1f}ms queries={row['avg_queries']:.1f}")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
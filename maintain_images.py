@@ -0,0 +1,212 @@
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from PIL import Image
+
+import database
+import farms
+import images
+
+# Moves inline image blobs into the deduplicated Image_Store, re-encoding oversized ones.
+# Rows are read in short keyset batches and committed batch by batch, so the tables stay
+# writable while it runs; progress is checkpointed after every batch and resumed on restart.
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Deduplicate and re-encode stored image blobs.")
+    parser.add_argument("--shard", default=farms.DEFAULT_SHARD, choices=list(farms.SHARDS),
+                        help="shard from the farm registry to migrate")
+    parser.add_argument("--tables", nargs="*", default=list(images.IMAGE_TABLES),
+                        choices=list(images.IMAGE_TABLES))
+    parser.add_argument("--batch-size", type=int, default=200, help="rows read per batch")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="re-encoding processes")
+    parser.add_argument("--max-side", type=int, default=images.MAX_SIDE,
+                        help="re-encode images whose longest side is larger than this")
+    parser.add_argument("--max-kb", type=int, default=300, help="re-encode images larger than this")
+    parser.add_argument("--quality", type=int, default=images.WEBP_QUALITY, help="WebP quality for re-encodes")
+    parser.add_argument("--checkpoint", help="progress file (default: maintain_images.<shard>.checkpoint.json)")
+    parser.add_argument("--restart", action="store_true", help="ignore an existing checkpoint")
+    parser.add_argument("--prune", action="store_true",
+                        help="afterwards delete store entries no row refers to")
+    args = parser.parse_args(argv)
+    # Keys and stored hashes only hold within one shard, so each shard resumes from its own file
+    if args.checkpoint is None:
+        args.checkpoint = f"maintain_images.{args.shard}.checkpoint.json"
+    return args
+
+
+def new_checkpoint(shard):
+    return {
+        'shard': shard,
+        # table -> last key migrated
+        'tables': {},
+        'stats': {'rows': 0, 'skipped': 0, 'stored': 0, 'duplicates': 0, 'reencoded': 0, 'unreadable': 0,
+                  'bytes_before': 0, 'bytes_after': 0},
+    }
+
+
+def load_checkpoint(path, shard, restart):
+    if restart or not os.path.exists(path):
+        return new_checkpoint(shard)
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('shard', farms.DEFAULT_SHARD) != shard:
+        raise SystemExit(f"{path} holds the progress of shard {checkpoint['shard']}, not {shard}")
+    # Older checkpoints also kept every hash seen; the store itself answers that now
+    checkpoint.pop('seen', None)
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temp_path, path)
+
+
+# Runs in a worker process: the bytes to store and whether they were re-encoded
+def prepare(data, max_side, max_bytes, quality):
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            oversized = len(data) > max_bytes or max(image.size) > max_side
+    except OSError:
+        return data, False, True
+    if not oversized:
+        return data, False, False
+    try:
+        smaller = images.process_image(data, max_side=max_side, quality=quality)
+    except images.InvalidImage:
+        return data, False, True
+    if len(smaller) >= len(data):
+        return data, False, False
+    return smaller, True, False
+
+
+def migrate_table(connection, executor, table, args, checkpoint):
+    key_column = images.IMAGE_TABLES[table]
+    last_key = checkpoint['tables'].get(table, 0)
+    stats = checkpoint['stats']
+    work = partial(prepare, max_side=args.max_side, max_bytes=args.max_kb * 1024, quality=args.quality)
+
+    cursor = connection.cursor()
+    try:
+        while True:
+            cursor.execute(f"""
+                SELECT {key_column}, image FROM {table}
+                WHERE {key_column} > %s AND image IS NOT NULL
+                ORDER BY {key_column}
+                LIMIT %s
+            """, (last_key, args.batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            # Each distinct original in the batch is processed once, however many rows share it.
+            # Originals kept as they were are stored under their own hash, so those already in the
+            # store need no work; INSERT IGNORE dedupes the rest, whose re-encodes come out the same.
+            originals = [images.content_hash(data) for _, data in rows]
+            distinct = list(dict.fromkeys(originals))
+            cursor.execute(f"""
+                SELECT image_hash FROM Image_Store WHERE image_hash IN ({', '.join(['%s'] * len(distinct))})
+            """, tuple(distinct))
+            seen = {row[0]: row[0] for row in cursor.fetchall()}
+            pending = {}
+            for original, (_, data) in zip(originals, rows):
+                if original not in seen and original not in pending:
+                    pending[original] = data
+            added = 0
+            for original, (stored, reencoded, unreadable) in zip(pending, executor.map(work, pending.values())):
+                seen[original] = images.store_image(cursor, stored)
+                if cursor.rowcount > 0:
+                    added += 1
+                    stats['stored'] += 1
+                    stats['bytes_after'] += len(stored)
+                    stats['reencoded'] += reencoded
+                    stats['unreadable'] += unreadable
+
+            # A row whose image was replaced or moved to the store since it was read keeps the newer one
+            cursor.executemany(f"""
+                UPDATE {table} SET image = NULL, image_hash = %s
+                WHERE {key_column} = %s AND image IS NOT NULL AND image_hash IS NULL AND SHA2(image, 256) = %s
+            """, [(seen[original], key, original) for original, (key, _) in zip(originals, rows)])
+            migrated = cursor.rowcount
+            connection.commit()
+            stats['rows'] += migrated
+            stats['skipped'] = stats.get('skipped', 0) + len(rows) - migrated
+            stats['duplicates'] += len(rows) - added
+            stats['bytes_before'] += sum(len(data) for _, data in rows)
+
+            last_key = rows[-1][0]
+            checkpoint['tables'][table] = last_key
+            save_checkpoint(args.checkpoint, checkpoint)
+            print(f"  {table:<16} up to {key_column} {last_key}: {stats['rows']:,} rows, "
+                  f"{stats['stored']:,} images stored")
+    finally:
+        cursor.close()
+
+
+# Delete store entries that no row refers to, archived animals included; returns (entries, bytes)
+# removed
+def prune(connection):
+    referenced = " UNION ".join(f"SELECT image_hash FROM {table} WHERE image_hash IS NOT NULL"
+                                for table in (*images.IMAGE_TABLES, "Animal_Archive"))
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM Image_Store "
+                       f"WHERE image_hash NOT IN ({referenced})")
+        count, size = cursor.fetchone()
+        cursor.execute(f"DELETE FROM Image_Store WHERE image_hash NOT IN ({referenced})")
+        connection.commit()
+        return count, int(size)
+    finally:
+        cursor.close()
+
+
+def print_report(stats, elapsed):
+    reclaimed = stats['bytes_before'] - stats['bytes_after']
+    print(f"rows migrated          {stats['rows']:,}")
+    print(f"changed while running  {stats.get('skipped', 0):,}")
+    print(f"distinct images stored {stats['stored']:,}")
+    print(f"duplicate rows         {stats['duplicates']:,}")
+    print(f"re-encoded             {stats['reencoded']:,}")
+    print(f"unreadable, kept as-is {stats['unreadable']:,}")
+    print(f"bytes before           {stats['bytes_before']:,}")
+    print(f"bytes after            {stats['bytes_after']:,}")
+    print(f"bytes reclaimed        {reclaimed:,} ({reclaimed / max(1, stats['bytes_before']):.0%})")
+    print(f"elapsed                {elapsed:.1f}s")
+    print("InnoDB keeps freed pages; run OPTIMIZE TABLE on the migrated tables to return them to the OS.")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not database.init_database(args.shard):
+        raise SystemExit("Could not prepare the database schema")
+    connection = database.create_connection(args.shard)
+    if connection is None:
+        raise SystemExit("Could not connect to the database")
+
+    checkpoint = load_checkpoint(args.checkpoint, args.shard, args.restart)
+    started = time.perf_counter()
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers,
+                                 mp_context=multiprocessing.get_context("spawn")) as executor:
+            for table in args.tables:
+                migrate_table(connection, executor, table, args, checkpoint)
+        print_report(checkpoint['stats'], time.perf_counter() - started)
+        if args.prune:
+            count, size = prune(connection)
+            print(f"pruned                 {count:,} unreferenced images ({size:,} bytes)")
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import argparse
+import sys
+from collections import namedtuple
+
+from streamlit.testing.v1 import AppTest
+
+import benchmark
+import instrumentation
+import synthetic
+
+# Budgets are calibrated against this fixed synthetic farm; changing it means re-declaring them.
+# The schema is created once per process, so steady-state reruns pay only for the page itself.
+# tests/test_query_budgets.py enforces the same budgets in the test suite.
+HERD_SIZE = 50
+YEARS = 1
+SEED = 42
+
+# actions: ("button", label) clicks a button, ("submit", label) clicks a form submit button,
+# ("select", label) picks the first option of a multiselect.
+# AppTest reruns the whole script on every interaction, so action budgets include the page itself.
+Budget = namedtuple("Budget", ["name", "page", "actions", "max_queries", "max_bytes"])
+
+BUDGETS = [
+    Budget("Dashboard", "Dashboard", [], 8, 320_000),
+    Budget("Animal Categories", "Animal Categories", [], 1, 400_000),
+    Budget("Animal Categories: delete check", "Animal Categories",
+           [("button", "🗑️ Delete Category"), ("submit", "Delete Category")], 2, 400_000),
+    Budget("Animal Records", "Animal Records", [], 2, 3_800_000),
+    Budget("Animal Records: delete check", "Animal Records",
+           [("button", "🗑️ Delete Animals"), ("select", "Select Animals to Delete"), ("submit", "Delete Animals")],
+           4, 3_800_000),
+    Budget("Weight Tracking", "Weight Tracking", [], 2, 40_000),
+    Budget("Feed Records", "Feed Records", [], 3, 10_000),
+    Budget("Medical Records", "Medical Records", [], 3, 10_000),
+    Budget("Animal Timeline", "Animal Timeline", [], 2, 10_000),
+    Budget("Animal Timeline: older page", "Animal Timeline", [("button", "Older ➡️")], 2, 10_000),
+    # Served from the report cache; the refresh recomputes it
+    Budget("Cohort Analytics", "Cohort Analytics", [], 0, 0),
+    Budget("Cohort Analytics: refresh", "Cohort Analytics", [("button", "🔄 Refresh")], 2, 20_000),
+    Budget("Forecasts", "Forecasts", [], 4, 20_000),
+    Budget("Staff Management", "Staff Management", [], 1, 240_000),
+    Budget("Financial Overview", "Financial Overview", [], 3, 20_000),
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fail when a page exceeds its SQL statement or byte budget.")
+    parser.add_argument("--database", default="farm_budget",
+                        help="scratch database to load (never the production one)")
+    parser.add_argument("--skip-load", action="store_true", help="reuse the data already in --database")
+    parser.add_argument("--only", nargs="*", help="check only the budgets with these names")
+    return parser.parse_args(argv)
+
+
+def _click(at, kind, label):
+    if kind == "select":
+        for widget in at.multiselect:
+            if widget.label == label:
+                # A form sends its widgets with the submit, so there is no rerun in between
+                widget.select(widget.options[0])
+                return
+        raise AssertionError(f"no multiselect labelled {label!r}")
+    buttons = at.button if kind == "button" else [b for b in at.button if b.proto.is_form_submitter]
+    for button in buttons:
+        if button.label == label:
+            button.click()
+            at.run()
+            return
+    raise AssertionError(f"no {kind} labelled {label!r}")
+
+
+# Render the scenario on a fresh session and return the totals of its final rerun
+def measure(budget, farm):
+    at = AppTest.from_file(benchmark.APP_PATH, default_timeout=300)
+    at.run()
+    # The second pass sets the page's own date filters, which only exist once it has rendered
+    for _ in range(2):
+        benchmark.select_page(at, budget.page, farm.start, farm.end)
+        at.run()
+    for kind, label in budget.actions:
+        _click(at, kind, label)
+    if at.exception:
+        raise AssertionError(f"{budget.name}: {at.exception[0].message}")
+
+    rerun = instrumentation.last_rerun()
+    if rerun is None:
+        raise AssertionError(f"{budget.name}: no reruns were recorded")
+    return {'queries': len(rerun.queries), 'bytes': rerun.bytes}
+
+
+def check(budgets, farm):
+    failures = []
+    for budget in budgets:
+        run = measure(budget, farm)
+        status = "ok"
+        if run['queries'] > budget.max_queries:
+            status = "OVER"
+            failures.append(f"{budget.name}: {run['queries']} statements > budget {budget.max_queries}")
+        if run['bytes'] > budget.max_bytes:
+            status = "OVER"
+            failures.append(f"{budget.name}: {run['bytes']:,} bytes > budget {budget.max_bytes:,}")
+        print(f"{status:<5} {budget.name:<34} {run['queries']:>3}/{budget.max_queries:<3} statements "
+              f"{run['bytes']:>11,}/{budget.max_bytes:,} bytes")
+    return failures
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    benchmark.use_database(args.database)
+
+    farm = synthetic.SyntheticFarm(herd_size=HERD_SIZE, years=YEARS, seed=SEED)
+    if not args.skip_load:
+        benchmark.load_farm(farm)
+
+    budgets = [b for b in BUDGETS if not args.only or b.name in args.only]
+    failures = check(budgets, farm)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,431 @@
+import argparse
+import logging
+import os
+import statistics
+import sys
+from datetime import date, timedelta
+
+from mysql.connector import Error
+
+import database
+import farms
+import frames
+
+# Raw scale readings are downsampled into Weight_Rollup: per animal, a daily median of the day's
+# readings with outliers rejected, and weekly and monthly tiers built from those daily medians.
+# The refresh is incremental: it follows a reading_id watermark and recomputes only the days,
+# weeks and months that new readings touched. Ids the watermark passed over are kept in
+# Rollup_Gap for a while, because a writer's transaction can commit after a higher id was
+# rolled up; a gap that turns into a reading is folded in then. Each monthly value is also
+# written to Monthly_Weight, so the existing pages pick up scale data without change.
+#
+# Expense_Summary and Utility_Bill are rolled up per farm into Finance_Rollup at month, quarter
+# and year grain, so a multi-year financial chart reads a few dozen rows. A year is the unit of
+# refresh: it holds one summary and a handful of bills a month, so all of its periods are
+# recomputed together, by the page that changed them or by the maintainer for other writers.
+TIERS = ("day", "week", "month")
+FINANCE_TIERS = ("month", "quarter", "year")
+# Expense_Summary columns rolled up, each stored as a category of the "expense" source
+EXPENSE_COLUMNS = ("total_feed_cost", "total_medicine_cost", "total_salaries", "total_utilities",
+                   "other_expenses", "total_expense")
+# A reading further than this fraction from its day's median is a bad pass (two animals on the
+# scale, one foot off it) and is left out of the rollups
+REJECT_FRACTION = float(os.environ.get("FARM_ROLLUP_REJECT", "0.08"))
+BATCH_READINGS = int(os.environ.get("FARM_ROLLUP_BATCH", "50000"))
+# Seconds a skipped reading id is waited for; ids of rolled-back or ignored inserts never fill
+GAP_WAIT = int(os.environ.get("FARM_ROLLUP_GAP_WAIT", "600"))
+INTERVAL = float(os.environ.get("FARM_ROLLUP_INTERVAL", "60"))
+WATERMARK = "weight_readings"
+
+logger = logging.getLogger("farm.rollups")
+
+
+def period_start(tier, day):
+    if tier == "week":
+        return day - timedelta(days=day.weekday())
+    if tier == "month":
+        return day.replace(day=1)
+    if tier == "quarter":
+        return date(day.year, day.month - (day.month - 1) % 3, 1)
+    if tier == "year":
+        return date(day.year, 1, 1)
+    return day
+
+
+def period_label(tier, day):
+    if tier == "quarter":
+        return f"{day.year}-Q{(day.month - 1) // 3 + 1}"
+    if tier == "year":
+        return str(day.year)
+    if tier == "month":
+        return day.strftime("%Y-%m")
+    return day.strftime("%Y-%m-%d")
+
+
+# Tier whose resolution suits a chart of start..end: a few hundred points at most
+def tier_for(start, end):
+    days = (end - start).days
+    if days <= 92:
+        return "day"
+    if days <= 730:
+        return "week"
+    return "month"
+
+
+# Finance tier for a chart of start..end: monthly detail up to two years, then quarters, then years
+def finance_tier_for(start, end):
+    days = (end - start).days
+    if days <= 731:
+        return "month"
+    if days <= 6 * 366:
+        return "quarter"
+    return "year"
+
+
+# (kept weights, number rejected) for one animal's readings on one day
+def reject_outliers(weights):
+    median = statistics.median(weights)
+    kept = [w for w in weights if abs(w - median) <= REJECT_FRACTION * median]
+    return kept, len(weights) - len(kept)
+
+
+def _in_list(values):
+    return ", ".join(["%s"] * len(values))
+
+
+def _replace_rows(cursor, tier, rows):
+    if not rows:
+        return
+    cursor.executemany("DELETE FROM Weight_Rollup WHERE animal_id = %s AND tier = %s AND period_start = %s",
+                       [(animal_id, tier, start) for _, animal_id, start, *_ in rows])
+    cursor.executemany(f"""
+        INSERT INTO Weight_Rollup (farm_id, animal_id, tier, period_start, readings, rejected,
+                                   median_kg, min_kg, max_kg)
+        VALUES (%s, %s, '{tier}', %s, %s, %s, %s, %s, %s)
+    """, [row for row in rows if row[3] > 0])
+
+
+# Recompute the day tier for the given (animal_id, day) pairs from their raw readings
+def _rollup_days(cursor, days):
+    animal_ids = sorted({animal_id for animal_id, _ in days})
+    first = min(day for _, day in days)
+    last = max(day for _, day in days) + timedelta(days=1)
+    cursor.execute(f"""
+        SELECT farm_id, animal_id, read_at, weight_kg FROM Weight_Reading
+        WHERE animal_id IN ({_in_list(animal_ids)}) AND read_at >= %s AND read_at < %s
+    """, (*animal_ids, first, last))
+    readings = {}
+    for farm_id, animal_id, read_at, weight in cursor.fetchall():
+        key = (animal_id, read_at.date())
+        if key in days:
+            readings.setdefault(key, (farm_id, []))[1].append(weight)
+
+    rows = []
+    for (animal_id, day), (farm_id, weights) in readings.items():
+        kept, rejected = reject_outliers(weights)
+        median = statistics.median(kept) if kept else None
+        rows.append((farm_id, animal_id, day, len(kept), rejected, median,
+                     min(kept, default=None), max(kept, default=None)))
+    # A day left without usable readings loses its row
+    for animal_id, day in days - readings.keys():
+        rows.append((None, animal_id, day, 0, 0, None, None, None))
+    _replace_rows(cursor, "day", rows)
+
+
+# Recompute a coarser tier for the given (animal_id, period start) pairs from the daily medians
+def _rollup_periods(cursor, tier, periods):
+    animal_ids = sorted({animal_id for animal_id, _ in periods})
+    first = min(start for _, start in periods)
+    last = max(start for _, start in periods) + timedelta(days=31)
+    cursor.execute(f"""
+        SELECT farm_id, animal_id, period_start, readings, rejected, median_kg, min_kg, max_kg
+        FROM Weight_Rollup
+        WHERE tier = 'day' AND readings > 0 AND animal_id IN ({_in_list(animal_ids)})
+          AND period_start >= %s AND period_start < %s
+    """, (*animal_ids, first, last))
+    groups = {}
+    for farm_id, animal_id, day, readings, rejected, median, low, high in cursor.fetchall():
+        key = (animal_id, period_start(tier, day))
+        if key in periods:
+            groups.setdefault(key, (farm_id, []))[1].append((readings, rejected, median, low, high))
+
+    rows = []
+    for (animal_id, start), (farm_id, day_rows) in groups.items():
+        rows.append((farm_id, animal_id, start, sum(r[0] for r in day_rows), sum(r[1] for r in day_rows),
+                     statistics.median(r[2] for r in day_rows),
+                     min(r[3] for r in day_rows), max(r[4] for r in day_rows)))
+    for animal_id, start in periods - groups.keys():
+        rows.append((None, animal_id, start, 0, 0, None, None, None))
+    _replace_rows(cursor, tier, rows)
+    return rows
+
+
+# Carry monthly medians into Monthly_Weight, updating the month's row or adding one
+def _publish_months(cursor, rows):
+    rows = [row for row in rows if row[3] > 0]
+    if not rows:
+        return
+    animal_ids = sorted({row[1] for row in rows})
+    first = min(row[2] for row in rows)
+    last = max(row[2] for row in rows) + timedelta(days=31)
+    # Entries made by hand may be dated any day of their month
+    cursor.execute(f"""
+        SELECT animal_id, month, weight_id FROM Monthly_Weight
+        WHERE animal_id IN ({_in_list(animal_ids)}) AND month >= %s AND month < %s
+        ORDER BY weight_id
+    """, (*animal_ids, first, period_start("month", last)))
+    existing = {}
+    for animal_id, month, weight_id in cursor.fetchall():
+        existing.setdefault((animal_id, period_start("month", month)), weight_id)
+    updates = [(round(row[5], 1), existing[row[1], row[2]]) for row in rows if (row[1], row[2]) in existing]
+    inserts = [(row[0], row[1], row[2], round(row[5], 1)) for row in rows if (row[1], row[2]) not in existing]
+    if updates:
+        cursor.executemany("UPDATE Monthly_Weight SET weight_kg = %s WHERE weight_id = %s", updates)
+    if inserts:
+        cursor.executemany("INSERT INTO Monthly_Weight (farm_id, animal_id, month, weight_kg) VALUES (%s, %s, %s, %s)",
+                           inserts)
+
+
+# Fold readings past the watermark, and readings that filled an earlier gap, into the rollups in
+# one transaction; returns readings processed. The watermark row is locked, so concurrent
+# refreshes of a shard take turns.
+def refresh(connection, batch_size=BATCH_READINGS):
+    cursor = connection.cursor()
+    try:
+        cursor.execute("INSERT IGNORE INTO Rollup_State (name, last_reading_id) VALUES (%s, 0)", (WATERMARK,))
+        cursor.execute("SELECT last_reading_id FROM Rollup_State WHERE name = %s FOR UPDATE", (WATERMARK,))
+        watermark = cursor.fetchone()[0]
+        cursor.execute("""
+            SELECT reading_id, animal_id, read_at FROM Weight_Reading
+            WHERE reading_id > %s ORDER BY reading_id LIMIT %s
+        """, (watermark, batch_size + 1))
+        new_readings = cursor.fetchall()
+        # Only the batch that reaches the newest readings can have passed an insert still in flight
+        at_head = len(new_readings) <= batch_size
+        new_readings = new_readings[:batch_size]
+        cursor.execute("""
+            SELECT r.reading_id, r.animal_id, r.read_at FROM Rollup_Gap g
+            JOIN Weight_Reading r ON r.reading_id = g.reading_id
+        """)
+        late_readings = cursor.fetchall()
+        cursor.execute("DELETE FROM Rollup_Gap WHERE noted_at < NOW() - INTERVAL %s SECOND", (GAP_WAIT,))
+        if not new_readings and not late_readings:
+            connection.commit()
+            return 0
+
+        if late_readings:
+            cursor.executemany("DELETE FROM Rollup_Gap WHERE reading_id = %s",
+                               [(reading_id,) for reading_id, _, _ in late_readings])
+        if new_readings and at_head:
+            seen = {reading_id for reading_id, _, _ in new_readings}
+            gaps = [(reading_id,) for reading_id in range(watermark + 1, new_readings[-1][0]) if reading_id not in seen]
+            if gaps:
+                cursor.executemany("INSERT IGNORE INTO Rollup_Gap (reading_id) VALUES (%s)", gaps)
+        days = {(animal_id, read_at.date()) for _, animal_id, read_at in new_readings + late_readings}
+        _rollup_days(cursor, days)
+        _rollup_periods(cursor, "week", {(a, period_start("week", d)) for a, d in days})
+        months = _rollup_periods(cursor, "month", {(a, period_start("month", d)) for a, d in days})
+        _publish_months(cursor, months)
+        if new_readings:
+            cursor.execute("UPDATE Rollup_State SET last_reading_id = %s WHERE name = %s",
+                           (new_readings[-1][0], WATERMARK))
+        connection.commit()
+        return len(new_readings) + len(late_readings)
+    except Error:
+        connection.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+# Refresh a shard until it has caught up; returns readings processed
+def refresh_shard(shard):
+    connection = database.open_connection(shard)
+    try:
+        total = 0
+        while True:
+            processed = refresh(connection)
+            total += processed
+            if processed == 0:
+                return total
+    finally:
+        connection.close()
+
+
+# Start over from the raw readings, e.g. after changing REJECT_FRACTION
+def rebuild(shard):
+    connection = database.open_connection(shard)
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("DELETE FROM Weight_Rollup")
+            cursor.execute("DELETE FROM Rollup_State WHERE name = %s", (WATERMARK,))
+            cursor.execute("DELETE FROM Rollup_Gap")
+            connection.commit()
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+    return refresh_shard(shard)
+
+
+# Count one month's amount into every finance tier's period that contains it
+def _add_finance(totals, month, source, category, amount):
+    for tier in FINANCE_TIERS:
+        entry = totals.setdefault((tier, period_start(tier, month), source, category), [0.0, 0])
+        entry[0] += amount or 0
+        entry[1] += 1
+
+
+# Recompute every finance period of the given years for one farm, in the caller's transaction
+def refresh_finance(connection, farm_id, years):
+    cursor = connection.cursor()
+    try:
+        for year in sorted(set(years)):
+            first, last = date(year, 1, 1), date(year + 1, 1, 1)
+            totals = {}
+            cursor.execute(f"""
+                SELECT month, {", ".join(EXPENSE_COLUMNS)} FROM Expense_Summary
+                WHERE farm_id = %s AND month >= %s AND month < %s
+            """, (farm_id, first, last))
+            for month, *amounts in cursor.fetchall():
+                for column, amount in zip(EXPENSE_COLUMNS, amounts):
+                    _add_finance(totals, month, "expense", column, amount)
+            cursor.execute("""
+                SELECT month, type, amount FROM Utility_Bill
+                WHERE farm_id = %s AND month >= %s AND month < %s
+            """, (farm_id, first, last))
+            for month, bill_type, amount in cursor.fetchall():
+                _add_finance(totals, month, "utility", bill_type or "Other", amount)
+
+            cursor.execute("DELETE FROM Finance_Rollup WHERE farm_id = %s AND period_start >= %s AND period_start < %s",
+                           (farm_id, first, last))
+            if totals:
+                cursor.executemany("""
+                    INSERT INTO Finance_Rollup (farm_id, tier, period_start, source, category, amount, entries)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """, [(farm_id, *key, amount, entries) for key, (amount, entries) in totals.items()])
+    finally:
+        cursor.close()
+
+
+# (farm_id, year) pairs whose finance rows changed since they were rolled up, or that lost them all.
+# Deleting rows leaves no newer updated_at behind, so a year whose row count differs from the
+# entries its year-tier rollup counted is stale too.
+def _stale_finance_years(cursor):
+    changed, counts = {}, {}
+    for i, table in enumerate(("Expense_Summary", "Utility_Bill")):
+        cursor.execute(f"""
+            SELECT farm_id, YEAR(month), MAX(updated_at), COUNT(*) FROM {table}
+            WHERE month IS NOT NULL GROUP BY farm_id, YEAR(month)
+        """)
+        for farm_id, year, updated_at, rows in cursor.fetchall():
+            changed[farm_id, year] = max(updated_at, changed.get((farm_id, year), updated_at))
+            counts.setdefault((farm_id, year), [0, 0])[i] = rows
+    # Every summary counts once in each expense category, every bill once in its type
+    cursor.execute("""
+        SELECT farm_id, YEAR(period_start), MIN(refreshed_at),
+               SUM(CASE WHEN tier = 'year' AND source = 'expense' AND category = %s THEN entries ELSE 0 END),
+               SUM(CASE WHEN tier = 'year' AND source = 'utility' THEN entries ELSE 0 END)
+        FROM Finance_Rollup GROUP BY farm_id, YEAR(period_start)
+    """, (EXPENSE_COLUMNS[0],))
+    refreshed, rolled_up = {}, {}
+    for farm_id, year, refreshed_at, expenses, bills in cursor.fetchall():
+        refreshed[farm_id, year] = refreshed_at
+        rolled_up[farm_id, year] = [int(expenses), int(bills)]
+    # Timestamps have whole seconds, so a change in the second of the refresh counts as newer
+    return ({key for key, updated_at in changed.items()
+             if key not in refreshed or updated_at >= refreshed[key] or counts[key] != rolled_up[key]}
+            | (refreshed.keys() - changed.keys()))
+
+
+# Roll up the finance years of a shard that are out of date; returns (farm, year) pairs refreshed
+def refresh_finance_shard(shard):
+    connection = database.open_connection(shard)
+    try:
+        cursor = connection.cursor()
+        try:
+            stale = _stale_finance_years(cursor)
+        finally:
+            cursor.close()
+        years = {}
+        for farm_id, year in stale:
+            years.setdefault(farm_id, set()).add(year)
+        try:
+            for farm_id, farm_years in years.items():
+                refresh_finance(connection, farm_id, farm_years)
+            connection.commit()
+        except Error:
+            connection.rollback()
+            raise
+        return len(stale)
+    finally:
+        connection.close()
+
+
+def rebuild_finance(shard):
+    connection = database.open_connection(shard)
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("DELETE FROM Finance_Rollup")
+            connection.commit()
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+    return refresh_finance_shard(shard)
+
+
+# Catches up once at start, then every interval
+def _maintain(shard):
+    processed = refresh_shard(shard)
+    if processed:
+        logger.info("Rolled up %d readings on shard %s", processed, shard)
+    years = refresh_finance_shard(shard)
+    if years:
+        logger.info("Rolled up %d farm-years of finances on shard %s", years, shard)
+
+
+# Background thread that keeps every shard's rollups current; started once per process
+def start_maintainer(interval=INTERVAL):
+    return database.start_maintainer("rollups", _maintain, interval, logger, "Rollup")
+
+
+# Rollup points for one animal's chart over start..end, at the tier that suits the range
+def series(animal_id, start, end):
+    tier = tier_for(start, end)
+    rows = database.run_queries({'series': ("""
+        SELECT period_start, median_kg, min_kg, max_kg, readings, rejected FROM Weight_Rollup
+        WHERE animal_id = %s AND tier = %s AND readings > 0 AND period_start BETWEEN %s AND %s
+        ORDER BY period_start
+    """, (animal_id, tier, period_start(tier, start), end))})['series']
+    return tier, rows
+
+
+# (tier, query) for a farm's finance rollups over start..end, for run_queries alongside other reads
+def finance_query(farm_id, start, end):
+    tier = finance_tier_for(start, end)
+    return tier, ("""
+        SELECT period_start, source, category, amount FROM Finance_Rollup
+        WHERE farm_id = %s AND tier = %s AND period_start BETWEEN %s AND %s
+        ORDER BY period_start
+    """, (farm_id, tier, period_start(tier, start), end), frames.FINANCE_ROLLUP_KINDS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bring the weight reading and finance rollups up to date.")
+    parser.add_argument("--shard", nargs="*", default=list(farms.SHARDS), choices=list(farms.SHARDS))
+    parser.add_argument("--rebuild", action="store_true", help="discard the rollups and recompute them")
+    args = parser.parse_args(argv)
+    for shard in args.shard:
+        if not database.init_database(shard):
+            raise SystemExit(f"Could not prepare the schema of shard {shard}")
+        processed = rebuild(shard) if args.rebuild else refresh_shard(shard)
+        years = rebuild_finance(shard) if args.rebuild else refresh_finance_shard(shard)
+        print(f"{shard}: rolled up {processed:,} readings and {years:,} farm-years of finances")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
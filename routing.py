@@ -0,0 +1,246 @@
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from mysql.connector import Error
+from mysql.connector.errors import InterfaceError, OperationalError
+
+# Read/write splitting. Plain SELECTs go to a read replica whose replication lag is within
+# bounds; everything else, and every read after a write on the same connection, goes to the
+# primary. Replicas share the primary's credentials and schema and are listed as host[:port];
+# FARM_DB_REPLICAS serves the default shard, other shards list theirs in the farm registry.
+REPLICAS = [r.strip() for r in os.environ.get("FARM_DB_REPLICAS", "").split(",") if r.strip()]
+MAX_LAG = float(os.environ.get("FARM_REPLICA_MAX_LAG", "5"))
+CHECK_INTERVAL = float(os.environ.get("FARM_REPLICA_CHECK_INTERVAL", "10"))
+# How long a session's reads stay on the primary after it commits a write
+READ_YOUR_WRITES = float(os.environ.get("FARM_READ_YOUR_WRITES", "10"))
+
+_READ = re.compile(r"^[\s(]*(SELECT|WITH)\b", re.IGNORECASE)
+# A WITH statement is whatever follows its CTE list, which MySQL 8 allows to be UPDATE or DELETE
+_QUOTED = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`")
+_PARENS = re.compile(r"\([^()]*\)")
+_STATEMENT = re.compile(r"\b(SELECT|UPDATE|DELETE|INSERT|REPLACE)\b", re.IGNORECASE)
+_LOCKING = re.compile(r"\bFOR\s+(UPDATE|SHARE)\b|\bLOCK\s+IN\s+SHARE\s+MODE\b", re.IGNORECASE)
+
+logger = logging.getLogger("farm.routing")
+
+# replica -> (checked at, usable)
+_health = {}
+_health_lock = threading.Lock()
+
+
+def is_read(sql):
+    match = _READ.match(sql)
+    if not match or _LOCKING.search(sql):
+        return False
+    if match.group(1).upper() == "WITH":
+        # Blank out quoted text, then the parenthesised CTE bodies innermost first, so the first
+        # keyword left after WITH is the statement itself
+        rest = _QUOTED.sub(" ", sql[match.end():])
+        while True:
+            stripped = _PARENS.sub(" ", rest)
+            if stripped == rest:
+                break
+            rest = stripped
+        statement = _STATEMENT.search(rest)
+        return bool(statement) and statement.group(1).upper() == "SELECT"
+    return True
+
+
+def replica_config(config, replica):
+    host, _, port = replica.partition(":")
+    return dict(config, host=host, port=int(port) if port else config.get('port', 3306))
+
+
+# Seconds the replica is behind, 0 for a server that is not replicating, None if replication is broken
+def replica_lag(connection):
+    cursor = connection.cursor(dictionary=True)
+    try:
+        try:
+            cursor.execute("SHOW REPLICA STATUS")
+        except Error:
+            # Servers older than MySQL 8.0.22 only know the old name
+            cursor.execute("SHOW SLAVE STATUS")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if row is None:
+        return 0.0
+    lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+    return None if lag is None else float(lag)
+
+
+def needs_check(replica):
+    with _health_lock:
+        checked_at, _ = _health.get(replica, (0.0, True))
+    return time.monotonic() - checked_at >= CHECK_INTERVAL
+
+
+# Whether a replica may serve reads, re-measuring its lag on this connection when the last check is stale
+def check(replica, connection):
+    with _health_lock:
+        checked_at, usable = _health.get(replica, (0.0, True))
+    if time.monotonic() - checked_at < CHECK_INTERVAL:
+        return usable
+    try:
+        lag = replica_lag(connection)
+        usable = lag is not None and lag <= MAX_LAG
+        if not usable:
+            logger.warning("Replica %s is %s; reading from the primary",
+                           replica, "not replicating" if lag is None else f"{lag:.0f}s behind")
+    except Error as e:
+        usable = False
+        logger.warning("Cannot read replication status of %s: %s", replica, e)
+    with _health_lock:
+        _health[replica] = (time.monotonic(), usable)
+    return usable
+
+
+def mark_down(replica):
+    with _health_lock:
+        _health[replica] = (time.monotonic(), False)
+
+
+# Replicas worth trying, in random order to spread the load
+def candidates(replicas):
+    now = time.monotonic()
+    with _health_lock:
+        down = {r for r, (checked_at, usable) in _health.items() if not usable and now - checked_at < CHECK_INTERVAL}
+    healthy = [r for r in replicas if r not in down]
+    return random.sample(healthy, len(healthy))
+
+
+class RoutingCursor:
+    def __init__(self, connection, kwargs):
+        self._connection = connection
+        self._kwargs = kwargs
+        self._cursors = {}
+        self._active = None
+
+    def _cursor(self, target):
+        if target not in self._cursors:
+            self._cursors[target] = self._connection._server(target).cursor(**self._kwargs)
+        return self._cursors[target]
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        target = self._connection._route(operation)
+        self._active = self._cursor(target)
+        try:
+            return self._active.execute(operation, params, *args, **kwargs)
+        except (InterfaceError, OperationalError):
+            if target == "primary":
+                raise
+            # The replica went away mid-session; carry on against the primary
+            self._connection._drop_replica()
+            self._cursors.pop(target, None)
+            self._active = self._cursor("primary")
+            return self._active.execute(operation, params, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        self._connection._wrote = True
+        self._active = self._cursor("primary")
+        return self._active.executemany(operation, seq_params, *args, **kwargs)
+
+    def fetchone(self):
+        return self._active.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._active.fetchmany(size)
+
+    def fetchall(self):
+        return self._active.fetchall()
+
+    def __iter__(self):
+        return iter(self._active)
+
+    def close(self):
+        for cursor in self._cursors.values():
+            cursor.close()
+        self._cursors.clear()
+
+    def __getattr__(self, name):
+        return getattr(self._active if self._active is not None else self._cursor("primary"), name)
+
+
+# Connection that opens the primary and one of its replicas lazily and routes each statement.
+# connect(config) opens a raw connection; on_commit runs after a commit that included writes.
+class RoutingConnection:
+    def __init__(self, config, connect, replicas, pin_primary=False, on_commit=None):
+        self._config = config
+        self._connect = connect
+        self._replicas = replicas
+        self._pin_primary = pin_primary
+        self._on_commit = on_commit
+        self._primary = None
+        self._replica = None
+        self._replica_name = None
+        self._wrote = False
+
+    def _route(self, sql):
+        if self._wrote or self._pin_primary or not is_read(sql):
+            if not is_read(sql):
+                self._wrote = True
+            return "primary"
+        return "replica" if self._open_replica() else "primary"
+
+    def _open_replica(self):
+        if self._replica is not None:
+            return True
+        for replica in candidates(self._replicas):
+            try:
+                connection = self._connect(replica_config(self._config, replica))
+            except Error as e:
+                logger.warning("Replica %s is unreachable: %s", replica, e)
+                mark_down(replica)
+                continue
+            if check(replica, connection):
+                self._replica, self._replica_name = connection, replica
+                return True
+            connection.close()
+        # No usable replica; stop looking for the rest of this connection
+        self._pin_primary = True
+        return False
+
+    def _drop_replica(self):
+        mark_down(self._replica_name)
+        try:
+            self._replica.close()
+        except Error:
+            pass
+        self._replica = None
+        self._pin_primary = True
+
+    def _server(self, target):
+        if target == "replica":
+            return self._replica
+        if self._primary is None:
+            self._primary = self._connect(self._config)
+        return self._primary
+
+    def cursor(self, **kwargs):
+        return RoutingCursor(self, kwargs)
+
+    def commit(self):
+        if self._primary is not None:
+            self._primary.commit()
+            if self._wrote and self._on_commit:
+                self._on_commit()
+
+    def rollback(self):
+        if self._primary is not None:
+            self._primary.rollback()
+
+    def is_connected(self):
+        return any(c is not None and c.is_connected() for c in (self._primary, self._replica))
+
+    def close(self):
+        for connection in (self._primary, self._replica):
+            if connection is not None:
+                connection.close()
+        self._primary = self._replica = None
+
+    def __getattr__(self, name):
+        return getattr(self._server("primary"), name)
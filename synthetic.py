@@ -0,0 +1,186 @@
+import io
+import random
+from datetime import date, timedelta
+
+from PIL import Image
+
+# Deterministic synthetic farm data sized for benchmarks and load tests.
+# The same seed and parameters always produce the same rows.
+
+BREEDS = ["Holstein", "Angus", "Hereford", "Jersey", "Simmental", "Charolais", "Brahman", "Limousin"]
+CATEGORIES = ["Dairy Cow", "Beef Steer", "Heifer", "Calf", "Bull"]
+FEED_TYPES = ["Hay", "Silage", "Grain Mix", "Pasture", "Protein Supplement", "Mineral Lick"]
+MEDICINES = ["Ivermectin", "Penicillin", "Oxytetracycline", "Vitamin B12", "FMD Vaccine", "Dewormer"]
+ROLES = ["Herdsman", "Milker", "Feeder", "Veterinary Assistant", "Manager"]
+UTILITY_TYPES = ["Electricity", "Water", "Gas", "Internet"]
+
+# Tables in foreign-key order, used for loading and clearing
+TABLES = ["Animal_Category", "Animal", "Staff", "Expense_Summary",
+          "Monthly_Weight", "Feed_Record", "Medicine_Record", "Utility_Bill", "Weight_Reading",
+          "Weight_Rollup", "Rollup_State", "Rollup_Gap", "Finance_Rollup", "Health_Score", "Weight_Forecast",
+          "Expense_Forecast", "Animal_Archive", "Monthly_Weight_Archive", "Feed_Record_Archive",
+          "Medicine_Record_Archive", "Weight_Reading_Archive"]
+
+DEFAULT_END = date(2025, 6, 1)
+
+
+def _month_starts(start, end):
+    current = date(start.year, start.month, 1)
+    while current <= end:
+        yield current
+        current = date(current.year + current.month // 12, current.month % 12 + 1, 1)
+
+
+# Noise JPEG of roughly phone-photo-thumbnail size; a small pool is reused like stock photos
+def make_image(rng, width=800, height=600, quality=85):
+    image = Image.effect_noise((width // 8, height // 8), 64).convert("RGB")
+    tint = Image.new("RGB", image.size, tuple(rng.randrange(256) for _ in range(3)))
+    image = Image.blend(image, tint, 0.5).resize((width, height), Image.BILINEAR)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+class SyntheticFarm:
+    def __init__(self, herd_size=100, years=2, seed=42, end=DEFAULT_END,
+                 image_pool=8, image_width=800, medicine_rate=0.02, staff_size=None):
+        self.herd_size = herd_size
+        self.years = years
+        self.seed = seed
+        self.end = end
+        self.start = date(end.year - years, end.month, 1)
+        self.medicine_rate = medicine_rate
+        self.staff_size = staff_size or max(3, herd_size // 20)
+
+        rng = random.Random(seed)
+        self.images = [make_image(rng, image_width, image_width * 3 // 4) for _ in range(image_pool)]
+
+    def _rng(self, table):
+        return random.Random(f"{self.seed}:{table}")
+
+    def categories(self):
+        rng = self._rng("Animal_Category")
+        for category_id, name in enumerate(CATEGORIES, start=1):
+            yield (category_id, name, f"{name} stock", rng.choice(self.images))
+
+    def animals(self):
+        rng = self._rng("Animal")
+        span = (self.end - self.start).days
+        for animal_id in range(1, self.herd_size + 1):
+            arrival = self.start + timedelta(days=rng.randrange(max(1, span // 4)))
+            yield (animal_id, f"TAG-{animal_id:06d}", rng.randrange(1, len(CATEGORIES) + 1),
+                   rng.choice(BREEDS), arrival, round(rng.uniform(80, 250), 1),
+                   rng.choice(self.images))
+
+    def _arrivals(self):
+        return {row[0]: (row[4], row[5]) for row in self.animals()}
+
+    def staff(self):
+        rng = self._rng("Staff")
+        for staff_id in range(1, self.staff_size + 1):
+            yield (staff_id, f"Worker {staff_id}", rng.choice(ROLES),
+                   round(rng.uniform(1500, 4000), 2), rng.choice(self.images))
+
+    def monthly_weights(self):
+        rng = self._rng("Monthly_Weight")
+        for animal_id, (arrival, initial) in self._arrivals().items():
+            gain_per_month = rng.uniform(15, 35)
+            for n, month in enumerate(_month_starts(arrival, self.end), start=1):
+                weight = initial + gain_per_month * n * (1 - n / 120) + rng.gauss(0, 4)
+                yield (animal_id, month, round(max(weight, initial * 0.8), 1))
+
+    def feed_records(self):
+        rng = self._rng("Feed_Record")
+        for animal_id, (arrival, _) in self._arrivals().items():
+            day = arrival
+            while day <= self.end:
+                feed_type = rng.choice(FEED_TYPES)
+                quantity = round(rng.uniform(4, 14), 1)
+                yield (animal_id, day, feed_type, quantity, round(quantity * rng.uniform(0.2, 0.6), 2))
+                day += timedelta(days=1)
+
+    def medicine_records(self):
+        rng = self._rng("Medicine_Record")
+        for animal_id, (arrival, _) in self._arrivals().items():
+            day = arrival
+            while day <= self.end:
+                if rng.random() < self.medicine_rate:
+                    yield (animal_id, day, rng.choice(MEDICINES), f"{rng.randrange(2, 30)}ml",
+                           round(rng.uniform(5, 80), 2), "routine" if rng.random() < 0.8 else "follow-up")
+                day += timedelta(days=1)
+
+    def utility_bills(self):
+        rng = self._rng("Utility_Bill")
+        for month in _month_starts(self.start, self.end):
+            for bill_type in UTILITY_TYPES:
+                yield (month, bill_type, round(rng.uniform(50, 900), 2))
+
+    def expense_summaries(self):
+        rng = self._rng("Expense_Summary")
+        salaries = sum(row[3] for row in self.staff())
+        per_head = self.herd_size * 30
+        for month in _month_starts(self.start, self.end):
+            feed = round(per_head * rng.uniform(1.8, 2.6), 2)
+            medicine = round(self.herd_size * rng.uniform(0.5, 2.5), 2)
+            utilities = round(rng.uniform(800, 2500), 2)
+            other = round(rng.uniform(200, 1500), 2)
+            yield (month, feed, medicine, salaries, utilities, other,
+                   round(feed + medicine + salaries + utilities + other, 2))
+
+    # (table, insert statement, row generator) in load order
+    def tables(self):
+        return [
+            ("Animal_Category", "INSERT INTO Animal_Category (category_id, name, description, image) "
+                                "VALUES (%s, %s, %s, %s)", self.categories),
+            ("Animal", "INSERT INTO Animal (animal_id, tag_number, category_id, breed, arrival_date, "
+                       "initial_weight_kg, image) VALUES (%s, %s, %s, %s, %s, %s, %s)", self.animals),
+            ("Staff", "INSERT INTO Staff (staff_id, name, role, salary_per_month, image) "
+                      "VALUES (%s, %s, %s, %s, %s)", self.staff),
+            ("Expense_Summary", "INSERT INTO Expense_Summary (month, total_feed_cost, total_medicine_cost, "
+                                "total_salaries, total_utilities, other_expenses, total_expense) "
+                                "VALUES (%s, %s, %s, %s, %s, %s, %s)", self.expense_summaries),
+            ("Monthly_Weight", "INSERT INTO Monthly_Weight (animal_id, month, weight_kg) "
+                               "VALUES (%s, %s, %s)", self.monthly_weights),
+            ("Feed_Record", "INSERT INTO Feed_Record (animal_id, date, feed_type, quantity_kg, cost) "
+                            "VALUES (%s, %s, %s, %s, %s)", self.feed_records),
+            ("Medicine_Record", "INSERT INTO Medicine_Record (animal_id, date, medicine_name, quantity, "
+                                "cost, remarks) VALUES (%s, %s, %s, %s, %s, %s)", self.medicine_records),
+            ("Utility_Bill", "INSERT INTO Utility_Bill (month, type, amount) "
+                             "VALUES (%s, %s, %s)", self.utility_bills),
+        ]
+
+
+# Remove every row from the farm tables, children first
+def clear(connection):
+    cursor = connection.cursor()
+    try:
+        for table in reversed(TABLES):
+            cursor.execute(f"DELETE FROM {table}")
+        connection.commit()
+    finally:
+        cursor.close()
+
+
+# Insert the synthetic farm in batched multi-row inserts; returns row counts per table
+def load(connection, farm, batch_size=1000):
+    counts = {}
+    cursor = connection.cursor()
+    try:
+        for table, statement, rows in farm.tables():
+            # Image batches are kept small so a batch stays under max_allowed_packet
+            size = 20 if table in ("Animal_Category", "Animal", "Staff") else batch_size
+            batch = []
+            counts[table] = 0
+            for row in rows():
+                batch.append(row)
+                if len(batch) >= size:
+                    cursor.executemany(statement, batch)
+                    counts[table] += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(statement, batch)
+                counts[table] += len(batch)
+            connection.commit()
+    finally:
+        cursor.close()
+    return counts
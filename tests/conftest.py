@@ -0,0 +1,27 @@
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The modules live at the repository root, next to app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# Builds Monthly_Weight rows (weight_id, animal_id, month, weight_kg) typed as frames.read_weights
+# returns them
+@pytest.fixture
+def weights_frame():
+    def build(rows):
+        rows = list(rows)
+        return pd.DataFrame({
+            'weight_id': np.array([row[0] for row in rows], dtype=np.int32),
+            'animal_id': np.array([row[1] for row in rows], dtype=np.int32),
+            'farm_id': np.ones(len(rows), dtype=np.int32),
+            'month': pd.DatetimeIndex([row[2] for row in rows]).as_unit("us"),
+            'weight_kg': np.array([row[3] for row in rows], dtype=np.float32),
+            'updated_at': pd.DatetimeIndex([datetime(2025, 1, 1, 0, 0, row[0] % 60) for row in rows]).as_unit("us"),
+        })
+    return build
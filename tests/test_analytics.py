@@ -0,0 +1,32 @@
+import json
+
+import pytest
+
+import analytics
+
+
+@pytest.fixture
+def shard(tmp_path, monkeypatch):
+    # A snapshot that has been refreshed but holds no parts: every fact table was empty
+    monkeypatch.setattr(analytics, "SNAPSHOT_DIR", str(tmp_path))
+    (tmp_path / "main").mkdir()
+    state = {table: {'refreshed_at': "2026-01-01T00:00:00", 'next_part': 1} for table in analytics.FACT_TABLES}
+    (tmp_path / "main" / "state.json").write_text(json.dumps(state))
+    return "main"
+
+
+def test_tables_without_parts_are_empty_views(shard):
+    assert analytics.monthly_costs(1, shard).empty
+    assert analytics.herd_weights(1, "2025-01-01", "2025-12-31", shard).empty
+    for table, (_, columns) in analytics.FACT_TABLES.items():
+        assert list(analytics.query(f"SELECT * FROM {table}", shard=shard).columns) == list(columns)
+
+
+def test_failed_query_is_snapshot_unavailable(shard):
+    with pytest.raises(analytics.SnapshotUnavailable):
+        analytics.query("SELECT no_such_column FROM Feed_Record", shard=shard)
+
+
+def test_never_refreshed_shard_is_unavailable(shard):
+    with pytest.raises(analytics.SnapshotUnavailable):
+        analytics.query("SELECT 1", shard="other")
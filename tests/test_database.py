@@ -0,0 +1,46 @@
+import pytest
+from mysql.connector.errors import InterfaceError, PoolError
+
+import database
+import farms
+import routing
+
+PRIMARY = object()
+
+
+class ReplicaPool:
+    def __init__(self, error):
+        self.error = error
+
+    def get_connection(self):
+        raise self.error
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    monkeypatch.setattr(routing, "_health", {})
+    monkeypatch.setattr(database, "shard_replicas", lambda shard: ["replica-1"])
+
+    def use(error):
+        monkeypatch.setattr(database, "get_pool",
+                            lambda shard, server="primary": PRIMARY if server == "primary" else ReplicaPool(error))
+    return use
+
+
+def test_exhausted_replica_pool_falls_back_without_marking_it_down(replica):
+    replica(PoolError(msg="Failed getting connection; pool exhausted"))
+    assert database._read_pool(farms.DEFAULT_SHARD, False) is PRIMARY
+    assert routing.candidates(["replica-1"]) == ["replica-1"]
+
+
+def test_unreachable_replica_is_marked_down(replica):
+    replica(InterfaceError(msg="2003: Can't connect to MySQL server"))
+    assert database._read_pool(farms.DEFAULT_SHARD, False) is PRIMARY
+    assert routing.candidates(["replica-1"]) == []
+
+
+def test_with_statement_is_routed_by_what_follows_the_cte_list():
+    assert routing.is_read("WITH recent (id) AS (SELECT id FROM Animal WHERE name = ')') SELECT * FROM recent")
+    assert not routing.is_read("WITH old AS (SELECT id FROM Animal) DELETE FROM Animal WHERE id IN (SELECT id FROM old)")
+    assert not routing.is_read("WITH old AS (SELECT id FROM Animal) UPDATE Animal SET status = 'Sold'")
+    assert not routing.is_read("WITH a AS (SELECT 1) SELECT * FROM a FOR UPDATE")
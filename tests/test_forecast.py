@@ -0,0 +1,111 @@
+import math
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import forecast
+
+
+def _line(animal_id, first_id, months, intercept, slope):
+    anchor = months[-1]
+    return [(first_id + i, animal_id, month, intercept + slope * (month - anchor).days)
+            for i, month in enumerate(months)]
+
+
+MONTHS = [date(2025, m, 1) for m in range(1, 9)]
+
+
+def test_exact_line_is_recovered_per_animal(weights_frame):
+    weights = weights_frame(_line(1, 1, MONTHS, 420.0, 0.75) + _line(2, 100, MONTHS[2:], 260.0, 1.25))
+    fits = forecast.fit_weights(weights).set_index('animal_id')
+    assert fits.loc[1, 'gain_kg_per_day'] == pytest.approx(0.75, abs=1e-4)
+    assert fits.loc[1, 'anchor_kg'] == pytest.approx(420.0, abs=1e-3)
+    assert fits.loc[2, 'gain_kg_per_day'] == pytest.approx(1.25, abs=1e-4)
+    assert fits.loc[2, 'anchor_kg'] == pytest.approx(260.0, abs=1e-3)
+    assert fits.loc[1, 'residual_kg'] == pytest.approx(0, abs=1e-3)
+    assert (fits.loc[1, 'points'], fits.loc[2, 'points']) == (8, 6)
+    assert fits.loc[1, 'anchor_month'] == pd.Timestamp(MONTHS[-1])
+
+
+def test_noisy_weights_match_polyfit(weights_frame):
+    rng = np.random.default_rng(7)
+    rows = []
+    for animal_id in range(1, 20):
+        for i, month in enumerate(MONTHS[:int(rng.integers(3, 9))]):
+            rows.append((animal_id * 100 + i, animal_id, month, 300 + 0.9 * i * 30 + rng.normal(0, 5)))
+    weights = weights_frame(reversed(rows))
+    fits = forecast.fit_weights(weights).set_index('animal_id')
+    for animal_id, group in weights.groupby('animal_id'):
+        days = (group['month'] - group['month'].max()).dt.days.to_numpy(dtype=np.float64)
+        slope, intercept = np.polyfit(days, group['weight_kg'].to_numpy(dtype=np.float64), 1)
+        assert fits.loc[animal_id, 'gain_kg_per_day'] == pytest.approx(slope, rel=1e-6)
+        assert fits.loc[animal_id, 'anchor_kg'] == pytest.approx(intercept, rel=1e-6)
+
+
+def test_weigh_ins_older_than_the_window_are_left_out(weights_frame):
+    old = (1, 1, date(2022, 1, 1), 900.0)
+    weights = weights_frame([old] + _line(1, 2, MONTHS, 420.0, 0.5))
+    fit = forecast.fit_weights(weights).iloc[0]
+    assert fit['points'] == len(MONTHS)
+    assert fit['gain_kg_per_day'] == pytest.approx(0.5, abs=1e-4)
+
+
+def test_degenerate_histories_are_not_fit(weights_frame):
+    weights = weights_frame([(1, 1, date(2025, 3, 1), 400.0),
+                        (2, 2, date(2025, 3, 1), 300.0), (3, 2, date(2025, 3, 1), 304.0),
+                        (4, 3, date(2025, 3, 1), 350.0), (5, 3, date(2025, 5, 1), 380.0)])
+    fits = forecast.fit_weights(weights)
+    # One weigh-in, or all on one day, leaves no slope; two points fit exactly with no residual
+    assert fits['animal_id'].tolist() == [3]
+    assert fits.iloc[0]['gain_kg_per_day'] == pytest.approx(30.0 / 61)
+    assert math.isnan(fits.iloc[0]['residual_kg'])
+
+
+def test_no_weights_fit_nothing(weights_frame):
+    fits = forecast.fit_weights(weights_frame([]))
+    assert fits.empty
+    assert list(fits.columns) == list(forecast.FIT_COLUMNS)
+
+
+def _expenses(months, amount):
+    return pd.DataFrame({'month': pd.DatetimeIndex(months).as_unit("us"),
+                         **{category: [amount(i, month) for i, month in enumerate(months)]
+                            for category in forecast.EXPENSE_CATEGORIES}})
+
+
+def _projection(rows, category):
+    return {month: amount for month, name, amount in rows if name == category}
+
+
+def test_expense_trend_is_extended():
+    months = [date(2024, m, 1) for m in range(1, 13)]
+    rows = forecast.fit_expenses(_expenses(months, lambda i, month: 100.0 + 10 * i))
+    feed = _projection(rows, "total_feed_cost")
+    assert len(feed) == forecast.HORIZON
+    assert feed[date(2025, 1, 1)] == pytest.approx(220.0)
+    assert feed[date(2025, 6, 1)] == pytest.approx(270.0)
+    total = _projection(rows, "total_expense")
+    assert total[date(2025, 1, 1)] == pytest.approx(220.0 * len(forecast.EXPENSE_CATEGORIES))
+
+
+def test_seasonal_pattern_is_repeated_after_two_years():
+    months = [date(2023 + i // 12, i % 12 + 1, 1) for i in range(24)]
+    rows = forecast.fit_expenses(_expenses(months, lambda i, month: 500.0 + 5 * i + (80 if month.month == 12 else 0)))
+    feed = _projection(rows, "total_feed_cost")
+    assert feed[date(2025, 11, 1)] == pytest.approx(500.0 + 5 * 34)
+    assert feed[date(2025, 12, 1)] == pytest.approx(500.0 + 5 * 35 + 80)
+
+
+def test_falling_expenses_are_not_projected_below_zero():
+    months = [date(2024, m, 1) for m in range(1, 7)]
+    rows = forecast.fit_expenses(_expenses(months, lambda i, month: 100.0 - 20 * i))
+    assert min(amount for _, _, amount in rows) == 0
+
+
+def test_degenerate_expense_histories():
+    assert forecast.fit_expenses(_expenses([date(2024, 5, 1)], lambda i, month: 100.0)) == []
+    # Two summaries of the same month give no trend, only their mean
+    rows = forecast.fit_expenses(_expenses([date(2024, 5, 1), date(2024, 5, 1)], lambda i, month: 100.0 + 50 * i))
+    assert set(_projection(rows, "total_feed_cost").values()) == {125.0}
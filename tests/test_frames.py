@@ -0,0 +1,98 @@
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+import frames
+
+
+class FakeCursor:
+    def __init__(self, names, rows):
+        self.description = [(name,) for name in names] if names else None
+        self.rows = list(rows)
+        self.fetches = 0
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        self.sql, self.params = sql, params
+
+    def fetchmany(self, size):
+        self.fetches += 1
+        chunk, self.rows = self.rows[:size], self.rows[size:]
+        return chunk
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self, names, rows):
+        self.cursor_ = FakeCursor(names, rows)
+
+    def cursor(self):
+        return self.cursor_
+
+
+KINDS = {'id': 'int32', 'day': 'date', 'kg': 'float32', 'total': 'float64', 'feed': 'category'}
+NAMES = ("id", "day", "kg", "total", "feed", "note")
+
+
+def _read(rows, chunk_rows=frames.FETCH_ROWS):
+    connection = FakeConnection(NAMES, rows)
+    frame = frames.read_frame(connection, "SELECT ...", (1,), KINDS, chunk_rows=chunk_rows)
+    assert connection.cursor_.closed
+    return frame, connection.cursor_
+
+
+def test_columns_get_their_kinds():
+    frame, cursor = _read([(1, date(2025, 3, 1), 410.5, 12.25, "Hay", "first"),
+                           (2, datetime(2025, 3, 2, 6, 30), 398.0, 3.5, "Silage", None)])
+    assert cursor.params == (1,)
+    assert frame['id'].dtype == np.int32
+    assert frame['day'].dtype == "datetime64[us]"
+    assert frame['kg'].dtype == np.float32
+    assert frame['total'].dtype == np.float64
+    assert isinstance(frame['feed'].dtype, pd.CategoricalDtype)
+    assert frame['day'].tolist() == [pd.Timestamp(2025, 3, 1), pd.Timestamp(2025, 3, 2, 6, 30)]
+    assert frame['feed'].tolist() == ["Hay", "Silage"]
+    # Columns without a kind are left to pandas
+    assert frame['note'][0] == "first" and pd.isna(frame['note'][1])
+
+
+def test_nulls_become_missing_values():
+    frame, _ = _read([(1, None, None, None, None, None), (2, date(2025, 1, 1), 5.0, 1.0, "Hay", "x")])
+    assert pd.isna(frame['day'][0])
+    assert np.isnan(frame['kg'][0]) and frame['kg'].dtype == np.float32
+    assert np.isnan(frame['total'][0])
+    assert pd.isna(frame['feed'][0]) and frame['feed'][1] == "Hay"
+
+
+def test_categories_stay_consistent_across_chunks():
+    feeds = ["Hay", "Silage", "Hay", None, "Grain", "Silage", "Grain"]
+    rows = [(i, date(2025, 1, 1), float(i), None if i % 3 == 0 else float(i), feed, None)
+            for i, feed in enumerate(feeds)]
+    frame, cursor = _read(rows, chunk_rows=2)
+    assert cursor.fetches == 5
+    assert frame['id'].tolist() == list(range(len(feeds)))
+    assert [None if pd.isna(v) else v for v in frame['feed']] == feeds
+    assert list(frame['feed'].cat.categories) == ["Hay", "Silage", "Grain"]
+    assert frame['total'].isna().tolist() == [i % 3 == 0 for i in range(len(feeds))]
+
+
+def test_empty_result_keeps_columns_and_dtypes():
+    frame, _ = _read([])
+    assert frame.empty
+    assert list(frame.columns) == list(NAMES)
+    assert frame['id'].dtype == np.int32
+    assert frame['day'].dtype == "datetime64[us]"
+    assert frame['kg'].dtype == np.float32
+    assert frame['total'].dtype == np.float64
+    assert isinstance(frame['feed'].dtype, pd.CategoricalDtype)
+
+
+def test_to_rows_gives_python_values_for_executemany():
+    frame, _ = _read([(1, date(2025, 3, 1), 410.5, None, "Hay", "x"), (2, None, None, 3.25, None, None)])
+    frame['stamp'] = pd.DatetimeIndex([datetime(2025, 3, 2, 8, 30), datetime(2025, 4, 2, 9, 0)]).as_unit("us")
+    rows = frames.to_rows(frame, ("id", "day", "kg", "total", "note", "stamp"), dates=("day",))
+    assert rows == [(1, date(2025, 3, 1), 410.5, None, "x", datetime(2025, 3, 2, 8, 30)),
+                    (2, None, None, 3.25, None, datetime(2025, 4, 2, 9, 0))]
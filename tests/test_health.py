@@ -0,0 +1,101 @@
+import math
+import random
+from datetime import date
+
+import numpy as np
+import pytest
+
+import health
+
+
+# The same scores computed one animal at a time, the plain way
+def _score_by_loop(weights):
+    expected = {}
+    for animal_id, rows in weights.groupby('animal_id'):
+        rows = rows.assign(index=rows['month'].dt.year * 12 + rows['month'].dt.month)
+        rows = rows.sort_values(['index', 'weight_id'])
+        months = rows['index'].tolist()
+        kg = [float(v) for v in rows['weight_kg']]
+        gains, gap, change = [], 0, math.nan
+        for i in range(1, len(kg)):
+            gap, change = months[i] - months[i - 1], kg[i] - kg[i - 1]
+            gains.append(change / gap if gap > 0 else math.nan)
+        latest_gain = gains[-1] if gains else math.nan
+        earlier = [g for g in gains[:-1] if not math.isnan(g)]
+        z = math.nan
+        if len(earlier) >= health.MIN_HISTORY:
+            std = float(np.std(earlier, ddof=1))
+            z = (latest_gain - float(np.mean(earlier))) / max(std, health.MIN_GAIN_STD_KG)
+        drop = max(-change / kg[-2], 0) if len(kg) > 1 else 0.0
+        missed = max(gap - 1, 0) if len(kg) > 1 else 0
+        severity = ((-z / health.Z_ALERT if z <= -health.Z_ALERT else 0)
+                    + (drop / health.DROP_ALERT if drop >= health.DROP_ALERT else 0) + missed)
+        expected[animal_id] = (latest_gain, z, drop, missed, severity, kg[-1], rows['updated_at'].max())
+    return expected
+
+
+def _assert_matches_loop(weights):
+    scores = health.score(weights).set_index('animal_id')
+    expected = _score_by_loop(weights)
+    assert sorted(scores.index) == sorted(expected)
+    for animal_id, (gain, z, drop, missed, severity, latest_kg, updated) in expected.items():
+        row = scores.loc[animal_id]
+        np.testing.assert_allclose([row['monthly_gain_kg'], row['gain_z'], row['drop_pct'], row['score'],
+                                    row['latest_weight_kg']],
+                                   [gain, z, drop, severity, latest_kg], rtol=1e-9, atol=1e-9, equal_nan=True)
+        assert row['gap_months'] == missed
+        assert row['source_updated_at'] == updated
+
+
+def test_empty_history_scores_nothing(weights_frame):
+    scores = health.score(weights_frame([]))
+    assert scores.empty
+    assert list(scores.columns) == list(health.SCORE_COLUMNS)
+
+
+def test_single_weigh_in_has_no_gain_and_no_alert(weights_frame):
+    scores = health.score(weights_frame([(1, 7, date(2025, 3, 1), 410.0)]))
+    row = scores.iloc[0]
+    assert row['animal_id'] == 7
+    assert math.isnan(row['monthly_gain_kg']) and math.isnan(row['gain_z'])
+    assert (row['drop_pct'], row['gap_months'], row['score']) == (0, 0, 0)
+
+
+def test_stalled_animal_is_flagged_and_segments_do_not_leak(weights_frame):
+    steady = [(i, 1, date(2025, month, 1), 300.0 + 20 * month + (month % 2)) for i, month in enumerate(range(1, 7), 1)]
+    # Animal 2 grows like animal 1, then loses weight after missing two weigh-ins
+    stalled = [(10 + month, 2, date(2025, month, 1), 300.0 + 20 * month + (month % 3)) for month in range(1, 6)]
+    stalled.append((20, 2, date(2025, 8, 1), 360.0))
+    lone = [(30, 3, date(2025, 1, 1), 250.0)]
+    weights = weights_frame(steady + stalled + lone)
+    scores = health.score(weights).set_index('animal_id')
+    assert scores.loc[1, 'score'] == 0
+    assert scores.loc[2, 'gap_months'] == 2
+    assert scores.loc[2, 'gain_z'] <= -health.Z_ALERT
+    assert scores.loc[2, 'drop_pct'] == pytest.approx(1 - 360.0 / 402.0)
+    assert scores.loc[3, 'score'] == 0
+    _assert_matches_loop(weights)
+
+
+def test_second_weigh_in_in_a_month_has_no_gain(weights_frame):
+    weights = weights_frame([(1, 5, date(2025, 1, 1), 300.0), (2, 5, date(2025, 2, 1), 320.0),
+                        (3, 5, date(2025, 2, 1), 318.0)])
+    row = health.score(weights).iloc[0]
+    assert math.isnan(row['monthly_gain_kg'])
+    assert row['latest_weight_kg'] == 318.0
+    _assert_matches_loop(weights)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_herd_matches_a_per_animal_loop(seed, weights_frame):
+    rng = random.Random(seed)
+    rows, weight_id = [], 0
+    for animal_id in range(1, 60):
+        kg = rng.uniform(150, 400)
+        for _ in range(rng.choice([1, 1, 2, 3, 5, 8, 12])):
+            weight_id += 1
+            kg += rng.gauss(15, 12)
+            rows.append((weight_id, animal_id, date(2024 + rng.randrange(2), rng.randrange(1, 13), 1), kg))
+    # Row order from the database is arbitrary
+    rng.shuffle(rows)
+    _assert_matches_loop(weights_frame(rows))
@@ -0,0 +1,145 @@
+import http.client
+import json
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+import pytest
+
+import farms
+import ingest_server
+
+
+@pytest.mark.parametrize("epoch", [1e20, -1e20, float("inf"), float("nan"), 10**30])
+def test_out_of_range_epoch_is_an_invalid_reading(epoch):
+    with pytest.raises(ingest_server.InvalidReading):
+        ingest_server.parse_time(epoch)
+
+
+@pytest.mark.parametrize("value", [True, False])
+def test_boolean_timestamp_is_an_invalid_reading(value):
+    with pytest.raises(ingest_server.InvalidReading):
+        ingest_server.parse_time(value)
+
+
+def test_boolean_weight_is_an_invalid_reading():
+    with pytest.raises(ingest_server.InvalidReading):
+        ingest_server.clean({'tag_number': "A1", 'weight_kg': True}, None)
+
+
+def test_epoch_and_iso_timestamps_are_read():
+    assert ingest_server.parse_time("2025-03-01T06:30:00").hour == 6
+    assert ingest_server.parse_time(0).year in (1969, 1970)
+
+
+def test_non_utf8_csv_body_is_an_invalid_reading():
+    with pytest.raises(ingest_server.InvalidReading):
+        ingest_server.parse_body(b"tag_number,weight_kg\n\xff\xfe,412\n", "text/csv")
+
+
+def test_non_utf8_json_body_is_an_invalid_reading():
+    with pytest.raises(ingest_server.InvalidReading):
+        ingest_server.parse_body(b"[\xff]", "application/json")
+
+
+def test_csv_body_is_parsed():
+    readings, device = ingest_server.parse_body("\ufefftag_number,weight_kg\nA1,412\n".encode("utf-8"),
+                                                "text/csv")
+    assert readings == [{'tag_number': "A1", 'weight_kg': "412"}]
+    assert device is None
+
+
+@pytest.fixture
+def server(monkeypatch):
+    # Tags resolve without a database; no tag is known, so nothing reaches the writer queues
+    monkeypatch.setattr(ingest_server, "resolve_tags", lambda farm_id, tags: {})
+    monkeypatch.setattr(ingest_server, "TOKEN", None)
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ingest_server._IngestHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/readings?farm={farms.DEFAULT_FARM}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _post(url, body, content_type):
+    request = urllib.request.Request(url, data=body, headers={"Content-Type": content_type}, method="POST")
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_non_utf8_body_gets_a_400(server):
+    status, body = _post(server, b"tag_number,weight_kg\n\xff,412\n", "text/csv")
+    assert status == 400
+    assert "UTF-8" in body['error']
+
+
+def test_out_of_range_epoch_counts_as_invalid(server):
+    readings = [{'tag_number': "A1", 'weight_kg': 412, 'read_at': 1e20},
+                {'tag_number': "A2", 'weight_kg': 398, 'read_at': 1700000000}]
+    status, body = _post(server, json.dumps(readings).encode("utf-8"), "application/json")
+    assert status == 202
+    assert body['invalid'] == 1
+    assert body['unknown_tags'] == ["A2"]
+    assert "out of range" in body['errors'][0]
+
+
+def _post_with_length(url, length):
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=5)
+    try:
+        connection.putrequest("POST", f"{parts.path}?{parts.query}")
+        connection.putheader("Content-Type", "application/json")
+        connection.putheader("Content-Length", length)
+        connection.endheaders(b"[]")
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+@pytest.mark.parametrize("length", ["abc", "-1", "1.5"])
+def test_invalid_content_length_gets_a_400(server, length):
+    status, body = _post_with_length(server, length)
+    assert status == 400
+    assert "Content-Length" in body['error']
+
+
+def test_oversized_content_length_gets_a_413(server, monkeypatch):
+    monkeypatch.setattr(ingest_server, "MAX_BODY_BYTES", 1024)
+    status, _ = _post_with_length(server, "1025")
+    assert status == 413
+
+
+def test_boolean_read_at_counts_as_invalid(server):
+    readings = [{'tag_number': "A1", 'weight_kg': 412, 'read_at': True}]
+    status, body = _post(server, json.dumps(readings).encode("utf-8"), "application/json")
+    assert status == 202
+    assert body['invalid'] == 1
+
+
+def test_tag_cache_expires_by_age_and_on_forget(monkeypatch):
+    loads = []
+
+    def load_tags(farm_id):
+        loads.append(farm_id)
+        return {"A1": 10 + len(loads)}
+
+    monkeypatch.setattr(ingest_server, "_load_tags", load_tags)
+    monkeypatch.setattr(ingest_server, "_tags", {})
+    clock = [1000.0]
+    monkeypatch.setattr(ingest_server.time, "monotonic", lambda: clock[0])
+
+    assert ingest_server.resolve_tags(1, ["A1"]) == {"A1": 11}
+    clock[0] += ingest_server.TAG_MAX_AGE - 1
+    assert ingest_server.resolve_tags(1, ["A1"]) == {"A1": 11}
+    clock[0] += 1
+    assert ingest_server.resolve_tags(1, ["A1"]) == {"A1": 12}
+    ingest_server.forget_tags(1)
+    assert ingest_server.resolve_tags(1, ["A1"]) == {"A1": 13}
+    assert loads == [1, 1, 1]
@@ -0,0 +1,96 @@
+import sqlite3
+import urllib.request
+
+import pytest
+
+import instrumentation
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def no_slow_log(monkeypatch):
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_MS", float("inf"))
+    monkeypatch.setattr(instrumentation, "SLOW_RERUN_MS", float("inf"))
+
+
+def test_counter_and_histogram_text_format():
+    registry = metrics.Registry()
+    requests = registry.counter("test_requests_total", "Requests, by status", ("status",))
+    latency = registry.histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+    requests.inc(status="200")
+    requests.inc(2, status="404")
+    latency.observe(0.05)
+    latency.observe(0.5)
+
+    assert registry.render().splitlines() == [
+        "# HELP test_requests_total Requests, by status",
+        "# TYPE test_requests_total counter",
+        'test_requests_total{status="200"} 1',
+        'test_requests_total{status="404"} 2',
+        "# HELP test_latency_seconds Latency",
+        "# TYPE test_latency_seconds histogram",
+        'test_latency_seconds_bucket{le="0.1"} 1',
+        'test_latency_seconds_bucket{le="1"} 2',
+        'test_latency_seconds_bucket{le="+Inf"} 2',
+        "test_latency_seconds_sum 0.55",
+        "test_latency_seconds_count 2",
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = metrics.Registry()
+    registry.counter("test_total", "Test", ("page",)).inc(page='a "b"\\c')
+    assert 'test_total{page="a \\"b\\"\\\\c"} 1' in registry.render()
+
+
+def test_unlabelled_counter_renders_zero_before_first_increment():
+    registry = metrics.Registry()
+    registry.counter("test_total", "Test")
+    assert "test_total 0" in registry.render().splitlines()
+
+
+def test_instrumented_query_is_recorded_and_exported():
+    connection = instrumentation.InstrumentedConnection(sqlite3.connect(":memory:"))
+    rerun = instrumentation.start_rerun("Metrics Test")
+    cursor = connection.cursor()
+    cursor.execute("SELECT ?, ? UNION ALL SELECT ?, ?", (1, "ab", 2, "cd"))
+    assert cursor.fetchall() == [(1, "ab"), (2, "cd")]
+    cursor.close()
+    instrumentation.finish_rerun()
+
+    assert len(rerun.queries) == 1
+    query = rerun.queries[0]
+    assert query['sql'] == "SELECT ?, ? UNION ALL SELECT ?, ?"
+    assert query['params'] == "(int, str, int, str)"
+    assert query['rows'] == 2
+    assert query['bytes'] == 8 + 2 + 8 + 2
+
+    lines = metrics.REGISTRY.render().splitlines()
+    assert 'farm_query_rows_total{page="Metrics Test"} 2' in lines
+    assert 'farm_query_duration_seconds_count{page="Metrics Test"} 1' in lines
+    assert 'farm_query_duration_seconds_bucket{page="Metrics Test",le="+Inf"} 1' in lines
+    assert 'farm_page_reruns_total{page="Metrics Test"} 1' in lines
+    assert "# TYPE farm_query_duration_seconds histogram" in lines
+
+
+def test_http_exporter_serves_the_registry():
+    registry = metrics.Registry()
+    registry.counter("test_scrapes_total", "Scrapes").inc()
+    server = metrics.start_http_server(0, registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        with urllib.request.urlopen(url, timeout=5) as response:
+            assert response.headers["Content-Type"] == metrics.CONTENT_TYPE
+            assert "test_scrapes_total 1" in response.read().decode("utf-8").splitlines()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_write_to_file_replaces_the_exposition(tmp_path):
+    registry = metrics.Registry()
+    registry.counter("test_total", "Test").inc(3)
+    path = tmp_path / "farm.prom"
+    metrics.write_to_file(str(path), registry)
+    assert "test_total 3" in path.read_text().splitlines()
+    assert [p.name for p in tmp_path.iterdir()] == ["farm.prom"]
@@ -0,0 +1,37 @@
+import os
+
+import pytest
+from mysql.connector import Error
+
+import benchmark
+import database
+import query_budgets
+import synthetic
+
+# Loads the budget farm into a scratch database once, then renders every budgeted page against it.
+# Needs a MySQL server reachable with the FARM_DB_* settings; skipped without one.
+BUDGET_DATABASE = os.environ.get("FARM_BUDGET_DATABASE", "farm_budget")
+
+
+@pytest.fixture(scope="module")
+def farm():
+    try:
+        database.open_connection(database=None).close()
+    except Error as e:
+        pytest.skip(f"MySQL is not reachable: {e}")
+    previous = database.DB_CONFIG['database']
+    benchmark.use_database(BUDGET_DATABASE)
+    farm = synthetic.SyntheticFarm(herd_size=query_budgets.HERD_SIZE, years=query_budgets.YEARS,
+                                   seed=query_budgets.SEED)
+    try:
+        benchmark.load_farm(farm)
+        yield farm
+    finally:
+        database.DB_CONFIG['database'] = previous
+
+
+@pytest.mark.parametrize("budget", query_budgets.BUDGETS, ids=lambda budget: budget.name)
+def test_page_stays_within_budget(budget, farm):
+    run = query_budgets.measure(budget, farm)
+    assert run['queries'] <= budget.max_queries, f"{run['queries']} statements > budget {budget.max_queries}"
+    assert run['bytes'] <= budget.max_bytes, f"{run['bytes']:,} bytes > budget {budget.max_bytes:,}"
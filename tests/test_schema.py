@@ -0,0 +1,76 @@
+import os
+
+import pytest
+from mysql.connector import Error, IntegrityError
+
+import benchmark
+import database
+
+# Builds the two tables with keys as they were before multi-farm support in a scratch database,
+# then lets init_database migrate them. Needs a MySQL server reachable with the FARM_DB_* settings.
+MIGRATION_DATABASE = os.environ.get("FARM_MIGRATION_DATABASE", "farm_migration")
+
+
+@pytest.fixture
+def pre_farm_schema():
+    try:
+        connection = database.open_connection(database=None)
+    except Error as e:
+        pytest.skip(f"MySQL is not reachable: {e}")
+    previous = database.DB_CONFIG['database']
+    benchmark.use_database(MIGRATION_DATABASE)
+    cursor = connection.cursor()
+    try:
+        cursor.execute(f"DROP DATABASE IF EXISTS `{MIGRATION_DATABASE}`")
+        cursor.execute(f"CREATE DATABASE `{MIGRATION_DATABASE}`")
+        cursor.execute(f"USE `{MIGRATION_DATABASE}`")
+        cursor.execute("""
+            CREATE TABLE Animal_Category (
+                category_id INT AUTO_INCREMENT PRIMARY KEY,
+                name VARCHAR(100) UNIQUE,
+                description TEXT,
+                image LONGBLOB
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE Animal (
+                animal_id INT AUTO_INCREMENT PRIMARY KEY,
+                tag_number VARCHAR(50) UNIQUE,
+                category_id INT,
+                breed VARCHAR(100),
+                arrival_date DATE,
+                initial_weight_kg FLOAT,
+                image LONGBLOB,
+                FOREIGN KEY (category_id) REFERENCES Animal_Category(category_id)
+            )
+        """)
+        cursor.execute("INSERT INTO Animal_Category (name) VALUES ('Cattle')")
+        cursor.execute("INSERT INTO Animal (tag_number, category_id) VALUES ('A1', %s)", (cursor.lastrowid,))
+        connection.commit()
+        yield
+    finally:
+        database.DB_CONFIG['database'] = previous
+        cursor.close()
+        connection.close()
+
+
+def test_keys_become_unique_per_farm(pre_farm_schema):
+    assert database.init_database()
+    # A second run finds the migrated keys and leaves them alone
+    assert database.init_database()
+    connection = database.open_connection()
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT farm_id FROM Animal WHERE tag_number = 'A1'")
+        assert cursor.fetchall() == [(1,)]
+        cursor.execute("INSERT INTO Animal_Category (farm_id, name) VALUES (2, 'Cattle')")
+        cursor.execute("INSERT INTO Animal (farm_id, tag_number, category_id) VALUES (2, 'A1', %s)",
+                       (cursor.lastrowid,))
+        with pytest.raises(IntegrityError):
+            cursor.execute("INSERT INTO Animal (farm_id, tag_number) VALUES (1, 'A1')")
+        with pytest.raises(IntegrityError):
+            cursor.execute("INSERT INTO Animal_Category (farm_id, name) VALUES (2, 'Cattle')")
+        connection.rollback()
+    finally:
+        cursor.close()
+        connection.close()
@@ -0,0 +1,113 @@
+from datetime import date
+
+import pytest
+from mysql.connector.errors import IntegrityError, InterfaceError
+
+import farms
+import write_queue
+
+
+class RejectingConnection:
+    # Accepts weights and rejects every feed record, as a database with a broken Feed_Record would
+    def cursor(self):
+        return self
+
+    def executemany(self, sql, params):
+        if sql.startswith("INSERT INTO Feed_Record"):
+            raise IntegrityError(msg="feed rejected")
+
+    def execute(self, sql, params):
+        self.executemany(sql, [params])
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(write_queue, "QUEUE_PATH", str(tmp_path / "queue.sqlite3"))
+    monkeypatch.setattr(write_queue, "_schema_ready", False)
+
+
+def test_status_tells_waiting_rejected_and_written_records_apart():
+    weight = write_queue.enqueue("Monthly_Weight", {'animal_id': 1, 'month': date(2025, 3, 1), 'weight_kg': 410.0},
+                                 farms.DEFAULT_FARM)
+    feed = write_queue.enqueue("Feed_Record", {'animal_id': 1, 'date': date(2025, 3, 2), 'feed_type': "Hay",
+                                               'quantity_kg': 8.0, 'cost': 12.5}, farms.DEFAULT_FARM)
+    assert write_queue.status([weight, feed]) == {weight: (0, None), feed: (0, None)}
+
+    assert write_queue.flush_batch(RejectingConnection(), [farms.DEFAULT_FARM]) == (2, 1)
+    assert write_queue.status([weight, feed]) == {feed: (1, "feed rejected")}
+
+    for _ in range(write_queue.MAX_ATTEMPTS - 1):
+        write_queue.flush_batch(RejectingConnection(), [farms.DEFAULT_FARM])
+    assert write_queue.status([weight, feed]) == {feed: (write_queue.MAX_ATTEMPTS, "feed rejected")}
+    assert write_queue.backlog() == (0, 1)
+
+
+def test_status_of_no_keys_is_empty():
+    assert write_queue.status([]) == {}
+
+
+def test_pending_for_counts_waiting_and_parked_records_of_the_animals():
+    for animal_id in (1, 1, 2):
+        write_queue.enqueue("Monthly_Weight", {'animal_id': animal_id, 'month': date(2025, 3, 1), 'weight_kg': 400.0},
+                            farms.DEFAULT_FARM)
+    write_queue.enqueue("Feed_Record", {'animal_id': 1, 'date': date(2025, 3, 2), 'feed_type': "Hay",
+                                        'quantity_kg': 8.0, 'cost': 12.5}, farms.DEFAULT_FARM)
+    for _ in range(write_queue.MAX_ATTEMPTS):
+        write_queue.flush_batch(RejectingConnection(), [farms.DEFAULT_FARM])
+
+    assert write_queue.pending_for(farms.DEFAULT_FARM, [1]) == 1
+    assert write_queue.pending_for(farms.DEFAULT_FARM, [3]) == 0
+    assert write_queue.pending_for(farms.DEFAULT_FARM + 1, [1]) == 0
+
+
+class Recorder(RejectingConnection):
+    def __init__(self):
+        self.inserted = []
+
+    def executemany(self, sql, params):
+        self.inserted.extend(params)
+
+
+def test_save_inserts_directly_while_mysql_answers():
+    connection = Recorder()
+    key, queued = write_queue.save(lambda: connection, "Monthly_Weight",
+                                   {'animal_id': 1, 'month': date(2025, 3, 1), 'weight_kg': 410.0}, farms.DEFAULT_FARM)
+    assert not queued
+    assert connection.inserted == [(1, date(2025, 3, 1), 410.0, farms.DEFAULT_FARM, key)]
+    assert write_queue.backlog() == (0, 0)
+
+
+def test_save_journals_the_record_when_mysql_is_unreachable():
+    def unreachable():
+        raise InterfaceError(msg="Can't connect to MySQL server")
+
+    key, queued = write_queue.save(unreachable, "Monthly_Weight",
+                                   {'animal_id': 1, 'month': date(2025, 3, 1), 'weight_kg': 410.0}, farms.DEFAULT_FARM)
+    assert queued
+    assert write_queue.status([key]) == {key: (0, None)}
+
+
+def test_save_raises_when_the_database_rejects_the_record():
+    with pytest.raises(IntegrityError):
+        write_queue.save(RejectingConnection, "Feed_Record", {'animal_id': 1, 'date': date(2025, 3, 2),
+                         'feed_type': "Hay", 'quantity_kg': 8.0, 'cost': 12.5}, farms.DEFAULT_FARM)
+    assert write_queue.backlog() == (0, 0)
+
+
+def test_flush_parks_records_of_farms_not_in_the_registry():
+    unknown_farm = max(farms.FARMS) + 1
+    key = write_queue.enqueue("Monthly_Weight", {'animal_id': 1, 'month': date(2025, 3, 1), 'weight_kg': 410.0},
+                              unknown_farm)
+
+    assert write_queue.flush(lambda shard: RejectingConnection()) == 0
+    assert write_queue.status([key]) == {key: (write_queue.MAX_ATTEMPTS, "farm not in registry")}
+    assert write_queue.backlog() == (0, 1)
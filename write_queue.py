@@ -0,0 +1,341 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime
+
+from mysql.connector import Error
+from mysql.connector.errors import InterfaceError, OperationalError
+
+import farms
+
+# Durable local journal for barn-side data entry. Weight, feed and medicine inserts go straight to
+# MySQL while it answers within DIRECT_TIMEOUT; when it is down or slow they are written here and
+# acknowledged at once, and a background thread copies them to MySQL in batched transactions.
+# Each row carries an idempotency key, so a batch that is retried after a dropped connection never
+# inserts the same record twice. Records are synced to their farm's shard.
+QUEUE_PATH = os.environ.get("FARM_WRITE_QUEUE", "write_queue.sqlite3")
+BATCH_SIZE = int(os.environ.get("FARM_WRITE_BATCH", "200"))
+FLUSH_INTERVAL = float(os.environ.get("FARM_WRITE_FLUSH_INTERVAL", "5"))
+# Seconds a direct insert may take to connect or answer before the record is journaled instead
+DIRECT_TIMEOUT = int(os.environ.get("FARM_WRITE_DIRECT_TIMEOUT", "3"))
+# Longest wait between sync attempts after unexpected failures
+MAX_FLUSH_BACKOFF = 300
+# A record is parked after this many rejections by the database and needs attention
+MAX_ATTEMPTS = 5
+
+# Tables that accept queued inserts, and their columns
+WRITES = {
+    "Monthly_Weight": ("animal_id", "month", "weight_kg"),
+    "Feed_Record": ("animal_id", "date", "feed_type", "quantity_kg", "cost"),
+    "Medicine_Record": ("animal_id", "date", "medicine_name", "quantity", "cost", "remarks"),
+}
+
+logger = logging.getLogger("farm.write_queue")
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+_wake = threading.Event()
+# farm_id -> animal options last written to the cache
+_animal_labels = {}
+
+
+def _journal():
+    global _schema_ready
+    journal = sqlite3.connect(QUEUE_PATH, timeout=30, isolation_level=None)
+    journal.execute("PRAGMA synchronous = FULL")
+    with _schema_lock:
+        if not _schema_ready:
+            journal.execute("PRAGMA journal_mode = WAL")
+            journal.execute("""
+                CREATE TABLE IF NOT EXISTS pending_writes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL UNIQUE,
+                    farm_id INTEGER NOT NULL DEFAULT 1,
+                    table_name TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    last_error TEXT
+                )
+            """)
+            # Journals from before multi-farm support hold farm 1's records and a single animal list
+            columns = [row[1] for row in journal.execute("PRAGMA table_info(pending_writes)")]
+            if "farm_id" not in columns:
+                journal.execute("ALTER TABLE pending_writes ADD COLUMN farm_id INTEGER NOT NULL DEFAULT 1")
+            columns = [row[1] for row in journal.execute("PRAGMA table_info(animal_cache)")]
+            if columns and "farm_id" not in columns:
+                journal.execute("DROP TABLE animal_cache")
+            journal.execute("""
+                CREATE TABLE IF NOT EXISTS animal_cache (
+                    farm_id INTEGER NOT NULL,
+                    label TEXT NOT NULL,
+                    animal_id INTEGER NOT NULL,
+                    PRIMARY KEY (farm_id, label)
+                )
+            """)
+            _schema_ready = True
+    return journal
+
+
+def _encode(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+# Journal an insert for a farm and wake the flusher; returns the record's idempotency key
+def enqueue(table, values, farm_id, key=None):
+    if table not in WRITES:
+        raise ValueError(f"{table} does not accept queued writes")
+    key = key or uuid.uuid4().hex
+    payload = json.dumps({column: _encode(values[column]) for column in WRITES[table]})
+    journal = _journal()
+    try:
+        journal.execute("INSERT INTO pending_writes (idempotency_key, farm_id, table_name, payload, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)", (key, farm_id, table, payload, time.time()))
+    finally:
+        journal.close()
+    _wake.set()
+    return key
+
+
+# (records waiting to sync, records parked after repeated rejections)
+def backlog():
+    journal = _journal()
+    try:
+        return journal.execute("""
+            SELECT COALESCE(SUM(attempts < ?), 0), COALESCE(SUM(attempts >= ?), 0) FROM pending_writes
+        """, (MAX_ATTEMPTS, MAX_ATTEMPTS)).fetchone()
+    finally:
+        journal.close()
+
+
+# Give parked records another round, e.g. after a schema fix
+def requeue_parked():
+    journal = _journal()
+    try:
+        journal.execute("UPDATE pending_writes SET attempts = 0 WHERE attempts >= ?", (MAX_ATTEMPTS,))
+    finally:
+        journal.close()
+    _wake.set()
+
+
+# Journal state of the given records that have not reached MySQL yet, as
+# {key: (attempts, last error)}; written records are gone from the journal and left out
+def status(keys):
+    if not keys:
+        return {}
+    journal = _journal()
+    try:
+        return {key: (attempts, error) for key, attempts, error in journal.execute(
+            f"SELECT idempotency_key, attempts, last_error FROM pending_writes "
+            f"WHERE idempotency_key IN ({', '.join('?' * len(keys))})", tuple(keys))}
+    finally:
+        journal.close()
+
+
+# Records of a farm still in the journal, parked ones included, counted by animal
+def queued_animals(farm_id):
+    journal = _journal()
+    try:
+        return Counter(json.loads(payload)["animal_id"] for payload, in journal.execute(
+            "SELECT payload FROM pending_writes WHERE farm_id = ?", (farm_id,)))
+    finally:
+        journal.close()
+
+
+# Records of a farm's animals still in the journal, parked ones included
+def pending_for(farm_id, animal_ids):
+    queued = queued_animals(farm_id)
+    return sum(queued[animal_id] for animal_id in set(animal_ids))
+
+
+# Keep each farm's last known animal list so the entry forms still work while MySQL is unreachable
+def remember_animals(animal_options, farm_id):
+    if animal_options == _animal_labels.get(farm_id):
+        return
+    journal = _journal()
+    try:
+        journal.execute("BEGIN")
+        journal.execute("DELETE FROM animal_cache WHERE farm_id = ?", (farm_id,))
+        journal.executemany("INSERT INTO animal_cache (farm_id, label, animal_id) VALUES (?, ?, ?)",
+                            [(farm_id, label, animal_id) for label, animal_id in animal_options.items()])
+        journal.execute("COMMIT")
+    finally:
+        journal.close()
+    _animal_labels[farm_id] = dict(animal_options)
+
+
+def cached_animals(farm_id):
+    journal = _journal()
+    try:
+        return dict(journal.execute("SELECT label, animal_id FROM animal_cache WHERE farm_id = ? ORDER BY label",
+                                    (farm_id,)).fetchall())
+    finally:
+        journal.close()
+
+
+def _insert_sql(table):
+    columns = WRITES[table] + ("farm_id", "idempotency_key")
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON DUPLICATE KEY UPDATE idempotency_key = idempotency_key")
+
+
+def _params(table, farm_id, payload, key):
+    values = json.loads(payload)
+    return tuple(values[column] for column in WRITES[table]) + (farm_id, key)
+
+
+# Insert a record for a farm through connect(), journaling it instead when MySQL cannot be reached
+# or times out; returns (idempotency key, True if journaled). Both paths use the same key, so a
+# direct insert that committed before its reply was lost is not written again by the flusher.
+# Records the database rejects raise Error as usual.
+def save(connect, table, values, farm_id):
+    if table not in WRITES:
+        raise ValueError(f"{table} does not accept queued writes")
+    key = uuid.uuid4().hex
+    try:
+        connection = connect()
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute(_insert_sql(table), tuple(values[column] for column in WRITES[table]) + (farm_id, key))
+                connection.commit()
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+    except (InterfaceError, OperationalError) as e:
+        logger.info("MySQL unavailable, journaling %s record %s: %s", table, key, e)
+        return enqueue(table, values, farm_id, key), True
+    return key, False
+
+
+# Copy one batch of the given farms' journaled records to their shard; returns (records read,
+# records written). Connection errors propagate so the caller can retry later; records the
+# database rejects are retried one by one and parked after MAX_ATTEMPTS.
+def flush_batch(connection, farm_ids, batch_size=BATCH_SIZE):
+    journal = _journal()
+    try:
+        rows = journal.execute(f"""
+            SELECT id, idempotency_key, farm_id, table_name, payload FROM pending_writes
+            WHERE attempts < ? AND farm_id IN ({', '.join('?' * len(farm_ids))}) ORDER BY id LIMIT ?
+        """, (MAX_ATTEMPTS, *farm_ids, batch_size)).fetchall()
+        if not rows:
+            return 0, 0
+
+        cursor = connection.cursor()
+        try:
+            try:
+                for table in WRITES:
+                    params = [_params(table, farm_id, payload, key)
+                              for _, key, farm_id, name, payload in rows if name == table]
+                    if params:
+                        cursor.executemany(_insert_sql(table), params)
+                connection.commit()
+                written = [row[0] for row in rows]
+            except (InterfaceError, OperationalError):
+                raise
+            except Error:
+                connection.rollback()
+                written = []
+                for row_id, key, farm_id, table, payload in rows:
+                    try:
+                        cursor.execute(_insert_sql(table), _params(table, farm_id, payload, key))
+                        connection.commit()
+                        written.append(row_id)
+                    except (InterfaceError, OperationalError):
+                        raise
+                    except Error as e:
+                        connection.rollback()
+                        journal.execute("UPDATE pending_writes SET attempts = attempts + 1, last_error = ? "
+                                        "WHERE id = ?", (str(e), row_id))
+                        logger.warning("MySQL rejected queued %s record %s: %s", table, key, e)
+        finally:
+            cursor.close()
+
+        journal.executemany("DELETE FROM pending_writes WHERE id = ?", [(row_id,) for row_id in written])
+    finally:
+        journal.close()
+    return len(rows), len(written)
+
+
+def _queued_farms():
+    journal = _journal()
+    try:
+        return [row[0] for row in journal.execute("SELECT DISTINCT farm_id FROM pending_writes WHERE attempts < ?",
+                                                  (MAX_ATTEMPTS,))]
+    finally:
+        journal.close()
+
+
+# Flush one shard until its records are synced or one is rejected; returns records written
+def _flush_shard(connection, farm_ids):
+    total = 0
+    try:
+        while True:
+            read, written = flush_batch(connection, farm_ids)
+            total += written
+            if read == 0 or written < read:
+                return total
+    finally:
+        connection.close()
+
+
+# Park the records of farms no longer in the registry, which have no shard to sync to
+def _park_unknown_farms(farm_ids):
+    unknown = [farm_id for farm_id in farm_ids if farm_id not in farms.FARMS]
+    if not unknown:
+        return
+    journal = _journal()
+    try:
+        parked = journal.execute(f"""
+            UPDATE pending_writes SET attempts = ?, last_error = 'farm not in registry'
+            WHERE attempts < ? AND farm_id IN ({', '.join('?' * len(unknown))})
+        """, (MAX_ATTEMPTS, MAX_ATTEMPTS, *unknown)).rowcount
+    finally:
+        journal.close()
+    logger.warning("Parked %d queued records of farms not in the registry: %s", parked, unknown)
+
+
+# Flush every shard with queued records; returns records written. connect(shard) opens a
+# connection to a shard; a shard that is unreachable keeps its records without holding up the rest.
+def flush(connect):
+    queued = _queued_farms()
+    _park_unknown_farms(queued)
+    total = 0
+    for shard, farm_ids in farms.by_shard(queued).items():
+        try:
+            total += _flush_shard(connect(shard), farm_ids)
+        except Error as e:
+            logger.info("Shard %s unavailable, its records stay queued: %s", shard, e)
+    return total
+
+
+def _run_flusher(connect, interval):
+    delay = interval
+    while True:
+        _wake.wait(delay)
+        _wake.clear()
+        try:
+            written = flush(connect) if backlog()[0] else 0
+        except Exception:
+            # A broken journal or payload must not stop the thread; back off and try again
+            delay = min(delay * 2, MAX_FLUSH_BACKOFF)
+            logger.exception("Syncing the write queue failed, retrying in %.0fs", delay)
+            continue
+        delay = interval
+        if written:
+            logger.info("Synced %d queued records", written)
+
+
+# Background thread that syncs the journal whenever records arrive and every interval seconds
+def start_flusher(connect, interval=FLUSH_INTERVAL):
+    thread = threading.Thread(target=_run_flusher, args=(connect, interval), name="write-queue", daemon=True)
+    thread.start()
+    return thread